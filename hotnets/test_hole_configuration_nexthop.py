@@ -109,7 +109,7 @@ def setup_logging():
     logger.addHandler(ch)
 
 
-def test_bgp_example(output_dir):
+def test_bgp_example(output_dir, netcomplete_config=None):
     # Generate the basic network of three routers
     # generate a full mesh topology, mesh_size = 3, asnum = 100
     graph = gen_mesh(3, 100)
@@ -515,7 +515,8 @@ def test_bgp_example(output_dir):
     ############################### NetComplete ###################################
 
     external_anns = [ann1, ann2, ann3]
-    netcomplete = NetComplete(reqs=reqs, topo=graph, external_announcements=external_anns)
+    netcomplete = NetComplete(reqs=reqs, topo=graph, external_announcements=external_anns,
+                              netcomplete_config=netcomplete_config)
     netcomplete.synthesize()
     netcomplete.write_configs(output_dir=output_dir)
 
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+"""
+Micro benchmarks for the SMT context used by the BGP synthesis
+"""
+
+import argparse
+import imp
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+import z3
+
+from tekton.bgp import Access
+from tekton.bgp import Announcement
+from tekton.bgp import BGP_ATTRS_ORIGIN
+from tekton.bgp import MatchLocalPref
+from tekton.bgp import RouteMap
+from tekton.bgp import RouteMapLine
+from tekton.utils import VALUENOTSET
+
+from synet.netcomplete import NetCompleteConfigs
+from synet.utils.fnfree_policy import SMTRouteMap
+from synet.utils.fnfree_smt_context import AnnouncementsContext
+from synet.utils.fnfree_smt_context import BV_INFER
+from synet.utils.fnfree_smt_context import DEFAULT_BV_WIDTHS
+from synet.utils.fnfree_smt_context import RMAP_ORDER_CHAINED
+from synet.utils.fnfree_smt_context import RMAP_ORDER_PAIRWISE
+from synet.utils.fnfree_smt_context import SolverContext
+from synet.utils.fnfree_smt_context import read_announcements
+from synet.utils.tracing import SMT
+from synet.utils.tracing import WARNING
+from synet.utils.tracing import set_level
+
+
+# The encodings of the integer BGP attributes compared by bench_bv
+BV_ENCODINGS = [
+    ('int', None),
+    ('bv32', DEFAULT_BV_WIDTHS),
+    ('bv-infer', BV_INFER),
+]
+
+
+def bench_enum(sizes, num_types=3):
+    """
+    Measure the time to create enum types and to lookup their values
+    as the number of values grows
+    :param sizes: list of the number of values per enum type
+    :param num_types: number of enum types created in the same context
+    """
+    print "%10s %16s %16s %16s" % (
+        'values', 'create (s)', 'symbolic (us)', 'concrete (us)')
+    for size in sizes:
+        ctx = SolverContext(z3.Context())
+        all_values = []
+        t1 = timer()
+        for type_index in range(num_types):
+            values = ['Val%d_%d' % (type_index, i) for i in range(size)]
+            ctx.create_enum_type('BenchSort%d' % type_index, values)
+            all_values.append(values)
+        t2 = timer()
+        symbolic = []
+        for type_index, values in enumerate(all_values):
+            vsort = ctx.get_enum_type('BenchSort%d' % type_index)
+            for value in values:
+                symbolic.append((vsort, vsort.get_symbolic_value(value)))
+        t3 = timer()
+        for vsort, var in symbolic:
+            vsort.get_concrete_value(var)
+        t4 = timer()
+        lookups = float(len(symbolic))
+        print "%10d %16f %16f %16f" % (
+            size, t2 - t1, (t3 - t2) / lookups * 1e6, (t4 - t3) / lookups * 1e6)
+
+
+def bench_vars(count, enum_size=50):
+    """
+    Measure the memory used by creating variables, half of them ints
+    (a quarter concrete) and half of them enums
+    :param count: number of variables
+    :param enum_size: number of values of the enum type
+    """
+    ctx = SolverContext(z3.Context())
+    vsort = ctx.create_enum_type(
+        'BenchSort', ['Val%d' % i for i in range(enum_size)])
+    int_sort = z3.IntSort(ctx=ctx.z3_ctx)
+    variables = []
+    # create_fresh_var prints every var name
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        t1 = timer()
+        for index in range(count):
+            if index % 2:
+                var = ctx.create_fresh_var(vsort, name_prefix='BenchEnum_')
+            else:
+                value = index if index % 4 == 0 else None
+                var = ctx.create_fresh_var(
+                    int_sort, name_prefix='BenchInt_', value=value)
+            variables.append(var)
+        t2 = timer()
+        rss2 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Hash every var once
+        set(variables)
+        t3 = timer()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    # ru_maxrss is in KB on linux
+    rss = (rss2 - rss1) * 1024.0
+    print "Number of variables: %d" % count
+    print "Create time (s): %f" % (t2 - t1)
+    print "Hash time (s): %f" % (t3 - t2)
+    print "Max RSS increase (MB): %.1f" % (rss / (1024 * 1024))
+    print "Max RSS increase per var (bytes): %.0f" % (rss / count)
+    for key, value in ctx.memory_report().iteritems():
+        print "%s: %d" % (key, value)
+
+
+def _run_scenario(module, bv_widths):
+    """
+    Run the test_bgp_example of a hotnets scenario
+    :return: the BGP SolveMetrics dict, the error if the synthesis failed
+    """
+    metrics_fd, metrics_file = tempfile.mkstemp(suffix='.json')
+    os.close(metrics_fd)
+    output_dir = tempfile.mkdtemp()
+    configs = NetCompleteConfigs(bgp_metrics=metrics_file,
+                                 bgp_bv_widths=bv_widths)
+    error = None
+    # The scenarios print the sketch and the synthesized configs
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        module.test_bgp_example(output_dir, netcomplete_config=configs)
+    except Exception as exp:
+        # The BGP metrics are written before the later stages fail
+        error = "%s: %s" % (type(exp).__name__, exp)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(output_dir, ignore_errors=True)
+    with open(metrics_file) as inf:
+        lines = inf.read().splitlines()
+    os.remove(metrics_file)
+    metrics = json.loads(lines[-1]) if lines else None
+    return metrics, error
+
+
+def bench_bv(scenarios, repeat=1):
+    """
+    Compare the time to solve the BGP formula of the hotnets scenarios
+    when local_pref, med, as_path_len and the router IDs are ints and
+    when they're bit-vectors
+    :param scenarios: paths of scripts with test_bgp_example(output_dir,
+                      netcomplete_config), e.g., hotnets/test_hotnets.py
+    :param repeat: number of runs per scenario and encoding
+    """
+    print "%-40s %10s %8s %16s %16s" % (
+        'scenario', 'encoding', 'result', 'z3_check (s)', 'total (s)')
+    for path in scenarios:
+        name = os.path.splitext(os.path.basename(path))[0]
+        module = imp.load_source('bench_%s' % name, path)
+        for encoding, bv_widths in BV_ENCODINGS:
+            checks = []
+            totals = []
+            result = None
+            for _ in range(repeat):
+                metrics, error = _run_scenario(module, bv_widths)
+                if metrics is None:
+                    result = 'error'
+                    sys.stderr.write("%s %s: %s\n" % (name, encoding, error))
+                    break
+                result = metrics['result']
+                checks.append(metrics['timings'].get('z3_check', 0))
+                totals.append(metrics['total_time'])
+            if not checks:
+                print "%-40s %10s %8s %16s %16s" % (
+                    name, encoding, result, '-', '-')
+                continue
+            print "%-40s %10s %8s %16f %16f" % (
+                name, encoding, result, sum(checks) / len(checks),
+                sum(totals) / len(totals))
+
+
+def _bench_route_map(num_lines, num_anns, rmap_order):
+    """
+    Encode and solve a route map where the even lines match a concrete
+    local pref and the odd lines match a hole
+    :return: (number of constraints, size of the SMT-LIB formula,
+              encode time, check time, result)
+    """
+    anns = []
+    for index in range(num_anns):
+        anns.append(Announcement(
+            prefix='Prefix_%d' % index, peer='Peer1',
+            origin=BGP_ATTRS_ORIGIN.EBGP, as_path=[100], as_path_len=1,
+            next_hop='NextHop1', local_pref=100 + index % num_lines,
+            med=10, communities={}, permitted=True))
+    lines = []
+    for lineno in range(1, num_lines + 1):
+        value = 100 + lineno - 1 if lineno % 2 else VALUENOTSET
+        lines.append(RouteMapLine(matches=[MatchLocalPref(value)],
+                                  actions=None, access=Access.permit,
+                                  lineno=lineno))
+    rmap = RouteMap(name='BenchMap', lines=lines)
+    ctx = SolverContext.create_context(anns, rmap_order=rmap_order)
+    smt_anns = AnnouncementsContext(read_announcements(anns, ctx))
+    t1 = timer()
+    SMTRouteMap(rmap, smt_anns, ctx)
+    t2 = timer()
+    num_constraints = len(list(ctx.constraints_itr()))
+    size = len(ctx.to_smt2())
+    solver = ctx.create_solver()
+    t3 = timer()
+    result = ctx.check(solver, track=False)
+    t4 = timer()
+    return num_constraints, size, t2 - t1, t4 - t3, str(result)
+
+
+def bench_rmap(num_lines, num_anns):
+    """
+    Compare the pairwise and the chained encodings of the first-match
+    order of the route map lines as the route map grows
+    :param num_lines: list of the number of lines
+    :param num_anns: list of the number of announcements
+    """
+    # The check traces the stats of the formula
+    set_level(SMT, WARNING)
+    print "%6s %6s %10s %12s %12s %12s %12s %8s" % (
+        'lines', 'anns', 'encoding', 'constraints', 'smt2 (KB)',
+        'encode (s)', 'check (s)', 'result')
+    for lines in num_lines:
+        for anns in num_anns:
+            results = set()
+            for rmap_order in [RMAP_ORDER_PAIRWISE, RMAP_ORDER_CHAINED]:
+                num_constraints, size, encode, check, result = \
+                    _bench_route_map(lines, anns, rmap_order)
+                results.add(result)
+                print "%6d %6d %10s %12d %12.1f %12f %12f %8s" % (
+                    lines, anns, rmap_order, num_constraints, size / 1024.0,
+                    encode, check, result)
+            if len(results) > 1:
+                sys.stderr.write("The encodings disagree for %d lines and "
+                                 "%d announcements: %s\n" % (
+                                     lines, anns, sorted(results)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Micro benchmarks for the SMT context.')
+    subparsers = parser.add_subparsers(dest='bench')
+    enum_parser = subparsers.add_parser(
+        'enum', help='enum type creation and value lookups')
+    enum_parser.add_argument(
+        '--sizes', type=int, nargs='+',
+        default=[100, 1000, 5000, 10000, 20000],
+        help='number of values per enum type')
+    enum_parser.add_argument(
+        '--types', type=int, default=3,
+        help='number of enum types in the same context')
+    vars_parser = subparsers.add_parser(
+        'vars', help='memory used by the variables')
+    vars_parser.add_argument(
+        '--count', type=int, default=200000,
+        help='number of variables')
+    bv_parser = subparsers.add_parser(
+        'bv', help='int vs bit-vector encoding of the BGP attributes')
+    bv_parser.add_argument(
+        'scenarios', nargs='+',
+        help='hotnets scenario scripts, e.g., hotnets/test_*.py')
+    bv_parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='number of runs per scenario and encoding')
+    rmap_parser = subparsers.add_parser(
+        'rmap', help='pairwise vs chained route map line order encoding')
+    rmap_parser.add_argument(
+        '--lines', type=int, nargs='+', default=[5, 10, 20, 50],
+        help='number of route map lines')
+    rmap_parser.add_argument(
+        '--anns', type=int, nargs='+', default=[10, 100, 300],
+        help='number of announcements')
+    args = parser.parse_args()
+    if args.bench == 'enum':
+        bench_enum(args.sizes, args.types)
+    elif args.bench == 'vars':
+        bench_vars(args.count)
+    elif args.bench == 'bv':
+        bench_bv(args.scenarios, args.repeat)
+    elif args.bench == 'rmap':
+        bench_rmap(args.lines, args.anns)
+
+
+if __name__ == '__main__':
+    main()
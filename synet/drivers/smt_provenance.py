@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+Query the provenance index recorded with NetCompleteConfigs(bgp_provenance=)
+e.g., which constraints mention SelectOne_index_88:
+    python -m synet.drivers.smt_provenance prov.db mentions SelectOne_index_88
+"""
+
+import argparse
+import os
+import sys
+
+from synet.utils.smt_provenance import PROVENANCE_FIELDS
+from synet.utils.smt_provenance import ProvenanceIndex
+
+
+def print_rows(rows):
+    """Print one row per line, skipping the empty fields"""
+    for row in rows:
+        fields = ['%s=%s' % (key, row[key])
+                  for key in ('sort', 'folded') + PROVENANCE_FIELDS + ('info',)
+                  if row.get(key) is not None]
+        print "%s %s" % (row['name'], ' '.join(fields))
+    print "(%d rows)" % len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Query where SMT variables and constraints come from.')
+    parser.add_argument('db', help='the provenance SQLite file')
+    subparsers = parser.add_subparsers(dest='query')
+    mentions_parser = subparsers.add_parser(
+        'mentions', help='the constraints that mention a variable')
+    mentions_parser.add_argument('var', help='variable name')
+    vars_parser = subparsers.add_parser(
+        'vars', help='the variables mentioned by a constraint')
+    vars_parser.add_argument('constraint', help='constraint name')
+    show_parser = subparsers.add_parser(
+        'show', help='the provenance of variables or constraints, '
+                     'e.g., the names in an unsat core')
+    show_parser.add_argument('names', nargs='+')
+    find_parser = subparsers.add_parser(
+        'find', help='the constraints (or vars) created at a router, '
+                     'route map, or line')
+    find_parser.add_argument('--router')
+    find_parser.add_argument('--route-map')
+    find_parser.add_argument('--line', type=int)
+    find_parser.add_argument('--requirement')
+    find_parser.add_argument('--vars', action='store_true',
+                             help='find variables instead of constraints')
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        parser.error("Provenance file '%s' doesn't exist" % args.db)
+    index = ProvenanceIndex(args.db)
+    if args.query == 'mentions':
+        print_rows(index.constraints_mentioning(args.var))
+    elif args.query == 'vars':
+        print_rows(index.vars_of(args.constraint))
+    elif args.query == 'show':
+        rows = []
+        for name in args.names:
+            row = index.get_constraint(name) or index.get_var(name)
+            if row is None:
+                sys.stderr.write("'%s' is not recorded\n" % name)
+            else:
+                rows.append(row)
+        print_rows(rows)
+    elif args.query == 'find':
+        print_rows(index.find(router=args.router, route_map=args.route_map,
+                              line=args.line, requirement=args.requirement,
+                              kind='vars' if args.vars else 'constraints'))
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
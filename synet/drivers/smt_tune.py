@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""
+Tune the z3 tactic and parameters over a corpus of formulas dumped with
+SolverContext.check(out_smt=...) (the bgp_smt config of NetComplete) or
+SynthesisComponent.out_smt (ospf_smt) and write the best configuration per
+class of problems. Point SYNET_TUNING at the output to use it, e.g.:
+    python -m synet.drivers.smt_tune corpus/bgp/*.smt2 --out tuning.json
+    python -m synet.drivers.smt_tune corpus/ospf/*.smt2 --kind ospf \
+        --out tuning.json
+    SYNET_TUNING=tuning.json python ...
+"""
+
+import argparse
+import os
+import sys
+
+from synet.utils.smt_tuning import KIND_BGP
+from synet.utils.smt_tuning import KIND_OSPF
+from synet.utils.smt_tuning import Tuning
+from synet.utils.smt_tuning import read_formula
+from synet.utils.smt_tuning import tune
+
+
+def log(msg):
+    sys.stderr.write(msg + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Tune the z3 configuration over a corpus of formulas.')
+    parser.add_argument('formulas', nargs='+',
+                        help='SMT-LIB files (optionally gzipped)')
+    parser.add_argument('--kind', choices=[KIND_BGP, KIND_OSPF],
+                        default=KIND_BGP, help='the kind of the formulas')
+    parser.add_argument('--strategy', choices=['grid', 'random'],
+                        default='grid', help='how to search the configs')
+    parser.add_argument('--samples', type=int, default=20,
+                        help='number of configs tried by random search')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random search')
+    parser.add_argument('--timeout', type=int, default=60000,
+                        help='z3 timeout per formula in ms')
+    parser.add_argument('--out', required=True,
+                        help='the tuning file, the classes of this kind '
+                             'are updated if it exists')
+    args = parser.parse_args()
+    formulas = [(os.path.basename(path), read_formula(path))
+                for path in args.formulas]
+    tuning = tune(formulas, args.kind, strategy=args.strategy,
+                  num_samples=args.samples, timeout=args.timeout,
+                  seed=args.seed, log=log)
+    if os.path.exists(args.out):
+        # Keep the classes of the other kind
+        merged = Tuning.load(args.out)
+        merged.classes.update(tuning.classes)
+        tuning = merged
+    tuning.save(args.out)
+    for name, entry in sorted(tuning.classes.iteritems()):
+        print "%s: %s" % (name, entry)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,26 +5,52 @@
 import logging
 import random
 from collections import Iterable
+from timeit import default_timer as timer
 
 from ipaddress import IPv4Network
 from ipaddress import IPv6Network
 import z3
 
 from synet.synthesis.connected import ConnectedSyn
+from synet.synthesis.new_bgp import DEFAULT_LOCAL_PREF
 from synet.synthesis.new_propagation import EBGPPropagation
 from synet.synthesis.ospf_heuristic import OSPFSyn as OSPFCEGIS
+from synet.synthesis.ospf_heuristic import STOP_TIMEOUT
+from synet.utils.budget import Budget
 
 from synet.utils.bgp_utils import compute_next_hop_map
 from synet.utils.bgp_utils import extract_all_next_hops
 from synet.utils.common import PathReq
 from synet.utils.common import Protocols
+from synet.utils.fnfree_smt_context import BV_ATTRS
+from synet.utils.fnfree_smt_context import BV_INFER
+from synet.utils.fnfree_smt_context import RMAP_ORDER_CHAINED
+from synet.utils.fnfree_smt_context import RMAP_ORDER_PAIRWISE
+from synet.utils.fnfree_smt_context import SOLVE_TRACKED
+from synet.utils.fnfree_smt_context import SOLVE_TWO_PHASE
 from synet.utils.fnfree_smt_context import SolverContext
-from synet.utils.fnfree_smt_context import desanitize_smt_name
-
+from synet.utils.fnfree_smt_context import infer_bv_widths
+from synet.utils.smt_cache import ModelCache
+from synet.utils.smt_cache import read_model_values
+from synet.utils.smt_provenance import ProvenanceIndex
+from synet.utils.smt_snapshot import FormulaSnapshot
+from synet.utils.smt_threads import GLOBAL_CONTEXT_LOCK
+from synet.utils.smt_threads import run_concurrently
+from synet.utils.tracing import NETCOMPLETE
+from synet.utils.tracing import get_tracer
+
+from tekton.bgp import ActionSetASPathLen
+from tekton.bgp import ActionSetLocalPref
+from tekton.bgp import ActionSetMED
+from tekton.bgp import MatchAsPathLen
+from tekton.bgp import MatchLocalPref
+from tekton.bgp import MatchMED
 from tekton.gns3 import GNS3Topo
 from tekton.graph import NetworkGraph
 from tekton.utils import is_empty
 
+_tracer = get_tracer(NETCOMPLETE)
+
 
 def setup_logging():
     # create logger
@@ -46,8 +72,15 @@ def setup_logging():
 
 
 class UnImplementableRequirements(Exception):
-    def __init__(self, msg):
+    def __init__(self, msg, unsat_core=None, core_handle=None):
+        """
+        :param unsat_core: the raw unsat core (constraint names)
+        :param core_handle: smt_mus.CoreMinimization that resolves to the
+                            MUSes of the core, when enabled in the configs
+        """
         super(UnImplementableRequirements, self).__init__(msg)
+        self.unsat_core = unsat_core
+        self.core_handle = core_handle
 
 
 class SketchError(Exception):
@@ -60,12 +93,116 @@ class RequirementError(Exception):
         super(RequirementError, self).__init__(msg)
 
 
+# The synthesis stages
+STAGE_CONNECTED = 'connected'
+STAGE_BGP = 'bgp'
+STAGE_OSPF = 'ospf'
+
+# The status of a stage
+STATUS_COMPLETED = 'completed'
+STATUS_TIMEOUT = 'timeout'
+STATUS_ITERATIONS = 'iterations'
+STATUS_SKIPPED = 'skipped'
+
+
+class StageResult(object):
+    """The outcome of a synthesis stage"""
+
+    def __init__(self, stage, status, elapsed=None, model=None,
+                 unsatisfied_reqs=None, metrics=None, msg=None):
+        """
+        :param stage: one of the STAGE_* values
+        :param status: one of the STATUS_* values
+        :param elapsed: seconds spent in the stage
+        :param model: the best partial assignment when the stage stopped
+                      early, e.g., the OSPF costs [(src, dst, cost)] of the
+                      last CEGIS iteration. None if there is none.
+        :param unsatisfied_reqs: the requirements not satisfied by model
+        :param metrics: the SolveMetrics dict of the last check, if any
+        """
+        self.stage = stage
+        self.status = status
+        self.elapsed = elapsed
+        self.model = model
+        self.unsatisfied_reqs = unsatisfied_reqs or []
+        self.metrics = metrics
+        self.msg = msg
+
+    @property
+    def completed(self):
+        return self.status == STATUS_COMPLETED
+
+    def __repr__(self):
+        return "StageResult(%s, %s, elapsed=%s, unsatisfied_reqs=%d)" % (
+            self.stage, self.status, self.elapsed, len(self.unsatisfied_reqs))
+
+
+class SynthesisResult(object):
+    """
+    The outcome of NetComplete.synthesize(), True only if all the
+    stages completed
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    def add(self, stage_result):
+        self.stages.append(stage_result)
+        return stage_result
+
+    @property
+    def completed(self):
+        return all(stage.completed for stage in self.stages)
+
+    @property
+    def stopped_stage(self):
+        """The first stage that didn't complete, None if all did"""
+        for stage in self.stages:
+            if not stage.completed:
+                return stage
+        return None
+
+    @property
+    def elapsed(self):
+        return sum(stage.elapsed or 0 for stage in self.stages)
+
+    def __nonzero__(self):
+        return self.completed
+
+    def __repr__(self):
+        return "SynthesisResult(%s)" % self.stages
+
+
 class NetCompleteConfigs(object):
     def __init__(self,
                  auto_enable_ospf_process=False,
                  default_ospf_process_id=100,
                  auto_enable_ospf_link_costs=True,
-                 bgp_smt='smt.smt2',
+                 bgp_smt=None,
+                 lazy_bgp_model=False,
+                 bgp_solved_smt=None,
+                 bgp_metrics=None,
+                 bgp_solve_strategy=SOLVE_TWO_PHASE,
+                 bgp_tactic=None,
+                 ospf_tactic=None,
+                 ospf_smt=None,
+                 bgp_portfolio_workers=0,
+                 bgp_cache_dir=None,
+                 bgp_cache_size=256 * 1024 * 1024,
+                 bgp_provenance=None,
+                 bgp_cone_slicing=False,
+                 bgp_cube_workers=0,
+                 bgp_substitute_equalities=False,
+                 bgp_bv_widths=None,
+                 bgp_rmap_order=RMAP_ORDER_PAIRWISE,
+                 bgp_check_context=False,
+                 bgp_snapshot=None,
+                 time_budget=None,
+                 bgp_time_budget=None,
+                 ospf_time_budget=None,
+                 ospf_max_iterations=None,
+                 max_muses=0,
+                 core_timeout=None,
                  ):
         """
 
@@ -75,12 +212,112 @@ class NetCompleteConfigs(object):
         :param auto_enable_ospf_link_costs: Set symbolic link
                 costs on all links that are part of OSPF requirements, even if
                 not enabled by the sketch
-        :param bgp_smt: a filename to dump the SMT formula for BGP. To disable set to None
+        :param bgp_smt: a filename to dump the SMT formula for BGP
+                (gzipped if it ends with '.gz'). Disabled when None
+        :param lazy_bgp_model: read the values of the BGP variables from the
+                model only when they're consulted, instead of all at once
+        :param bgp_solved_smt: a filename to dump the SMT formula for BGP
+                after it's solved. Disabled when None
+        :param bgp_metrics: a filename to append the BGP solve metrics to
+                as a JSON line. Disabled when None
+        :param bgp_solve_strategy: SOLVE_TWO_PHASE to check the BGP
+                constraints without tracking first and track them only to
+                read the unsat core, or SOLVE_TRACKED to always track them
+        :param bgp_tactic: z3 tactic pipeline applied to the BGP formula
+                before solving, a preset name (e.g., 'fast-bgp'), a chain
+                of tactic names, or None for the default z3 solver
+        :param ospf_tactic: same as bgp_tactic for the OSPF formula
+                (e.g., 'ospf-lia')
+        :param ospf_smt: a filename to dump the SMT formula of the last
+                OSPF check (gzipped if it ends with '.gz'). Disabled when None
+        :param bgp_portfolio_workers: solve the BGP formula in this many
+                worker processes with different seeds and tactics, the first
+                answer wins. Disabled when 0
+        :param bgp_cache_dir: a directory to cache the solutions of the BGP
+                formula across runs. Disabled when None
+        :param bgp_cache_size: the max size in bytes of bgp_cache_dir
+        :param bgp_provenance: a SQLite filename to record where each BGP
+                variable and constraint is created, query it with
+                synet.drivers.smt_provenance. Disabled when None
+        :param bgp_cone_slicing: only solve the constraints connected to
+                the BGP requirements and holes together, the rest of the
+                BGP formula is solved separately. Not supported with
+                bgp_portfolio_workers and bgp_cube_workers
+        :param bgp_cube_workers: split the BGP formula into cubes over the
+                route map selector vars and solve them in this many worker
+                processes. Disabled when 0
+        :param bgp_substitute_equalities: replace the BGP vars that are
+                only constrained to be equal (e.g., imported attributes)
+                by a single representative before solving
+        :param bgp_bv_widths: encode local_pref, med, as_path_len and the
+                router IDs as bit-vectors instead of ints: a dict of
+                attribute -> width (e.g., DEFAULT_BV_WIDTHS), or BV_INFER
+                to infer the widths from the announcements and the sketch.
+                The values are bounded by the widths, so widths that are
+                too narrow can make the requirements unsat. Ints if None
+        :param bgp_rmap_order: how the first-match order of the route map
+                lines is encoded, RMAP_ORDER_PAIRWISE negates the matches
+                of all the previous lines, RMAP_ORDER_CHAINED chains one
+                "not matched yet" var per line and announcement (linear
+                in the number of lines, same results)
+        :param bgp_check_context: make sure the BGP constraints don't use
+                terms created in another z3 context before solving them,
+                see SolverContext.check_context and synthesize_concurrently
+        :param bgp_snapshot: a filename to save a snapshot of the encoded
+                BGP formula before solving it (gzipped if it ends with
+                '.gz'), solve it again with NetComplete.replay_bgp without
+                encoding BGP. Disabled when None
+        :param time_budget: seconds for the whole synthesis, unbounded
+                if None. A stage that runs out of time stops with its
+                partial result instead of raising, see SynthesisResult
+        :param bgp_time_budget: seconds for the BGP stage (within
+                time_budget), unbounded if None
+        :param ospf_time_budget: same as bgp_time_budget for OSPF
+        :param ospf_max_iterations: max number of OSPF CEGIS iterations,
+                unbounded if None
+        :param max_muses: when the BGP or OSPF requirements are unsat,
+                shrink the unsat core to this many minimal unsat subsets
+                in a background process, see the core_handle of
+                UnImplementableRequirements. Disabled when 0
+        :param core_timeout: seconds for each core minimization,
+                unbounded if None
         """
         self.auto_enable_ospf_process = auto_enable_ospf_process
         self.default_ospf_process_id = default_ospf_process_id
         self.auto_enable_ospf_link_costs = auto_enable_ospf_link_costs
         self.bgp_smt = bgp_smt
+        self.lazy_bgp_model = lazy_bgp_model
+        self.bgp_solved_smt = bgp_solved_smt
+        self.bgp_metrics = bgp_metrics
+        assert bgp_solve_strategy in [SOLVE_TRACKED, SOLVE_TWO_PHASE]
+        self.bgp_solve_strategy = bgp_solve_strategy
+        self.bgp_tactic = bgp_tactic
+        self.ospf_tactic = ospf_tactic
+        self.ospf_smt = ospf_smt
+        self.bgp_portfolio_workers = bgp_portfolio_workers
+        self.bgp_cache_dir = bgp_cache_dir
+        self.bgp_cache_size = bgp_cache_size
+        self.bgp_provenance = bgp_provenance
+        assert not bgp_cone_slicing or \
+            not (bgp_portfolio_workers or bgp_cube_workers), \
+            "The portfolio and the cubes solve the whole BGP formula, " \
+            "they don't support cone slicing"
+        self.bgp_cone_slicing = bgp_cone_slicing
+        self.bgp_cube_workers = bgp_cube_workers
+        self.bgp_substitute_equalities = bgp_substitute_equalities
+        assert bgp_bv_widths is None or bgp_bv_widths == BV_INFER or \
+            isinstance(bgp_bv_widths, dict)
+        self.bgp_bv_widths = bgp_bv_widths
+        assert bgp_rmap_order in [RMAP_ORDER_PAIRWISE, RMAP_ORDER_CHAINED]
+        self.bgp_rmap_order = bgp_rmap_order
+        self.bgp_check_context = bgp_check_context
+        self.bgp_snapshot = bgp_snapshot
+        self.time_budget = time_budget
+        self.bgp_time_budget = bgp_time_budget
+        self.ospf_time_budget = ospf_time_budget
+        self.ospf_max_iterations = ospf_max_iterations
+        self.max_muses = max_muses
+        self.core_timeout = core_timeout
 
 
 class NetComplete(object):
@@ -100,6 +337,8 @@ class NetComplete(object):
         self.configs = netcomplete_config
         self._bgp_ctx = None
         self._bgp_synthesizer = None
+        # SynthesisResult of the last call to synthesize()
+        self.last_result = None
         self._bgp_solver = None
 
     @property
@@ -136,6 +375,44 @@ class NetComplete(object):
     def announcements(self):
         return self.external_announcements
 
+    def _infer_bv_widths(self):
+        """
+        The bit-vector widths of the integer BGP attributes that fit
+        the concrete values in the announcements and the sketch
+        """
+        values = dict((attr, []) for attr in BV_ATTRS)
+        values['local_pref'].append(DEFAULT_LOCAL_PREF)
+        routers = [node for node in self.topo.routers_iter()
+                   if self.topo.is_bgp_enabled(node)]
+        for ann in self.announcements:
+            for attr in ['local_pref', 'med']:
+                value = getattr(ann, attr)
+                if not is_empty(value):
+                    values[attr].append(value)
+            as_path_len = 0 if is_empty(ann.as_path) else len(ann.as_path)
+            # Each router on the way can add to the AS path
+            values['as_path_len'].append(as_path_len + len(routers))
+        sketch_attrs = {
+            MatchLocalPref: 'local_pref', ActionSetLocalPref: 'local_pref',
+            MatchMED: 'med', ActionSetMED: 'med',
+            MatchAsPathLen: 'as_path_len', ActionSetASPathLen: 'as_path_len',
+        }
+        for router in routers:
+            router_id = self.topo.get_bgp_router_id(router)
+            if isinstance(router_id, (int, long)):
+                values['router_id'].append(router_id)
+            for rmap in self.topo.get_route_maps(router).values():
+                for line in rmap.lines:
+                    for item in line.matches:
+                        attr = sketch_attrs.get(type(item))
+                        if attr and not is_empty(item.match):
+                            values[attr].append(item.match)
+                    for item in line.actions:
+                        attr = sketch_attrs.get(type(item))
+                        if attr and not is_empty(item.value):
+                            values[attr].append(item.value)
+        return infer_bv_widths(values, num_router_ids=len(routers))
+
     def _create_context(self, create_as_paths=False):
         """
         Create the context to hold symbolic variables used in BGP synthesis
@@ -151,17 +428,28 @@ class NetComplete(object):
                  if self.topo.is_bgp_enabled(node)]
 
         # print network graph router (peer) and bgp neighbor interface (next_hop)
-        print "PEER", peers
-        print "NEXTHOPS", next_hops
+        _tracer.debug("PEER %s", peers)
+        _tracer.debug("NEXTHOPS %s", next_hops)
 
         # create the SMT context that contains all the known announcements
         # involve some ctx.EnumType as follows
         #   prefix_list, peer_list, bgp_attrs_origin, as_path_list, next_hop_list
         #   xxx_list + read_list (x.xxx for x in announcements, if x.xxx not empty)
+        provenance = None
+        if self.configs.bgp_provenance:
+            provenance = ProvenanceIndex(self.configs.bgp_provenance,
+                                         reset=True)
+        bv_widths = self.configs.bgp_bv_widths
+        if bv_widths == BV_INFER:
+            bv_widths = self._infer_bv_widths()
+            _tracer.info("Inferred bit-vector widths %s", bv_widths)
         ctx = SolverContext.create_context(self.announcements,
                                            peer_list=peers,
                                            next_hop_list=next_hops,
-                                           create_as_paths=create_as_paths)
+                                           create_as_paths=create_as_paths,
+                                           provenance=provenance,
+                                           bv_widths=bv_widths,
+                                           rmap_order=self.configs.bgp_rmap_order)
         return ctx
 
     def synthesize_connected(self):
@@ -170,7 +458,16 @@ class NetComplete(object):
             raise UnImplementableRequirements(msg)
         return True
 
-    def synthesize_bgp(self):
+    def _bgp_timeout(self, msg):
+        """The partial result of the BGP stage when it runs out of time"""
+        metrics = self.bgp_ctx.last_metrics if self._bgp_ctx else None
+        return StageResult(STAGE_BGP, STATUS_TIMEOUT,
+                           unsatisfied_reqs=list(self.bgp_reqs),
+                           metrics=metrics.to_dict() if metrics else None,
+                           msg=msg)
+
+    def _encode_bgp(self):
+        """Compute the BGP propagation and encode it in a new context"""
         ###################### Compute BGP Propagation ############################
         # create the context to hold symbolic variables used in BGP synthesis
         # create the SMT context that contains all the known announcements
@@ -191,29 +488,143 @@ class NetComplete(object):
         # synthesize BGP propagation graph
         self.bgp_synthesizer.synthesize()
 
-        print "#" * 80
-        print "#" * 80
-        print "#" * 80
+    def synthesize_bgp(self, budget=None):
+        """
+        :param budget: optional utils.budget.Budget of the stage
+        :return: True, or a StageResult if the budget ran out
+        """
+        budget = budget or Budget()
+        self._encode_bgp()
+        if self.configs.bgp_snapshot:
+            self._bgp_ctx.snapshot().save(self.configs.bgp_snapshot)
+
+        _tracer.info("Synthesized the BGP propagation graph, solving")
+        if budget.expired():
+            return self._bgp_timeout("Ran out of time encoding BGP")
 
         ###################### SMT Solving & Check ################################
         # z3 solver
-        self._bgp_solver = z3.Solver(ctx=self._bgp_ctx.z3_ctx)
+        self._bgp_solver = self._bgp_ctx.create_solver(
+            self.configs.bgp_tactic,
+            unsat_core=self.configs.bgp_solve_strategy == SOLVE_TRACKED or
+            self.configs.bgp_portfolio_workers > 0 or
+            self.configs.bgp_cube_workers > 0)
+        budget.set_z3_timeout(self._bgp_solver)
+        if self.configs.bgp_check_context:
+            self._bgp_ctx.check_context(self._bgp_solver)
+        if self.configs.bgp_cache_dir:
+            self._bgp_ctx.model_cache = ModelCache(
+                self.configs.bgp_cache_dir, self.configs.bgp_cache_size)
         # z3 check ( call SolverContext.check )
-        if self.bgp_ctx.check(self.bgp_solver, track=True, out_smt=self.configs.bgp_smt) != z3.sat:
+        check_args = dict(out_smt=self.configs.bgp_smt,
+                          lazy_model=self.configs.lazy_bgp_model,
+                          out_solved_smt=self.configs.bgp_solved_smt,
+                          cone=self.configs.bgp_cone_slicing,
+                          substitute=self.configs.bgp_substitute_equalities,
+                          budget=budget)
+        if self.configs.bgp_portfolio_workers or self.configs.bgp_cube_workers:
+            if self.configs.bgp_cube_workers:
+                ret = self.bgp_ctx.check_cubes(
+                    self.configs.bgp_cube_workers,
+                    tactic=self.configs.bgp_tactic,
+                    timeout=budget.z3_timeout(),
+                    lazy_model=self.configs.lazy_bgp_model,
+                    substitute=self.configs.bgp_substitute_equalities)
+            else:
+                ret = self.bgp_ctx.check_portfolio(
+                    self.configs.bgp_portfolio_workers,
+                    timeout=budget.z3_timeout(),
+                    lazy_model=self.configs.lazy_bgp_model,
+                    substitute=self.configs.bgp_substitute_equalities)
+            if ret == z3.unsat and not self.bgp_ctx.false_constraints:
+                # Check again with tracking to read the unsat core
+                ret = self.bgp_ctx.check(self.bgp_solver, track=True,
+                                         **check_args)
+        elif self.configs.bgp_solve_strategy == SOLVE_TWO_PHASE:
+            # The tracked check only runs if the first one is unsat,
+            # check() limits it to the time left at that point
+            tracked_solver = self._bgp_ctx.create_solver(
+                self.configs.bgp_tactic, unsat_core=True)
+            ret, self._bgp_solver = self.bgp_ctx.check_two_phase(
+                self.bgp_solver, tracked_solver=tracked_solver, **check_args)
+        else:
+            ret = self.bgp_ctx.check(self.bgp_solver, track=True,
+                                     **check_args)
+        if self.configs.bgp_metrics:
+            self.bgp_ctx.last_metrics.write_json(self.configs.bgp_metrics)
+        if ret == z3.unknown and budget.bounded:
+            return self._bgp_timeout("Ran out of time solving BGP")
+        if ret != z3.sat:
+            unsat_core = self.bgp_ctx.false_constraints or \
+                self.bgp_ctx.unsat_core(self.bgp_solver)
+            core_handle = None
+            if self.configs.max_muses:
+                core_handle = self.bgp_ctx.minimize_core_async(
+                    unsat_core, self.configs.max_muses,
+                    self.configs.core_timeout)
             msg = "Unimplementable BGP requirements;" \
                   "Possibly change the requirements or loosen the sketch." \
                   "The following constraints couldn't be satisfied:" \
-                  "{}".format(self.bgp_solver.unsat_core())
-            raise UnImplementableRequirements(msg)
+                  "{}".format(unsat_core)
+            raise UnImplementableRequirements(msg, unsat_core, core_handle)
 
-        print "*" * 80
-        print "*" * 80
+        _tracer.info("Solved the BGP formula")
 
         # update the network graph with the concrete values
         self.bgp_synthesizer.update_network_graph()
 
         return True
 
+    def replay_bgp(self, snapshot, fixed_values=None, tactic=None,
+                   timeout=None):
+        """
+        Solve a snapshot of the BGP formula (see the bgp_snapshot config)
+        again, without encoding BGP. Nothing is changed in the network
+        graph, apply the values of a sat result with apply_bgp_values.
+        :param snapshot: smt_snapshot.FormulaSnapshot or its filename
+        :param fixed_values: optional dict of var name -> value to
+                             constrain some of the holes
+        :param tactic: see the bgp_tactic config, defaults to it
+        :param timeout: optional z3 timeout in ms
+        :return: (z3.sat, dict of var name -> value) if sat,
+                 (z3.unsat, unsat core), or (z3.unknown, None)
+        """
+        if isinstance(snapshot, basestring):
+            snapshot = FormulaSnapshot.load(snapshot)
+        ctx = SolverContext.from_snapshot(snapshot, fixed_values)
+        solver = ctx.create_solver(tactic or self.configs.bgp_tactic,
+                                   unsat_core=True)
+        if timeout:
+            solver.set('timeout', timeout)
+        ret = ctx.check(solver, track=True, set_model=False)
+        if ret == z3.sat:
+            return ret, read_model_values(solver.model())
+        elif ret == z3.unsat:
+            return ret, ctx.false_constraints or ctx.unsat_core(solver)
+        return ret, None
+
+    def apply_bgp_values(self, values, snapshot=None):
+        """
+        Update the network graph with the values of the BGP holes found by
+        replay_bgp. BGP is encoded first if it's not (e.g., in a new
+        process) or if it was solved already, to map the values back to
+        the route maps.
+        :param values: dict of var name -> value
+        :param snapshot: optional smt_snapshot.FormulaSnapshot (or its
+                         filename) the values are read from, it must
+                         match the encoded BGP formula
+        """
+        if self._bgp_ctx is None or self._bgp_ctx.last_metrics is not None:
+            self._encode_bgp()
+        if isinstance(snapshot, basestring):
+            snapshot = FormulaSnapshot.load(snapshot)
+        if snapshot is not None and \
+                snapshot.fingerprint != self._bgp_ctx.fingerprint():
+            raise ValueError("The snapshot doesn't match the BGP formula "
+                             "of this sketch")
+        self._bgp_ctx.apply_values(values)
+        self.bgp_synthesizer.update_network_graph()
+
     def _check_ospf_path(self, req):
         """
         Checks if the OSPF path synthesizable
@@ -333,13 +744,14 @@ class NetComplete(object):
                 next_hop = ann.next_hop
                 if not next_hop.is_concrete:
                     continue
-                next_hop = desanitize_smt_name(next_hop.get_value())
-                if next_hop == desanitize_smt_name(self.bgp_ctx.origin_next_hop):
+                smt_names = self.bgp_ctx.smt_names
+                next_hop = smt_names.desanitize(next_hop.get_value())
+                if next_hop == smt_names.desanitize(self.bgp_ctx.origin_next_hop):
                     continue
                 next_router, next_iface = next_hop.split("-")[0], '/'.join(next_hop.split("-")[1:])
                 path = [k.path for k, v in attrs['box'].anns_map.iteritems() if v == ann][0]
                 pretty = "{}:{}".format(next_router, next_iface)
-                print "XXXXX NEXT HOP at {} is {}, Path {}".format(node, pretty, path)
+                _tracer.debug("NEXT HOP at %s is %s, Path %s", node, pretty, path)
                 if node == next_router:
                     # Next hop is is one the same router
                     continue
@@ -371,30 +783,99 @@ class NetComplete(object):
             return False, not_announced
         return True, []
 
-    def synthesize_ospf(self):
+    def synthesize_ospf(self, budget=None):
+        """
+        :param budget: optional utils.budget.Budget of the stage
+        :return: True, or a StageResult if the budget or the max number
+                 of CEGIS iterations ran out
+        """
         check, msg = self._check_reqs()
         if not check:
             raise SketchError(msg)
+        # The OSPF formula is in the global z3 context, shared by the
+        # other threads (see synthesize_concurrently)
+        with GLOBAL_CONTEXT_LOCK:
+            return self._synthesize_ospf(budget)
+
+    def _synthesize_ospf(self, budget):
         seed = 0
         ospfRand = random.Random(seed)
         path_gen = 100
         ospf = OSPFCEGIS(network_graph=self.topo,
                          gen_paths=path_gen,
-                         random_obj=ospfRand)
+                         random_obj=ospfRand,
+                         tactic=self.configs.ospf_tactic)
+        ospf.max_muses = self.configs.max_muses
+        ospf.core_timeout = self.configs.core_timeout
+        ospf.out_smt = self.configs.ospf_smt
         for req in self.ospf_reqs:
             ospf.add_req(req)
-        ospf.synthesize()
+        ret = ospf.synthesize(max_iterations=self.configs.ospf_max_iterations,
+                              budget=budget)
+        if not ret and ospf.stop_reason:
+            status = STATUS_TIMEOUT if ospf.stop_reason == STOP_TIMEOUT \
+                else STATUS_ITERATIONS
+            metrics = ospf.last_metrics
+            return StageResult(STAGE_OSPF, status,
+                               model=ospf.last_costs,
+                               unsatisfied_reqs=ospf.unsatisfied_reqs,
+                               metrics=metrics.to_dict() if metrics else None,
+                               msg="OSPF synthesis stopped early")
+        if not ret:
+            msg = "Unimplementable OSPF requirements; " \
+                  "The following path constraints couldn't be satisfied:" \
+                  "{}".format(ospf.last_unsat_core)
+            raise UnImplementableRequirements(
+                msg, ospf.last_unsat_core, ospf.core_handle)
         ospf.update_network_graph()
+        return True
+
+    def _run_stage(self, stage, func, budget, reqs=()):
+        """
+        Run a synthesis stage within its budget
+        :return: StageResult
+        """
+        if budget.expired():
+            return StageResult(stage, STATUS_SKIPPED, elapsed=0,
+                               unsatisfied_reqs=list(reqs),
+                               msg="No time left to start the stage")
+        start = timer()
+        ret = func(budget)
+        elapsed = timer() - start
+        if isinstance(ret, StageResult):
+            ret.elapsed = elapsed
+            _tracer.warning("Stage %s stopped early: %s", stage, ret)
+            return ret
+        return StageResult(stage, STATUS_COMPLETED, elapsed=elapsed)
 
     def synthesize(self):
+        """
+        Run all the synthesis stages within the time budgets of the configs
+        :return: SynthesisResult, evaluates to True if all the stages
+                 completed. When a stage runs out of time (or OSPF CEGIS
+                 iterations), the following stages are not run and the
+                 stage result carries the partial solution.
+        """
+        budget = Budget(self.configs.time_budget)
+        result = SynthesisResult()
+        self.last_result = result
         # synthesize directly connected interfaces
-        self.synthesize_connected()
+        result.add(self._run_stage(
+            STAGE_CONNECTED, lambda _: self.synthesize_connected(), budget))
         # synthesize configure sketch of BGP
         if self.bgp_reqs:
-            self.synthesize_bgp()
+            stage = result.add(self._run_stage(
+                STAGE_BGP, self.synthesize_bgp,
+                budget.child(self.configs.bgp_time_budget), self.bgp_reqs))
+            if not stage.completed:
+                return result
 
         # synthesize configure sketch of OSPF
-        self.synthesize_ospf() 
+        stage = result.add(self._run_stage(
+            STAGE_OSPF, self.synthesize_ospf,
+            budget.child(self.configs.ospf_time_budget), self.ospf_reqs))
+        if not stage.completed:
+            return result
         # synthesize directly connected interfaces
         self.synthesize_connected()
 
@@ -424,9 +905,38 @@ class NetComplete(object):
                       ": {}".format(tmp)
                 raise SketchError(err)
 
-        return True
+        return result
 
     def write_configs(self, output_dir, prefix_map=None, gns3_config=None):
         writer = GNS3Topo(graph=self.topo, prefix_map=prefix_map,
                           gns3_config=gns3_config)
         writer.write_configs(out_folder=output_dir)
+
+
+def synthesize_concurrently(netcompletes, num_threads=None):
+    """
+    Run the synthesis of independent NetComplete instances on a pool of
+    threads. Each BGP stage is encoded in a new z3 context (see
+    SolverContext.create_context) and solved in parallel, the contexts are
+    never shared, as required by smt_threads.check_jobs. The OSPF stages
+    use the global z3 context and run one at a time.
+    :param netcompletes: list of NetComplete, they must not share their
+                         topologies (the synthesis updates them)
+    :param num_threads: the size of the pool, one thread per instance
+                        if None
+    :return: list of (SynthesisResult, exception) in the order of the
+             instances, the exception (e.g., UnImplementableRequirements)
+             is None if the synthesis returned
+    """
+    topos = {}
+    for index, netcomplete in enumerate(netcompletes):
+        assert isinstance(netcomplete, NetComplete)
+        if id(netcomplete.topo) in topos:
+            raise ValueError(
+                "NetComplete jobs %d and %d share the same topology" % (
+                    topos[id(netcomplete.topo)], index))
+        topos[id(netcomplete.topo)] = index
+    outcomes = run_concurrently(
+        [netcomplete.synthesize for netcomplete in netcompletes],
+        num_threads)
+    return [(ret, error) for ret, error, _ in outcomes]
@@ -24,13 +24,16 @@ from synet.utils.fnfree_smt_context import PEER_SORT
 from synet.utils.fnfree_smt_context import PREFIX_SORT
 from synet.utils.fnfree_smt_context import SolverContext
 from synet.utils.fnfree_smt_context import is_empty
-from synet.utils.fnfree_smt_context import sanitize_smt_name
 from synet.utils.smt_context import get_as_path_key
+from synet.utils import tracing
 
 
 __author__ = "Ahmed El-Hassany"     # maintainer Yongzheng Zhang
 __email__ = "a.hassany@gmail.com"   # yongzheng2024@outlook.com
 
+# The module defines its own BGP class, so don't import the BGP subsystem name
+_tracer = tracing.get_tracer(tracing.BGP)
+
 
 DEFAULT_LOCAL_PREF = 100
 DEFAULT_MED = 100
@@ -80,13 +83,12 @@ def create_sym_ann(ctx, fixed_values=None, name_prefix=None):
         ('peer', PEER_SORT, None),
         ('origin', BGP_ORIGIN_SORT, lambda x: x.name),
         ('as_path', ASPATH_SORT, get_as_path_key),
-        ('as_path_len', z3.IntSort(ctx.z3_ctx), None),
+        ('as_path_len', ctx.attr_sort('as_path_len'), None),
         ('next_hop', NEXT_HOP_SORT, None),
-        ('local_pref', z3.IntSort(ctx.z3_ctx), None),
-        ('med', z3.IntSort(ctx.z3_ctx), None),
+        ('local_pref', ctx.attr_sort('local_pref'), None),
+        ('med', ctx.attr_sort('med'), None),
         ('permitted', z3.BoolSort(ctx.z3_ctx), None),
     ]
-    print "$" * 50
     for attr, vsort, conv in all_attrs:
         is_enum = isinstance(vsort, basestring)
         value = None
@@ -94,14 +96,14 @@ def create_sym_ann(ctx, fixed_values=None, name_prefix=None):
             vsort = ctx.get_enum_type(vsort)
         if attr in fixed_values:
             if is_enum:
-                value = vsort.get_symbolic_value(sanitize_smt_name(fixed_values[attr]))
+                value = vsort.get_symbolic_value(fixed_values[attr])
             else:
                 value = fixed_values[attr]
         nprefix = "%s_" % attr
         nprefix = "%s_%s" % (name_prefix, nprefix) if name_prefix else nprefix
         vals[attr] = ctx.create_fresh_var(vsort=vsort, value=value, name_prefix=nprefix)
-        print "CREATED", vals[attr]
-        print value
+        _tracer.trace("create_sym_ann %s: %s value %s",
+                      name_prefix, vals[attr], value)
     comms = 'communities'
     vals[comms] = {}
     for community in ctx.communities:
@@ -113,9 +115,8 @@ def create_sym_ann(ctx, fixed_values=None, name_prefix=None):
             value=value,
             name_prefix=nprefix)
         vals['communities'][community] = comm_var
-        print "CREATED", comm_var
-        print value
-    print "$" * 50
+        _tracer.trace("create_sym_ann %s: %s value %s",
+                      name_prefix, comm_var, value)
     new_ann = Announcement(**vals)
     return new_ann
 
@@ -275,18 +276,19 @@ class BGP(object):
 
             # Apply any export policies (if any)
             rmap_name = self.network_graph.get_bgp_export_route_map(self.node, neighbor)
-            print "E" * 80
-            print rmap_name
-            for prop in props:
-                print prop
-            print "E" * 80
+            _tracer.debug("Export route map at %s to %s: %s for %s",
+                          self.node, neighbor, rmap_name, props)
             if not rmap_name:
                 continue
             rmap = self.network_graph.get_route_maps(self.node)[rmap_name]
             tmp = self.anns_ctx.create_new(anns, self.compute_exported_routes)
-            smt_map = SMTRouteMap(rmap, tmp, self.ctx)
+            with self.ctx.provenance_scope(router=self.node,
+                                           route_map=rmap_name):
+                smt_map = SMTRouteMap(rmap, tmp, self.ctx)
             self.rmaps[rmap_name] = smt_map
-            smt_map.execute()    # pass
+            with self.ctx.provenance_scope(router=self.node,
+                                           route_map=rmap_name):
+                smt_map.execute()    # pass
             for index, prop in enumerate(props):
                 # update export_anns[neighbor][prop]
                 #        origin -> route map (smt_map.announcements[index])
@@ -297,9 +299,7 @@ class BGP(object):
                 # print "E" * 50
                 assert assert_order(tmp[index], export_anns[neighbor][prop])
 
-        print "A" * 70
-        print export_anns
-        print "A" * 70
+        _tracer.trace("Exported routes at %s: %s", self.node, export_anns)
         return export_anns
 
     def _get_selected_sham(self):
@@ -345,7 +345,7 @@ class BGP(object):
                 next_hop = self.next_hop_map[self.node][neighbor]
                 if is_ebgp_neighbor:
                     ann.local_pref = self.ctx.create_fresh_var(
-                        z3.IntSort(self.ctx.z3_ctx),
+                        self.ctx.attr_sort('local_pref'),
                         value=DEFAULT_LOCAL_PREF)
                     next_hop_var = self.ctx.create_fresh_var(next_hop_sort, value=next_hop)
                     ann.next_hop = next_hop_var
@@ -373,9 +373,11 @@ class BGP(object):
                     props.append(prop)
                     anns.append(ann)
                 tmp = self.anns_ctx.create_new(anns, self.compute_exported_routes)
-                smt_map = SMTRouteMap(rmap, tmp, self.ctx)
+                with self.ctx.provenance_scope(router=self.node,
+                                               route_map=rmap_name):
+                    smt_map = SMTRouteMap(rmap, tmp, self.ctx)
+                    smt_map.execute()
                 self.rmaps[rmap_name] = smt_map
-                smt_map.execute()
                 cc = self.ctx._tracked.keys()[:]
                 for index, prop in enumerate(props):
                     imported[prop] = smt_map.announcements[index]
@@ -493,7 +495,8 @@ class BGP(object):
 
         # MED
         select_med = z3.And(best_as_num == other_as_num,
-                            best_ann_var.med.var < other_ann_var.med.var, self.ctx.z3_ctx)
+                            self.ctx.less(best_ann_var.med.var, other_ann_var.med.var),
+                            self.ctx.z3_ctx)
         not_select_med = z3.Or(best_as_num != other_as_num,
                                z3.And(best_as_num == other_as_num,
                                       best_ann_var.med.var == other_ann_var.med.var, self.ctx.z3_ctx),
@@ -521,7 +524,8 @@ class BGP(object):
             self.log.warn("Router ID is not set for {} {}".format(other_neighbor, other_router_id))
         if best_router_id and other_router_id:
             # Router ID are known, we can make assumptions about them
-            select_router_id = best_router_id.var < other_router_id.var
+            select_router_id = self.ctx.less(best_router_id.var,
+                                             other_router_id.var)
         else:
             # Router IDs are NOT known, assume they're not in our favor
             select_router_id = self.ctx.create_fresh_var(
@@ -536,12 +540,12 @@ class BGP(object):
                 other_permitted == False,
                 # 2) If Permitted, local pref
                 z3.And(other_permitted,
-                       s_localpref > o_localpref,
+                       self.ctx.greater(s_localpref, o_localpref),
                        self.ctx.z3_ctx),
                 # 3) AS Path Length
                 z3.And(other_permitted,
                        s_localpref == o_localpref,
-                       s_aslen < o_aslen,
+                       self.ctx.less(s_aslen, o_aslen),
                        self.ctx.z3_ctx),
                 # 4) Origin Code IGP < EGP < Incomplete
                 z3.And(other_permitted,
@@ -607,16 +611,26 @@ class BGP(object):
         tmp = const_selection + [self.ctx.z3_ctx]
         prefix = "SELECT_at_{}_prefix_{}_path_{}_".format(
             self.node, best_propagated.ann_name, '_'.join(best_propagated.path))
-        const_name = self.ctx.register_constraint(z3.And(*tmp) == True, name_prefix=prefix)
+        const_name = self.ctx.register_constraint(
+            z3.And(*tmp) == True, name_prefix=prefix,
+            requirement='select %s over %s' % (best_propagated.path,
+                                               other_propagated.path),
+            announcement=best_propagated.ann_name)
         self.selection_constraints[const_name] = (best_ann_var, other_ann_var, best_propagated, other_propagated, const_selection)
 
     def mark_selected(self):
         for propagated, ann in self.anns_map.iteritems():
             n = '_{}_from_{}_path_{}_'.format(self.node, propagated.peer, '_'.join(propagated.path))
             if ann not in self.selected_sham:
-                self.ctx.register_constraint(ann.permitted.var == False, name_prefix='Req_Block' + n)
+                self.ctx.register_constraint(
+                    ann.permitted.var == False, name_prefix='Req_Block' + n,
+                    requirement='block %s' % propagated.path,
+                    announcement=propagated.ann_name)
             else:
-                self.ctx.register_constraint(ann.permitted.var == True, name_prefix='Req_Allow' + n)
+                self.ctx.register_constraint(
+                    ann.permitted.var == True, name_prefix='Req_Allow' + n,
+                    requirement='allow %s' % propagated.path,
+                    announcement=propagated.ann_name)
 
     def synthesize(self, use_igp=False):
 
@@ -692,9 +706,7 @@ class BGP(object):
         """Update the network graph with the concrete values"""
         for smt_rmap in self.rmaps.values():
             rmap = smt_rmap.get_config()
-            print "P" * 50
-            print rmap
-            print "P" * 50
+            _tracer.debug("Synthesized route map at %s: %s", self.node, rmap)
             self.network_graph.add_route_map(self.node, rmap)
             for line in rmap.lines:
                 for match in line.matches:
@@ -26,11 +26,16 @@ from synet.utils.fnfree_smt_context import ASPATH_SORT
 from synet.utils.fnfree_smt_context import is_empty
 from synet.utils.fnfree_smt_context import is_symbolic
 from synet.utils.smt_context import get_as_path_key
+from synet.utils.tracing import DEBUG
+from synet.utils.tracing import PROPAGATION
+from synet.utils.tracing import get_tracer
 
 
 __author__ = "Ahmed El-Hassany"     # maintainer Yongzheng Zhang
 __email__ = "a.hassany@gmail.com"   # yongzheng2024@outlook.com
 
+_tracer = get_tracer(PROPAGATION)
+
 
 class EBGPPropagation(object):
     """compute the BGP route propagation graph"""
@@ -70,7 +75,7 @@ class EBGPPropagation(object):
                     router_id = router_id.get_value()
                 else:
                     router_id = None
-            var = self.ctx.create_fresh_var(z3.IntSort(self.ctx.z3_ctx),
+            var = self.ctx.create_fresh_var(self.ctx.attr_sort('router_id'),
                                             value=router_id,
                                             name_prefix='{}_router_id'.format(router))
             ids.append(var)
@@ -79,7 +84,8 @@ class EBGPPropagation(object):
             # No router IDs used in the sketch
             return
         for var in ids:
-            self.ctx.register_constraint(var.var > 0, name_prefix='router_id_larger_than_zero_')
+            self.ctx.register_constraint(self.ctx.greater(var.var, 0),
+                                         name_prefix='router_id_larger_than_zero_')
         dist = [var.var for var in ids]
         if all([var.is_concrete for var in ids]):
             unq = len(set(dist)) == len(dist)
@@ -303,12 +309,11 @@ class EBGPPropagation(object):
             # Second compute the propagation among routers and possibily iBGP Propagation
             ibgp_propagation = compute_propagation(self.network_graph, router_paths)
 
-            print "E" * 50
-            print_compute_propagation(ebgp_propagation)
-            print "E" * 50
-            print "I" * 50
-            print_compute_propagation(ibgp_propagation)
-            print "I" * 50
+            if _tracer.enabled(DEBUG):
+                _tracer.debug("eBGP propagation of %s", net)
+                print_compute_propagation(ebgp_propagation)
+                _tracer.debug("iBGP propagation of %s", net)
+                print_compute_propagation(ibgp_propagation)
 
             for node in ibgp_propagation.nodes():
                 clear = [x for x in ibgp_propagation.node[node]['order'] if x]
@@ -323,9 +328,9 @@ class EBGPPropagation(object):
 
             # Extend the iBGP propagation to contain the eBGP paths
             self.expand_ebgp_graph(ebgp_propagation, ibgp_propagation, as_paths, router_paths)
-            print "I" * 50
-            print_compute_propagation(ibgp_propagation)
-            print "I" * 50
+            if _tracer.enabled(DEBUG):
+                _tracer.debug("Extended iBGP propagation of %s", net)
+                print_compute_propagation(ibgp_propagation)
 
             self.ebgp_graphs[net] = ebgp_propagation
             self.ibgp_graphs[net] = ibgp_propagation
@@ -336,8 +341,9 @@ class EBGPPropagation(object):
         as_paths = self.partial_eval_propagated_info()
 
         # print ebgp, ibgp output info
-        print as_paths
-        self.print_propagation_info()
+        _tracer.debug("Propagated AS paths: %s", as_paths)
+        if _tracer.enabled(DEBUG):
+            self.print_propagation_info()
 
         self.ctx.create_enum_type(ASPATH_SORT, [get_as_path_key(p) for p in as_paths])
         return unmatching_orders
@@ -478,16 +484,18 @@ class EBGPPropagation(object):
     def synthesize(self, use_igp=False):
         #self.compute_dags()
         for node in self.ibgp_propagation.nodes():
-            self.ibgp_propagation.node[node]['box'] = BGP(node, self)
+            with self.ctx.provenance_scope(router=node):
+                self.ibgp_propagation.node[node]['box'] = BGP(node, self)
         for node in self.ibgp_propagation.nodes():
-            self.ibgp_propagation.node[node]['box'].synthesize(use_igp=use_igp)
+            with self.ctx.provenance_scope(router=node):
+                self.ibgp_propagation.node[node]['box'].synthesize(
+                    use_igp=use_igp)
             # TODO sub-specifications verifier
             # self.ibgp_propagation.node[node]['box'].synthesize_subspecs()
 
-        print "Y" * 50
-        print "PROPAGATION GRAPH SIZE:", self.ibgp_propagation.number_of_nodes()
-        print "NETWORK GRAPH SIZE:", self.network_graph.number_of_nodes()
-        print "Y" * 50
+        _tracer.info("PROPAGATION GRAPH SIZE: %d, NETWORK GRAPH SIZE: %d",
+                     self.ibgp_propagation.number_of_nodes(),
+                     self.network_graph.number_of_nodes())
 
     def get_generated_ospf_requirements(self):
         reqs = []
@@ -504,27 +512,27 @@ class EBGPPropagation(object):
             self.ibgp_propagation.node[node]['box'].update_network_graph()
 
     def print_propagation_info(self):
-        """print bgp propagation info"""
+        """Trace the bgp propagation info (at the DEBUG level)"""
         for node in self.ebgp_propagation.nodes():
-            print "#" * 50
-            print "node:", node
+            _tracer.debug("#" * 50)
+            _tracer.debug("node: %s", node)
             for net, attrs in self.ebgp_propagation.node[node][NETS].iteritems():
-                print "network prefix:", net
-                print "paths attributes:", attrs[PATHS]
-                print "order attributes:", attrs[ORDER]
-                print "block attributes:", attrs[BLOCK]
-                print "-" * 50
+                _tracer.debug("network prefix: %s", net)
+                _tracer.debug("paths attributes: %s", attrs[PATHS])
+                _tracer.debug("order attributes: %s", attrs[ORDER])
+                _tracer.debug("block attributes: %s", attrs[BLOCK])
+                _tracer.debug("-" * 50)
 
         for node in self.ibgp_propagation.nodes():
-            print "#" * 50
-            print "node:", node
+            _tracer.debug("#" * 50)
+            _tracer.debug("node: %s", node)
             for net, attrs in self.ibgp_propagation.node[node][NETS].iteritems():
-                print "network prefix:", net
-                print "paths attributes:", attrs[PATHS]
-                print "order attributes:", attrs[ORDER]
-                print "block attributes:", attrs[BLOCK]
-                print "paths info attributes:", attrs[PATHS_INFO]
-                print "order info attributes:", attrs[ORDER_INFO]
-                print "block info attributes:", attrs[BLOCK_INFO]
-                print "origins info attributes:", attrs[ORIGIN]
-                print "-" * 50
+                _tracer.debug("network prefix: %s", net)
+                _tracer.debug("paths attributes: %s", attrs[PATHS])
+                _tracer.debug("order attributes: %s", attrs[ORDER])
+                _tracer.debug("block attributes: %s", attrs[BLOCK])
+                _tracer.debug("paths info attributes: %s", attrs[PATHS_INFO])
+                _tracer.debug("order info attributes: %s", attrs[ORDER_INFO])
+                _tracer.debug("block info attributes: %s", attrs[BLOCK_INFO])
+                _tracer.debug("origins info attributes: %s", attrs[ORIGIN])
+                _tracer.debug("-" * 50)
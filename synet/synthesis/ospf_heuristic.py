@@ -27,12 +27,17 @@ from synet.utils.ospf_utils import get_output_network_graph
 from synet.utils.ospf_utils import load_graph_constrains
 from synet.utils.ospf_utils import synthesize_ospf_announce
 from synet.utils.smt_context import is_symbolic
+from synet.utils.smt_tuning import KIND_OSPF
+from synet.utils.tracing import OSPF
+from synet.utils.tracing import get_tracer
 
 
 __author__ = "Ahmed El-Hassany"
 __email__ = "a.hassany@gmail.com"
 
 
+_tracer = get_tracer(OSPF)
+
 z3.set_option('unsat-core', True)
 
 
@@ -49,14 +54,27 @@ def get_path_name(path):
     return '_'.join(path)
 
 
+# The relations between two paths in the names of the tracked constraints
+TRACK_RELATIONS = ('_ISLESS_', '_ISEQUAL_', '_ORDER_')
+
+
+# Reasons for synthesize() to stop early
+STOP_TIMEOUT = 'timeout'
+STOP_ITERATIONS = 'iterations'
+
+
 class OSPFSyn(SynthesisComponent):
+    tuning_kind = KIND_OSPF
 
     def __init__(self, network_graph,
-                 solver=None, gen_paths=1000, random_obj=None):
+                 solver=None, gen_paths=1000, random_obj=None, tactic=None):
         assert isinstance(network_graph, NetworkGraph)
         self.log = logging.getLogger('%s.%s' % (
             self.__module__, self.__class__.__name__))
-        super(OSPFSyn, self).__init__([], network_graph, solver)
+        super(OSPFSyn, self).__init__([], network_graph, solver, tactic)
+        # The solver is created again once the number of holes is known
+        # to pick the tuned configuration (see num_holes)
+        self._own_solver = solver is None
 
         self.random_gen = random_obj or random.Random()
         self.ospf_graph = None
@@ -70,11 +88,30 @@ class OSPFSyn(SynthesisComponent):
         self.removed_reqs = []
         self.all_req_paths = None  # Keep track of all paths in the reqs
         self._names_cache = []
+        # Why the last synthesize() stopped before satisfying all the reqs,
+        # one of the STOP_* values or None
+        self.stop_reason = None
+        # The costs [(src, dst, cost)] of the last sat model
+        self.last_costs = None
+        # The reqs not satisfied by last_costs
+        self.unsatisfied_reqs = []
+        # smt_mus.CoreMinimization of the core when the reqs are directly
+        # unsat and max_muses is set
+        self.core_handle = None
+
+    def num_holes(self):
+        """Number of symbolic link costs"""
+        # Called by the base class before ospf_graph is set
+        ospf_graph = getattr(self, 'ospf_graph', None)
+        if ospf_graph is None:
+            return 0
+        return len([1 for _, _, attrs in ospf_graph.edges(data=True)
+                    if z3.is_expr(attrs['cost'])])
 
     def reset_solver(self):
         """Reset and clear all caches and create new solver"""
-        self.solver = z3.Solver()
         self.ospf_graph = extract_ospf_graph(self.network_graph, self.log)
+        self.solver = self.create_solver()
         load_graph_constrains(self.solver, self.ospf_graph)
         self.saved_path_gen = {}
 
@@ -440,6 +477,20 @@ class OSPFSyn(SynthesisComponent):
         assert req.protocol == Protocols.OSPF
         self.reqs.append(req)
 
+    def _find_path_req(self, path):
+        """The requirement of the given path, None if there is none"""
+        for req in self.reqs:
+            if isinstance(req, PathReq):
+                if req.path == path:
+                    return req
+            elif isinstance(req, (ECMPPathsReq, PathOrderReq, KConnectedPathsReq)):
+                for p in req.paths:
+                    if path == p.path:
+                        return req
+            else:
+                raise ValueError("Not supported req: %s" % req)
+        return None
+
     def remove_unsat_paths(self):
         """
         Remove one path from to the requirements if it's part of the unsat core.
@@ -452,25 +503,9 @@ class OSPFSyn(SynthesisComponent):
             if 'ISLESS' not in str(t):
                 continue
             path = t.split('_ISLESS_')[0].split('_')
-            path_req = None
-            for req in self.reqs[:]:
-                if isinstance(req, PathReq):
-                    if req.path == path:
-                        self.reqs.remove(req)
-                        path_req = req
-                        break
-                elif isinstance(req, (ECMPPathsReq, PathOrderReq, KConnectedPathsReq)):
-                    found = False  # To break outer loop
-                    for p in req.paths:
-                        if path == p.path:
-                            self.reqs.remove(req)
-                            path_req = req
-                            found = True
-                    if found:
-                        break
-                else:
-                    raise ValueError("Cannot remove req %s" % req)
+            path_req = self._find_path_req(path)
             assert path_req, "Couldn't find path in requirements %s" % path
+            self.reqs.remove(path_req)
             self.removed_reqs.append(path_req)
             break
         self.reset_solver()
@@ -495,10 +530,8 @@ class OSPFSyn(SynthesisComponent):
         if len(computed) > 1 or computed[0] != path:
             if allow_ecmp and path in computed:
                 return sat
-            print "#" * 20
-            print "Required Simple shortest path", path
-            print "Computed Simple shortest path", computed
-            print "#" * 20
+            _tracer.debug("Required Simple shortest path %s, computed %s",
+                          path, computed)
             sat = False
             key = get_path_key(path[0], path[-1])
             if key not in self.counter_examples:
@@ -526,10 +559,8 @@ class OSPFSyn(SynthesisComponent):
             sat = False
             return sat
         if computed != set(req_paths):
-            print "#" * 20
-            print "Required ECMP paths", req_paths
-            print "Computed ECMP paths", computed
-            print "#" * 20
+            _tracer.debug("Required ECMP paths %s, computed %s",
+                          req_paths, computed)
             sat = False
             key = get_path_key(primary[0], primary[-1])
             if key not in self.counter_examples:
@@ -566,10 +597,8 @@ class OSPFSyn(SynthesisComponent):
                 out_copy, curr_path[0], curr_path[-1], 'cost')
             computed = list(shortest)
             if len(computed) > 1 or computed[0] != curr_path:
-                print "#" * 20
-                print "Required Order shortest path", curr_path
-                print "Computed Order shortest path", computed
-                print "#" * 20
+                _tracer.debug("Required Order shortest path %s, computed %s",
+                              curr_path, computed)
                 sat = False
                 key = get_path_key(primary[0], primary[-1])
                 if key not in self.counter_examples:
@@ -613,10 +642,8 @@ class OSPFSyn(SynthesisComponent):
                     not_valid_path = p
                     break
             if not_valid_path:
-                print "#" * 20
-                print "Required KConnected shortest path", curr_reqs
-                print "Computed KConnected shortest path", not_valid_path
-                print "#" * 20
+                _tracer.debug("Required KConnected shortest path %s, computed %s",
+                              curr_reqs, not_valid_path)
                 sat = False
                 key = get_path_key(primary[0], primary[-1])
                 if key not in self.counter_examples:
@@ -640,56 +667,150 @@ class OSPFSyn(SynthesisComponent):
             raise ValueError("Cannot check req for %s", req)
         return sat
 
-    def synthesize(self, retries_before_rest=5, gen_path_increment=500, allow_ecmp=False):
+    def explain_core(self, names):
+        """
+        The requirement and the symbolic link costs (holes) of the two
+        paths compared by each tracked constraint of an unsat core
+        """
+        explained = []
+        for name in names:
+            entry = dict(name=name)
+            for relation in TRACK_RELATIONS:
+                if relation not in name:
+                    continue
+                paths = [part.split('_') for part in name.split(relation, 1)]
+                entry['requirement'] = self._find_path_req(paths[0]) or \
+                    self._find_path_req(paths[1])
+                holes = set()
+                for path in paths:
+                    for src, dst in zip(path[:-1], path[1:]):
+                        if not self.ospf_graph.has_edge(src, dst):
+                            continue
+                        cost = self._get_edge_cost(src, dst)
+                        if is_symbolic(cost):
+                            holes.add(str(cost))
+                entry['holes'] = sorted(holes)
+                break
+            explained.append(entry)
+        return explained
+
+    def _solve_in_budget(self, budget):
+        """
+        Solve with a z3 timeout of the remaining budget
+        :return: True if sat, None if the budget ran out, False otherwise
+        """
+        bounded = budget is not None and budget.bounded
+        if bounded:
+            if budget.expired():
+                return None
+            budget.set_z3_timeout(self.solver)
+        if self.solve():
+            return True
+        if bounded and self.last_metrics.result == str(z3.unknown):
+            return None
+        return False
+
+    def _stop(self, reason):
+        """Stop the synthesis early, keeping the last sat costs"""
+        self.stop_reason = reason
+        self.log.warn("Stopped OSPF synthesis (%s) with %d unsatisfied "
+                      "requirements", reason, len(self.unsatisfied_reqs))
+        return False
+
+    def synthesize(self, retries_before_rest=5, gen_path_increment=500,
+                   allow_ecmp=False, max_iterations=None, budget=None):
         """
         The main synthesis method
         :param retries_before_rest: how many time to try before resetting
-                                    for new instance of the SMT solver
+                                    for new instance of the SMT solver,
+                                    and how many times the costs are
+                                    recomputed when they're unsat before
+                                    giving up with the unsat core
         :param gen_path_increment: how many paths to generate per iterations
-        :return: bool
+        :param max_iterations: max number of CEGIS iterations (recomputing
+                               the costs, including the unsat attempts),
+                               unbounded if None
+        :param budget: optional utils.budget.Budget, z3 checks are limited
+                       to the remaining time
+        :return: bool, when False self.stop_reason tells if it stopped
+                 early, then self.last_costs and self.unsatisfied_reqs
+                 hold the best partial result
         """
+        self.stop_reason = None
+        self.last_costs = None
+        self.core_handle = None
+        self.unsatisfied_reqs = list(self.reqs)
         # Load Graph
         self.ospf_graph = extract_ospf_graph(self.network_graph, self.log)
+        if self._own_solver:
+            self.solver = self.create_solver()
         load_graph_constrains(self.solver, self.ospf_graph)
 
         origianl_gen_paths = self.gen_paths
 
         # First try to synthesize with all requirements
-        while not self.solve():
+        solved = self._solve_in_budget(budget)
+        if solved is None:
+            return self._stop(STOP_TIMEOUT)
+        if not solved:
             # At this point any unsat is directly caused by the requirements
             # So remove one of them
-            print "Reqs directly are unsatisfiable"
-            print self.solver.unsat_core()
+            _tracer.info("Reqs directly are unsatisfiable: %s",
+                         self.last_unsat_core)
+            if self.max_muses:
+                self.core_handle = self.minimize_core_async()
             #self.remove_unsat_paths()
             return False
+        self.last_costs = self.get_output_configs()
 
         # Now the actual synthesis
         retries = 0
+        iterations = 0
         while True:
-            recompute = False
             # Check if all requirements are already satisfied
             # Using dijkstra algorithm
-            for req in self.reqs:
-                g_ospf = self.get_output_network_graph()
-                if not self.check_req_satisfied(g_ospf, req, allow_ecmp=allow_ecmp):
-                    recompute = True
-            if not recompute:
+            g_ospf = self.get_output_network_graph()
+            self.unsatisfied_reqs = [
+                req for req in self.reqs if not self.check_req_satisfied(
+                    g_ospf, req, allow_ecmp=allow_ecmp)]
+            if not self.unsatisfied_reqs:
                 break
-            print "Recomputing ospf costs"
+            iterations += 1
+            if max_iterations is not None and iterations > max_iterations:
+                return self._stop(STOP_ITERATIONS)
+            _tracer.debug("Recomputing ospf costs")
             retries += 1
             if retries > retries_before_rest:
                 self.gen_paths += gen_path_increment
-                print "RESET SOLVER and increase the number of paths to", self.gen_paths, "#" * 10
+                _tracer.debug("Reset the solver and increase the number "
+                              "of paths to %d", self.gen_paths)
                 self.reset_solver()
-            while not self.solve():
-                print "UNSAT"
-                print self.solver.unsat_core()
+            unsat_retries = 0
+            while True:
+                solved = self._solve_in_budget(budget)
+                if solved is None:
+                    return self._stop(STOP_TIMEOUT)
+                if solved:
+                    break
+                _tracer.debug("Recomputed ospf costs are unsat: %s",
+                              self.last_unsat_core)
                 #removed_path = self.remove_unsat_paths()
-                print "#" * 40
                 #print "Removed path from req", removed_path
                 #assert not removed_path
                 self.gen_paths = origianl_gen_paths
-                print "#" * 40
+                unsat_retries += 1
+                iterations += 1
+                if max_iterations is not None and \
+                        iterations > max_iterations:
+                    return self._stop(STOP_ITERATIONS)
+                if unsat_retries > retries_before_rest:
+                    # The counter examples keep the reqs unsat
+                    _tracer.info("Reqs are unsatisfiable with the counter "
+                                 "examples: %s", self.last_unsat_core)
+                    if self.max_muses:
+                        self.core_handle = self.minimize_core_async()
+                    return False
+            self.last_costs = self.get_output_configs()
         return True
 
     def print_costs(self):
@@ -7,12 +7,17 @@ import networkx as nx
 from synet.utils.fnfree_smt_context import VALUENOTSET
 from synet.utils.fnfree_smt_context import is_empty
 from synet.utils.fnfree_smt_context import sanitize_smt_name
+from synet.utils.tracing import PROPAGATION
+from synet.utils.tracing import get_tracer
 
 
 __author__ = "Ahmed El-Hassany"
 __email__ = "a.hassany@gmail.com"
 
 
+_tracer = get_tracer(PROPAGATION)
+
+
 def synthesize_next_hop(network_graph, node, neighbor, ibgp_loopback=True):
     """
     Synthesizes a next hop interface between two router.
@@ -166,11 +171,12 @@ def compute_propagation(graph, ordered_paths):
 
 
 def print_compute_propagation(graph):
+    """Trace the propagation graph (at the DEBUG level)"""
     for node in graph.nodes():
-        print "node:", node
-        print "node['paths']:", graph.node[node]['paths']
-        print "node['order']:", graph.node[node]['order']
-        print "node['block']:", graph.node[node]['block']
+        _tracer.debug("node: %s", node)
+        _tracer.debug("node['paths']: %s", graph.node[node]['paths'])
+        _tracer.debug("node['order']: %s", graph.node[node]['order'])
+        _tracer.debug("node['block']: %s", graph.node[node]['block'])
 
 
 def write_dag(dag, file):
@@ -0,0 +1,72 @@
+"""
+Wall clock time budgets for the synthesis stages
+"""
+
+from timeit import default_timer as timer
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# The max value of the z3 timeout parameter (unsigned int, in ms)
+_MAX_Z3_TIMEOUT = 2 ** 32 - 1
+
+
+class Budget(object):
+    """
+    A deadline, unbounded if seconds is None
+    """
+
+    def __init__(self, seconds=None, deadline=None):
+        """
+        :param seconds: the budget from now
+        :param deadline: an absolute deadline (in timer() time),
+                         used instead of seconds
+        """
+        self.start = timer()
+        if deadline is None and seconds is not None:
+            deadline = self.start + seconds
+        self.deadline = deadline
+
+    @property
+    def bounded(self):
+        return self.deadline is not None
+
+    def elapsed(self):
+        """Seconds since the budget started"""
+        return timer() - self.start
+
+    def remaining(self):
+        """Seconds left, None if unbounded"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - timer())
+
+    def expired(self):
+        return self.deadline is not None and timer() >= self.deadline
+
+    def z3_timeout(self):
+        """The remaining time as a z3 'timeout' parameter (ms), or None"""
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        return min(_MAX_Z3_TIMEOUT, max(1, int(remaining * 1000)))
+
+    def child(self, seconds=None):
+        """
+        A budget for a sub stage that ends at the earliest of this budget
+        deadline and seconds from now
+        """
+        deadline = self.deadline
+        if seconds is not None:
+            stage_deadline = timer() + seconds
+            if deadline is None or stage_deadline < deadline:
+                deadline = stage_deadline
+        return Budget(deadline=deadline)
+
+    def set_z3_timeout(self, solver):
+        """Limit the next checks of a z3 solver to the remaining time"""
+        timeout = self.z3_timeout()
+        if timeout is not None:
+            solver.set('timeout', timeout)
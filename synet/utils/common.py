@@ -15,11 +15,25 @@ from networkx.drawing import nx_pydot
 
 from tekton.graph import NetworkGraph
 
+from synet.utils.smt_metrics import SolveMetrics
+from synet.utils.smt_metrics import read_z3_statistics
+from synet.utils.smt_dump import write_smt2
+from synet.utils.smt_mus import minimize_core_async
+from synet.utils.smt_tactics import create_solver
+from synet.utils.smt_tactics import tactic_name
+from synet.utils.smt_tuning import default_tuning
+from synet.utils.smt_tuning import problem_header
+from synet.utils.tracing import SMT
+from synet.utils.tracing import get_tracer
+
 
 __author__ = "Ahmed El-Hassany"
 __email__ = "a.hassany@gmail.com"
 
 
+_tracer = get_tracer(SMT)
+
+
 # Keys for annotations used in nx graphs
 NODE_TYPE = '"node"'
 EXTERNAL_NODE_TYPE = '"external_node"'
@@ -388,7 +402,11 @@ class SynthesisComponent(object):
     __metaclass__ = ABCMeta
 
     valid_inputs = ()
-    def __init__(self, initial_configs, network_graph, solver=None):
+    # smt_tuning kind of the formula, to pick the tuned solver configuration
+    tuning_kind = None
+
+    def __init__(self, initial_configs, network_graph, solver=None,
+                 tactic=None):
         if not network_graph:
             network_graph = NetworkGraph()
         if not initial_configs:
@@ -396,11 +414,49 @@ class SynthesisComponent(object):
 
         self.network_graph = network_graph
         self.initial_configs = initial_configs
+        # z3 tactic pipeline applied before solving, see smt_tactics
+        self.tactic = tactic
         if not solver:
-            solver = z3.Solver()
+            solver = self.create_solver()
         self.solver = solver
         # Requirements for the synthesis
         self.reqs = []
+        # SolveMetrics of the last call to solve()
+        self.last_metrics = None
+        # Unsat core (tracked names) of the last unsat call to solve()
+        self.last_unsat_core = None
+        # Enumerate this many MUSes of the unsat cores in a background
+        # process, see minimize_core_async. Disabled when 0
+        self.max_muses = 0
+        # Optional seconds for each core minimization
+        self.core_timeout = None
+        # The formula of the last unsat call to solve(), kept to minimize
+        # its core when max_muses is set
+        self._last_unsat_smt2 = None
+        # Optional filename to dump the formula of each call to solve()
+        # in SMT-LIB (gzipped if it ends with '.gz'), the last one is kept.
+        # Used to build the corpus of the tuner (see smt_tuning)
+        self.out_smt = None
+
+    def num_holes(self):
+        """
+        Number of symbolic variables, used to pick the tuned solver and
+        recorded in the header of the dumps
+        """
+        return 0
+
+    def create_solver(self):
+        """
+        Create a new z3 solver that applies self.tactic, or the tuned
+        configuration (see smt_tuning) if self.tactic is None
+        """
+        tactic, params = self.tactic, None
+        tuning = default_tuning()
+        if tactic is None and self.tuning_kind and tuning is not None:
+            config = tuning.lookup(self.tuning_kind, self.num_holes())
+            if config:
+                tactic, params = config['tactic'], config['params']
+        return create_solver(tactic, unsat_core=True, params=params)
 
     def _get_names(self, configs, graph):
         node_names, interface_names, network_names, announced_networks = get_vertices(graph)
@@ -448,22 +504,62 @@ class SynthesisComponent(object):
         t1 = timer()
         self.push_requirements()
         t2 = timer()
-        result = self.solver.check()
+        tdump = None
+        if self.out_smt:
+            header = problem_header(self.tuning_kind, self.num_holes()) \
+                if self.tuning_kind else None
+            write_smt2(self.solver, self.out_smt, header=header)
+            tdump = timer() - t2
         t3 = timer()
+        result = self.solver.check()
         treqs = t2 - t1
-        tz3 = t3 - t2
+        tz3 = timer() - t3
         ttotal = t2 - t1
         name = self.__class__.__name__
-        print "%s: Pushing requirements time: %s" % (name, treqs)
-        print "%s: Z3 time: %s" % (name, tz3)
-        print "%s: Total synthesizes time: %s" % (name, ttotal)
-        print "%s: sat result: %s" % (name, result)
+        metrics = SolveMetrics(tactic=tactic_name(self.tactic))
+        metrics.result = str(result)
+        metrics.add_timing('push_requirements', treqs)
+        metrics.add_timing('z3_check', tz3)
+        if tdump is not None:
+            metrics.add_timing('dump', tdump)
+        metrics.z3_stats = read_z3_statistics(self.solver.statistics())
+        self.last_metrics = metrics
+        _tracer.debug("%s: Pushing requirements time: %s", name, treqs)
+        _tracer.debug("%s: Z3 time: %s", name, tz3)
+        _tracer.debug("%s: Total synthesizes time: %s", name, ttotal)
+        _tracer.debug("%s: sat result: %s", name, result)
         if result == z3.sat:
             return True
         else:
+            if result == z3.unsat:
+                # The requirements are gone after the pop
+                self.last_unsat_core = [
+                    str(name) for name in self.solver.unsat_core()]
+                if self.max_muses:
+                    self._last_unsat_smt2 = self.solver.sexpr()
             self.solver.pop()
             return False
 
+    def explain_core(self, names):
+        """
+        Where the tracked constraints of an unsat core come from
+        :return: list of dicts with the 'name', and when known
+                 the 'requirement' and the 'holes' (symbolic vars)
+        """
+        return [dict(name=name) for name in names]
+
+    def minimize_core_async(self):
+        """
+        Shrink the unsat core of the last unsat call to solve() to
+        self.max_muses minimal unsatisfiable subsets in a background process
+        :return: smt_mus.CoreMinimization
+        """
+        assert self.max_muses, "Set max_muses before calling solve()"
+        assert self._last_unsat_smt2 is not None, "No unsat solve() yet"
+        return minimize_core_async(self._last_unsat_smt2,
+                                   self.last_unsat_core, self.max_muses,
+                                   self.core_timeout, self.explain_core)
+
     @abstractmethod
     def get_output_network_graph(self):
         """
@@ -41,18 +41,22 @@ from synet.utils.fnfree_smt_context import ASPATH_SORT
 from synet.utils.fnfree_smt_context import BGP_ORIGIN_SORT
 from synet.utils.fnfree_smt_context import PEER_SORT
 from synet.utils.fnfree_smt_context import PREFIX_SORT
+from synet.utils.fnfree_smt_context import RMAP_ORDER_CHAINED
 from synet.utils.fnfree_smt_context import NEXT_HOP_SORT
 from synet.utils.fnfree_smt_context import SMTVar
 from synet.utils.fnfree_smt_context import SolverContext
 from synet.utils.fnfree_smt_context import is_symbolic
 from synet.utils.fnfree_smt_context import is_empty
 from synet.utils.fnfree_smt_context import decode_as_path
-from synet.utils.fnfree_smt_context import desanitize_smt_name
+from synet.utils.tracing import POLICY
+from synet.utils.tracing import get_tracer
 
 
 __author__ = "Ahmed El-Hassany"
 __email__ = "a.hassany@gmail.com"
 
+_tracer = get_tracer(POLICY)
+
 SELECTOR = {}
 
 
@@ -65,8 +69,6 @@ class SMTAbstractMatch(object):
         Using this method on the same announcement multiple times generates
         redundant constraints and variables
         """
-        print "========= ", "SMTAbstractMacth is_match BEG", "=" * 10
-        print "========= ", "SMTAbstractMacth is_match END", "=" * 10
         raise NotImplementedError()
 
     def get_is_match(self, announcement):
@@ -81,8 +83,6 @@ class SMTMatchAll(SMTAbstractMatch):
         self.match_var = ctx.create_fresh_var(z3.BoolSort(ctx=self.ctx.z3_ctx), name_prefix='match_all_', value=True)
 
     def is_match(self, announcement):
-        print "========= ", "SMTMacthAll is_match BEG", "=" * 10
-        print "========= ", "SMTMacthAll is_match END", "=" * 10
         return self.match_var
 
     def get_is_match(self, announcement):
@@ -100,8 +100,6 @@ class SMTMatchNone(SMTAbstractMatch):
         self.match_var = ctx.create_fresh_var(z3.BoolSort(ctx=self.ctx.z3_ctx), name_prefix='match_none_', value=False)
 
     def is_match(self, announcement):
-        print "========= ", "SMTMacthNone is_match BEG", "=" * 10
-        print "========= ", "SMTMacthNone is_match END", "=" * 10
         return self.match_var
 
     def get_is_match(self, announcement):
@@ -118,7 +116,6 @@ class SMTMatchAnd(SMTAbstractMatch):
         self.matched_announcements = {}  # Cache evaluated announcements
 
     def is_match(self, announcement):
-        print "========= ", "SMTMacthAnd is_match BEG", "=" * 10
         # Check cache first
         # TODO partially evaluate short cuts
         if announcement not in self.matched_announcements:
@@ -132,16 +129,15 @@ class SMTMatchAnd(SMTAbstractMatch):
                 value = False
                 is_concrete = True
             match_var = self.ctx.create_fresh_var(z3.BoolSort(ctx=self.ctx.z3_ctx), name_prefix='match_and_', value=value)
-            print "]]]]]]]]]> ", match_var
+            _tracer.trace("SMTMatchAnd.is_match: %s", match_var)
             if not is_concrete:
                 tmp = [result.var == True for result in results if not result.is_concrete]
                 tmp += [self.ctx.z3_ctx]
                 constraint = z3.And(*tmp)
                 match_con = self.ctx.register_constraint(
                     match_var.var == constraint, name_prefix='const_and_')
-                print "]]]]]]]]]> ", match_con
+                _tracer.trace("SMTMatchAnd.is_match: %s", match_con)
             self.matched_announcements[announcement] = match_var
-        print "========= ", "SMTMacthAnd is_match END", "=" * 10
         return self.matched_announcements[announcement]
 
     def __str__(self):
@@ -173,7 +169,6 @@ class SMTMatchOr(SMTAbstractMatch):
         self.matched_announcements = {}  # Cache evaluated announcements
 
     def is_match(self, announcement):
-        print "========= ", "SMTMacthOr is_match BEG", "=" * 10
         # Check cache first
         # TODO partially evaluate short cuts
         if announcement not in self.matched_announcements:
@@ -193,7 +188,6 @@ class SMTMatchOr(SMTAbstractMatch):
                 self.ctx.register_constraint(
                     match_var.var == constraint, name_prefix='const_or_')
             self.matched_announcements[announcement] = match_var
-        print "========= ", "SMTMacthOr is_match END", "=" * 10
         return self.matched_announcements[announcement]
 
     def __str__(self):
@@ -255,23 +249,22 @@ class SMTMatchSelectOne(SMTAbstractMatch):
         # Create map for the different matches
         self.matches = {}
         self.index_var = self.ctx.create_fresh_var(z3.IntSort(ctx=self.ctx.z3_ctx), name_prefix='SelectOne_index_')
-        print "=========> ", self.index_var
+        _tracer.trace("SMTMatchSelectOne.__init__: %s", self.index_var)
         for index, match in enumerate(matches):
             self.matches[index] = match
-            print ">>>>>>>>>> ", index, match
+            _tracer.trace("SMTMatchSelectOne.__init__: %s %s", index, match)
         # Make index in the range of number of matches
         smt_const = self.ctx.register_constraint(
             z3.And(
                 self.index_var.var >= 0,
                 self.index_var.var < index + 1, self.ctx.z3_ctx),
             name_prefix='SelectOne_index_range_')
-        print "=========> ", smt_const
+        self.ctx.register_selector(self.index_var, range(index + 1))
+        _tracer.trace("SMTMatchSelectOne.__init__: %s", smt_const)
 
     def _get_match(self, announcement, current_index=0):
-        print "." * 30, current_index, "BEGIN"
         """Recursively construct a match"""
         if current_index not in self.matches:
-            print "." * 30, current_index, "END", "END"
             # Base case
             return False
             return z3.And(self.index_var.var == current_index, False, self.ctx.z3_ctx)
@@ -289,25 +282,20 @@ class SMTMatchSelectOne(SMTAbstractMatch):
         # call chain attr1 -> attr2 -> attr3 -> ...
         # then select one
         next_attr = self._get_match(announcement, current_index + 1)
-        print "." * 30, current_index, "END"
         return z3.If(index_check, match_var, next_attr, ctx=self.ctx.z3_ctx)
 
     def is_match(self, announcement):
-        print "========= ", "SMTMatchSelectorOne is_match BEG", "=" * 10
-        print "\"" * 39, "\'" * 10
         if announcement not in self.matched_announcements:
             var = self.ctx.create_fresh_var(z3.BoolSort(ctx=self.ctx.z3_ctx))
-            print "---------> ", var
+            _tracer.trace("SMTMatchSelectOne.is_match: %s", var)
             self.matched_announcements[announcement] = var
             now_var = self._get_match(announcement)
-            print var.var
-            print now_var
+            _tracer.trace("SMTMatchSelectOne.is_match: %s == %s",
+                          var.var, now_var)
             # constraint = var.var == self._get_match(announcement)
             constraint = var.var == now_var
             con = self.ctx.register_constraint(constraint, name_prefix='SelectOne_match_')
-            print "---------> ", con
-        print "\"" * 50
-        print "========= ", "SMTMatchSelectorOne is_match END", "=" * 10
+            _tracer.trace("SMTMatchSelectOne.is_match: %s", con)
         return self.matched_announcements[announcement]
 
     def get_is_match(self, announcement):
@@ -343,7 +331,7 @@ class SMTMatchAttribute(SMTAbstractMatch):
         if value is None:
             asort = getattr(announcements[0], attribute).vsort
             value = ctx.create_fresh_var(asort, name_prefix='Match_attr_%s_' % attribute)
-            print "=========> ", value
+            _tracer.trace("SMTMatchAttribute.__init__: %s", value)
         assert isinstance(value, SMTVar)
         attr_sort = getattr(announcements[0], attribute).vsort
         err = "Type mismatch of attribute and value %s != %s" % (
@@ -356,7 +344,6 @@ class SMTMatchAttribute(SMTAbstractMatch):
         self.matched_announcements = {}  # Cache evaluated announcements
 
     def is_match(self, announcement):
-        print "========= ", "SMTMacthAttribute", self.attribute, "is_match BEG", "=" * 10
         attr = getattr(announcement, self.attribute)
         # Check cache first
         if announcement not in self.matched_announcements:
@@ -365,14 +352,13 @@ class SMTMatchAttribute(SMTAbstractMatch):
             if not is_symbolic(constraint):
                 value = constraint
             match_var = self.ctx.create_fresh_var(z3.BoolSort(ctx=self.ctx.z3_ctx), name_prefix='match_%s_var_' % self.attribute, value=value)
-            print "---------> ", match_var
+            _tracer.trace("SMTMatchAttribute.is_match: %s", match_var)
             if is_symbolic(constraint):
                 const = self.ctx.register_constraint(
                     match_var.var == constraint,
                     name_prefix='const_match_%s_' % self.attribute)
-                print "---------> ", const
+                _tracer.trace("SMTMatchAttribute.is_match: %s", const)
             self.matched_announcements[announcement] = match_var
-        print "========= ", "SMTMacthAttribute", self.attribute, "is_match END", "=" * 10
         return self.matched_announcements[announcement]
 
     def get_is_match(self, announcement):
@@ -402,7 +388,7 @@ class SMTMatchCommunity(SMTAbstractMatch):
         assert community in announcements[0].communities
         if not value:
             value = ctx.create_fresh_var(z3.BoolSort(ctx=self.ctx.z3_ctx), name_prefix='Match_Community_var_', value=True)
-            print "=========> ", value
+            _tracer.trace("SMTMatchCommunity.__init__: %s", value)
         assert isinstance(value, SMTVar)
         self.value = value
         self.community = community
@@ -410,7 +396,6 @@ class SMTMatchCommunity(SMTAbstractMatch):
         self.matched_announcements = {}  # Cache evaluated announcements
 
     def is_match(self, announcement):
-        print "========= ", "SMTMacthCommunity is_match BEG", "=" * 10
         # print "--------- ", announcement
         if announcement not in self.matched_announcements:
             attr = announcement.communities[self.community]
@@ -422,11 +407,10 @@ class SMTMatchCommunity(SMTAbstractMatch):
             if not is_symbolic(constraint):
                 value = constraint
             match_var = self.ctx.create_fresh_var(z3.BoolSort(ctx=self.ctx.z3_ctx), value=value)
-            print "]]]]]]]]]> ", match_var
+            _tracer.trace("SMTMatchCommunity.is_match: %s", match_var)
             if is_symbolic(constraint):
                 self.ctx.register_constraint(match_var.var == constraint)
             self.matched_announcements[announcement] = match_var
-        print "========= ", "SMTMacthCommunity is_match END", "=" * 10
         return self.matched_announcements[announcement]
 
     def get_is_match(self, announcement):
@@ -605,7 +589,7 @@ class SMTSetAttribute(SMTAbstractAction):
             vsort = getattr(announcements[0], attribute).vsort
             prefix = 'Set_%s_val' % attribute
             value = ctx.create_fresh_var(vsort, name_prefix=prefix)
-            print "=========> ", value
+            _tracer.trace("SMTSetAttribute.__init__: %s", value)
         assert isinstance(value, SMTVar)
         attr_sort = getattr(announcements[0], attribute).vsort
         err = "Type mismatch of attribute and value %s != %s" % (
@@ -693,7 +677,7 @@ class SMTSetCommunity(SMTAbstractAction):
         if value is None:
             prefix = 'Set_community_val_'
             value = ctx.create_fresh_var(z3.BoolSort(ctx=ctx.z3_ctx), name_prefix=prefix, value=True)
-            print "=========> ", value
+            _tracer.trace("SMTSetCommunity.__init__: %s", value)
         assert isinstance(value, SMTVar)
         err = "Value is not of type BoolSort %s" % (value.vsort)
         assert z3.BoolSort(ctx=ctx.z3_ctx) == value.vsort, err
@@ -807,7 +791,7 @@ class SMTSetOne(SMTAbstractAction):
         # Create map for the different actions
         self.actions = {}
         self.index_var = self.ctx.create_fresh_var(z3.IntSort(ctx=self.ctx.z3_ctx), name_prefix='SetOneIndex_')
-        print "=========> ", self.index_var
+        _tracer.trace("SMTSetOne.__init__: %s", self.index_var)
         index = itertools.count(0)
         for action in actions:
             err1 = 'All actions must have the same match'
@@ -820,6 +804,7 @@ class SMTSetOne(SMTAbstractAction):
                              self.index_var.var < index.next(), self.ctx.z3_ctx)
         self.ctx.register_constraint(index_range,
                                      name_prefix='setone_index_max_')
+        self.ctx.register_selector(self.index_var, range(len(self.actions)))
         self.execute()
 
     @property
@@ -935,7 +920,9 @@ class SMTSetLocalPref(SMTSetAttribute):
         super(SMTSetLocalPref, self).__init__(
             match, 'local_pref', value, announcements, ctx)
         if not self.value.is_concrete:
-            self.smt_ctx.register_constraint(self.value.var > 0, name_prefix="LocalPref_Bound")
+            self.smt_ctx.register_constraint(
+                self.smt_ctx.greater(self.value.var, 0),
+                name_prefix="LocalPref_Bound")
 
     def get_config(self):
         return ActionSetLocalPref(self.value.get_value())
@@ -955,7 +942,7 @@ class SMTSetPrefix(SMTSetAttribute):
             match, 'prefix', value, announcements, ctx)
 
     def get_config(self):
-        return ActionSetPrefix(desanitize_smt_name(self.value.get_value()))
+        return ActionSetPrefix(self.smt_ctx.smt_names.desanitize(self.value.get_value()))
 
 
 class SMTSetPeer(SMTSetAttribute):
@@ -1048,7 +1035,7 @@ class SMTSetPermitted(SMTSetAttribute):
                             new_var = oldp
                     else:
                         new_var = self.smt_ctx.create_fresh_var(z3.BoolSort(self.smt_ctx.z3_ctx), name_prefix='ActionPermittedVal')
-                        print "#########> ", new_var
+                        _tracer.trace("SMTSetPermitted.execute: %s", new_var)
                         vv = self.value.var if self.value.is_concrete else self.value.get_var()
                         attv = oldp.var if oldp.is_concrete else oldp.get_var()
                         # Permitted only overwrite announcements
@@ -1125,7 +1112,7 @@ class SMTSetNextHop(SMTSetAttribute):
             match, 'next_hop', value, announcements, ctx)
 
     def get_config(self):
-        return ActionSetNextHop(desanitize_smt_name(self.value.get_value()))
+        return ActionSetNextHop(self.smt_ctx.smt_names.desanitize(self.value.get_value()))
 
 
 class SMTSetMED(SMTSetAttribute):
@@ -1141,7 +1128,9 @@ class SMTSetMED(SMTSetAttribute):
         super(SMTSetMED, self).__init__(
             match, 'med', value, announcements, ctx)
         if not self.value.is_concrete:
-            self.smt_ctx.register_constraint(self.value.var > 0, name_prefix="MED_Bound")
+            self.smt_ctx.register_constraint(
+                self.smt_ctx.greater(self.value.var, 0),
+                name_prefix="MED_Bound")
 
     def get_config(self):
         return ActionSetMED(self.value.get_value())
@@ -1217,9 +1206,7 @@ class SMTMatchCommunityList(SMTAbstractMatch):
         self.smt_match = SMTMatchAnd(self.matches, self.announcements, self.ctx)
 
     def is_match(self, announcement):
-        print "========= ", "SMTMacthCommunityList is_match BEG", "=" * 10
         is_match_ret = self.smt_match.is_match(announcement)
-        print "========= ", "SMTMacthCommunityList is_match END", "=" * 10
         return is_match_ret;
 
     def get_is_match(self, announcement):
@@ -1228,7 +1215,7 @@ class SMTMatchCommunityList(SMTAbstractMatch):
     def _get_community_match(self, community):
         if not is_empty(community):
             var = self.ctx.create_fresh_var(vsort=z3.BoolSort(ctx=self.ctx.z3_ctx), value=True)
-            print "=========> SMT Match Commuity List", var
+            _tracer.trace("SMTMatchCommunityList.is_match: %s", var)
             match = SMTMatchCommunity(community=community, value=var,
                                       announcements=self.announcements,
                                       ctx=self.ctx)
@@ -1236,7 +1223,7 @@ class SMTMatchCommunityList(SMTAbstractMatch):
             comms = []
             for comm in self.ctx.communities:
                 var = self.ctx.create_fresh_var(z3.BoolSort(ctx=self.ctx.z3_ctx), value=True)
-                print "=========> SMT Match Commuity List", var
+                _tracer.trace("SMTMatchCommunityList.is_match: %s", var)
                 smt = SMTMatchCommunity(comm, var, self.announcements, self.ctx)
                 comms.append(smt)
             match = SMTMatchSelectOne(self.announcements, self.ctx, comms)
@@ -1266,28 +1253,26 @@ class SMTMatchIpPrefixList(SMTAbstractMatch):
         if not is_empty(ip):
             val = vsort.get_symbolic_value(ip)
             var = self.ctx.create_fresh_var(vsort, value=val)
-            print "=========> SMT Match Commuity List", var
+            _tracer.trace("SMTMatchIpPrefixList.is_match: %s", var)
             return SMTMatchPrefix(var, self.announcements, self.ctx)
 
         matches = []
         for ip in vsort.symbolic_values:
             var = self.ctx.create_fresh_var(vsort, value=ip)
-            print "=========> SMT Match Commuity List", var
+            _tracer.trace("SMTMatchIpPrefixList.is_match: %s", var)
             m = SMTMatchPrefix(var, self.announcements, self.ctx)
             matches.append(m)
         return SMTMatchSelectOne(self.announcements, self.ctx, matches)
 
     def is_match(self, announcement):
-        print "========= ", "SMTMacthIpPrefixList is_match BEG", "=" * 10
         is_match_ret = self.smt_match.is_match(announcement)
-        print "========= ", "SMTMacthIpPrefixList is_match END", "=" * 10
         return is_match_ret;
 
     def get_is_match(self, announcement):
         return self.smt_match.get_is_match(announcement)
 
     def get_config(self):
-        networks = [desanitize_smt_name(n) for n in self.smt_match.get_config() if n]
+        networks = [self.ctx.smt_names.desanitize(n) for n in self.smt_match.get_config() if n]
         ip_list = IpPrefixList(name=self.ip_list.name,
                                access=self.ip_list.access,
                                networks=networks)
@@ -1319,9 +1304,7 @@ class SMTMatch(SMTAbstractMatch):
             self.match_dispatch[type(match)]()
 
     def is_match(self, announcement):
-        print "========= ", "SMTMacth is_match BEG", "=" * 10
         is_match_ret = self.smt_match.is_match(announcement)
-        print "========= ", "SMTMacth is_match END", "=" * 10
         return is_match_ret;
 
     def get_is_match(self, announcement):
@@ -1333,19 +1316,19 @@ class SMTMatch(SMTAbstractMatch):
         if value:
             value = vsort.get_symbolic_value(value)
         self.value = self.ctx.create_fresh_var(vsort=vsort, value=value)
-        print "=========> _load_match_next_hop", self.value
+        _tracer.trace("_load_match_next_hop: %s", self.value)
         self.smt_match = SMTMatchNextHop(self.value, self.announcements, self.ctx)
 
     def _load_match_local_pref(self):
         value = self.match.match if not is_empty(self.match.match) else None
-        self.value = self.ctx.create_fresh_var(vsort=z3.IntSort(ctx=self.ctx.z3_ctx), value=value)
-        print "=========> _load_match_local_pref", self.value
+        self.value = self.ctx.create_fresh_var(vsort=self.ctx.attr_sort('local_pref'), value=value)
+        _tracer.trace("_load_match_local_pref: %s", self.value)
         self.smt_match = SMTMatchLocalPref(self.value, self.announcements, self.ctx)
 
     def _load_match_med(self):
         value = self.match.match if not is_empty(self.match.match) else None
-        self.value = self.ctx.create_fresh_var(vsort=z3.IntSort(ctx=self.ctx.z3_ctx), value=value)
-        print "=========> _load_match_med", self.value
+        self.value = self.ctx.create_fresh_var(vsort=self.ctx.attr_sort('med'), value=value)
+        _tracer.trace("_load_match_med: %s", self.value)
         self.smt_match = SMTMatchMED(self.value, self.announcements, self.ctx)
 
     def _load_match_as_path(self):
@@ -1354,13 +1337,13 @@ class SMTMatch(SMTAbstractMatch):
         if value:
             value = vsort.get_symbolic_value(value)
         self.value = self.ctx.create_fresh_var(vsort=vsort, value=value)
-        print "=========> _load_match_as_path", self.value
+        _tracer.trace("_load_match_as_path: %s", self.value)
         self.smt_match = SMTMatchASPath(self.value, self.announcements, self.ctx)
 
     def _load_match_as_path_len(self):
         value = self.match.match if not is_empty(self.match.match) else None
-        self.value = self.ctx.create_fresh_var(vsort=z3.IntSort(ctx=self.ctx.z3_ctx), value=value)
-        print "=========> _load_match_as_path_len", self.value
+        self.value = self.ctx.create_fresh_var(vsort=self.ctx.attr_sort('as_path_len'), value=value)
+        _tracer.trace("_load_match_as_path_len: %s", self.value)
         self.smt_match = SMTMatchASPathLen(self.value, self.announcements, self.ctx)
 
     def _load_match_peer(self):
@@ -1368,7 +1351,7 @@ class SMTMatch(SMTAbstractMatch):
         vsort = self.ctx.get_enum_type(PEER_SORT)
         if value:
             value = vsort.get_symbolic_value(value)
-        print "=========> _load_match_peer", self.value
+        _tracer.trace("_load_match_peer: %s", self.value)
         self.value = self.ctx.create_fresh_var(vsort=vsort, value=value)
         self.smt_match = SMTMatchPeer(self.value, self.announcements, self.ctx)
 
@@ -1382,15 +1365,11 @@ class SMTMatch(SMTAbstractMatch):
 
     def _load_match_select_one(self):
         matches = []
-        print "M" * 60
         for match in self.match.match:
-            print "M" * 40
-            print match
+            _tracer.trace("SMTMatch._load_match_select_one: %s", match)
             smt_match = SMTMatch(match, self.announcements, self.ctx)
             matches.append(smt_match)
-        print "M" * 60
         self.smt_match = SMTMatchSelectOne(self.announcements, self.ctx, matches)
-        print "M" * 60
 
     def __str__(self):
         return "SMTMatch(%s)" % self.smt_match
@@ -1433,7 +1412,7 @@ class SMTActions(SMTAbstractAction):
         prev_ann_ctx = self.old_announcements
         for action in self.actions:
             smt_action = self.action_dispatch[type(action)](action, prev_ann_ctx)
-            print "-----------------------", smt_action
+            _tracer.trace("SMTActions.execute: %s", smt_action)
             if isinstance(smt_action, list):
                 self.smt_actions.extend(smt_action)
                 prev_ann_ctx = smt_action[-1].announcements
@@ -1443,16 +1422,7 @@ class SMTActions(SMTAbstractAction):
             if self._selector:
                 for index, ann in enumerate(self.smt_actions[-1].announcements):
                     prev = ann.prev_announcement
-                    print ann
-                    print prev
-                    if ann == prev:
-                        print "(" * 90
-                        print "(" * 90
-                        print "(" * 90
-                    else:
-                        print ")" * 90
-                        print ")" * 90
-                        print ")" * 90
+                    _tracer.trace("SMTActions.execute: %s prev %s", ann, prev)
                     if prev in self._selector:
                         # TODO not understand
                         self._selector[ann] = self._selector.get(prev)
@@ -1478,7 +1448,7 @@ class SMTActions(SMTAbstractAction):
             # Partial evaluate
             value = True if action.value == Access.permit else False
         var = self.ctx.create_fresh_var(vsort=vsort, value=value)
-        print "=========> _set_access", var
+        _tracer.trace("_set_access: %s", var)
         return SMTSetPermitted(self.smt_match, var, anns, self.ctx)
 
     def _set_community(self, community, anns):
@@ -1487,13 +1457,13 @@ class SMTActions(SMTAbstractAction):
         vsort = z3.BoolSort(ctx=self.ctx.z3_ctx)
         if community:
             var = self.ctx.create_fresh_var(vsort=vsort, value=True)
-            print "=========> _set_community", var
+            _tracer.trace("_set_community: %s", var)
             return SMTSetCommunity(self.smt_match, community, var, anns, self.ctx)
         else:
             actions = []
             for community in self.ctx.communities:
                 var = self.ctx.create_fresh_var(vsort=vsort, value=True)
-                print "=========> _set_community inline", var
+                _tracer.trace("_set_community inline: %s", var)
                 tmp = SMTSetCommunity(self.smt_match, community, var, anns, self.ctx)
                 actions.append(tmp)
             return SMTSetOne(self.smt_match, anns, self.ctx, actions)
@@ -1504,7 +1474,7 @@ class SMTActions(SMTAbstractAction):
         if action.additive == False:
             for comm in self.ctx.communities:
                 var = self.ctx.create_fresh_var(z3.BoolSort(ctx=self.ctx.z3_ctx), value=False)
-                print "=========> _set_communities", var
+                _tracer.trace("_set_communities: %s", var)
                 a = SMTSetCommunity(self.match, comm, var, prev_anns, self.ctx)
                 prev_anns = a.announcements
                 # Dont add these explicit resets
@@ -1517,9 +1487,9 @@ class SMTActions(SMTAbstractAction):
 
     def _set_local_pref(self, action, anns):
         value = action.value if not is_empty(action.value) else None
-        vsort = z3.IntSort(ctx=self.ctx.z3_ctx)
+        vsort = self.ctx.attr_sort('local_pref')
         var = self.ctx.create_fresh_var(vsort=vsort, value=value)
-        print "=========> _set_local_pref", var
+        _tracer.trace("_set_local_pref: %s", var)
         return SMTSetLocalPref(self.smt_match, var, anns, self.ctx)
 
     def _set_next_hop(self, action, anns):
@@ -1528,13 +1498,12 @@ class SMTActions(SMTAbstractAction):
         if value:
             value = vsort.get_symbolic_value(value)
         var = self.ctx.create_fresh_var(vsort=vsort, value=value)
-        print "=========> _set_next_hop", var
+        _tracer.trace("_set_next_hop: %s", var)
         return SMTSetNextHop(self.smt_match, var, anns, self.ctx)
 
     def _set_one(self, action, anns):
         smt_actions = []
         for action in action.value:
-            print "=========> _set_one"
             smt_action = self.action_dispatch[type(action)](action, anns)
             if isinstance(smt_action, list):
                 smt_actions.extend(smt_action)
@@ -1548,7 +1517,7 @@ class SMTActions(SMTAbstractAction):
         if value:
             value = vsort.get_symbolic_value(value)
         var = self.ctx.create_fresh_var(vsort=vsort, value=value)
-        print "=========> _set_prefix", var
+        _tracer.trace("_set_prefix: %s", var)
         return SMTSetPrefix(self.smt_match, var, anns, self.ctx)
 
     def get_config(self):
@@ -1594,7 +1563,6 @@ class SMTSelectorMatch(SMTAbstractMatch):
         self.matched_announcements = {}  # Cache evaluated announcements
 
     def is_match(self, announcement):
-        print "========= ", "SMTSelectorMacth is_match BEG", "=" * 10
         #if not self.selectors_vars:
         #    return self.match.is_match(announcement)
         if announcement not in self.matched_announcements:
@@ -1609,14 +1577,13 @@ class SMTSelectorMatch(SMTAbstractMatch):
             if sel.is_concrete and sel.get_value() != self.selector_value:
                 value = False
             match_var = self.ctx.create_fresh_var(z3.BoolSort(ctx=self.ctx.z3_ctx), name_prefix='match_sel_', value=value)
-            print "]]]]]]]]]> ", match_var
+            _tracer.trace("SMTSelectorMatch.is_match: %s", match_var)
             if not value:
                 self.ctx.register_constraint(
                     z3.And(is_match.var,
                            sel.var == self.selector_value, self.ctx.z3_ctx) == match_var.var,
                     name_prefix='Selector_')
             self.matched_announcements[announcement] = match_var
-        print "========= ", "SMTSelectorMacth is_match END", "=" * 10
         return self.matched_announcements[announcement]
 
     def get_is_match(self, announcement):
@@ -1643,19 +1610,14 @@ class SMTRouteMapLine(SMTAbstractAction):
         """
         log_name = '%s.%s' % (self.__module__, self.__class__.__name__)
         self.log = logging.getLogger(log_name)
-        print "R" * 70
         self.log.debug("Parsing Route Map line: %d to process: %d announcements %s",
                        line.lineno, len(announcements), announcements)
-        for i in range(len(announcements)):
-            print announcements[i]
-        print "R" * 70
         self.ctx = ctx
         self.line = line
         self._old_announcements = announcements
         self.line_no_match = line_no_match
 
-        print "+" * 30, "SMTMatch & SMTMachAnd", "+" * 30
-        print line.matches
+        _tracer.trace("SMTRouteMapLine.__init__ matches: %s", line.matches)
         if not line.matches:
             # Empty matches all by default
             self.smt_match = SMTMatch(None, self.old_announcements, self.ctx)
@@ -1672,7 +1634,6 @@ class SMTRouteMapLine(SMTAbstractAction):
                 ctx=self.ctx)
 
         # Ensure that only one route map is selected
-        print "+" * 30, "SMTSelectorMatch", "+" * 30
         self.selector_match = SMTSelectorMatch(
             selectors_vars=line_no_match,
             selector_value=self.line.lineno,
@@ -1687,8 +1648,7 @@ class SMTRouteMapLine(SMTAbstractAction):
             assert isinstance(line.actions, Iterable)
             actions += line.actions
         # Call the actions
-        print "+" * 30, "SMTActions", "+" * 30
-        print actions
+        _tracer.trace("SMTRouteMapLine.__init__ actions: %s", actions)
         self.smt_actions = SMTActions(
             match=self.selector_match,
             actions=actions,
@@ -1697,10 +1657,8 @@ class SMTRouteMapLine(SMTAbstractAction):
             selector=self.line_no_match)
         self._announcements = self.smt_actions.announcements
 
-        print "S" * 50
-        print self.smt_match
-        print self.smt_actions
-        print "S" * 50
+        _tracer.trace("SMTRouteMapLine.__init__: %s %s",
+                      self.smt_match, self.smt_actions)
 
     @property
     def announcements(self):
@@ -1756,10 +1714,9 @@ class SMTRouteMap(SMTAbstractAction):
         name_prefix = 'SelectOneRmapLineIndex_'
         line_numbers = [line.lineno for line in route_map.lines]
         selectors = {}
-        print "++++++++++++++++++++++++++ SMTRouteMap"
         for announcement in self.old_announcements:
             index_var = self.ctx.create_fresh_var(z3.IntSort(ctx=self.ctx.z3_ctx), name_prefix=name_prefix)
-            print "=========> ", index_var
+            _tracer.trace("SMTRouteMap.__init__: %s", index_var)
             selectors[announcement] = index_var
             SELECTOR[announcement] = index_var
             # Bound the selector variable only to the available
@@ -1768,15 +1725,21 @@ class SMTRouteMap(SMTAbstractAction):
             # route map line numbers
             const_var = self.ctx.register_constraint(z3.Or(*possible_vals),
                             name_prefix='RmapIndexBound_%s_' % self.route_map.name)
-            print "=========> ", const_var
-
+            self.ctx.register_selector(index_var, line_numbers)
+            _tracer.trace("SMTRouteMap.__init__: %s", const_var)
+
+        # Map an announcement to whether it's not matched by the lines
+        # before the current one: True, False or a symbolic var
+        # (used by RMAP_ORDER_CHAINED)
+        self._unmatched = dict((ann, True) for ann in self.old_announcements)
+        chained = self.ctx.rmap_order == RMAP_ORDER_CHAINED
         # TODO not understand
         prev_anns = self._old_announcements
         matched_anns = []
         for i, line in enumerate(self.route_map.lines):
             # TODO box = SMTRouteMapLine
-            print "++++++++++++++++++++++++++ SMTRouteMapLine"
-            box = SMTRouteMapLine(selectors, line, prev_anns, self.ctx)
+            with self.ctx.provenance_scope(line=line.lineno):
+                box = SMTRouteMapLine(selectors, line, prev_anns, self.ctx)
             self.smt_lines.append(box)
             # Cascade changes
             prev_anns = self.smt_lines[-1].announcements
@@ -1784,9 +1747,11 @@ class SMTRouteMap(SMTAbstractAction):
             # different route map lines
             if len(self.route_map.lines) < 2:
                 continue
+            if chained:
+                self._chain_line_order(i, line, box, selectors)
+                continue
             for ann in self.old_announcements:
                 index_var = selectors[ann]
-                print "++++++++++++++++++++++++++ is_match"
                 # is_match = box.smt_match.is_match(ann)
                 is_match = box.smt_match.get_is_match(ann)
                 if i == 0:
@@ -1811,10 +1776,61 @@ class SMTRouteMap(SMTAbstractAction):
                         ctx=self.ctx.z3_ctx)
                 self.ctx.register_constraint(
                     const,
-                    name_prefix='rmap_%s_order_' % self.route_map.name)
+                    name_prefix='rmap_%s_order_' % self.route_map.name,
+                    line=line.lineno)
         self.log.debug("End parsing route map %s", self.route_map.name)
         self._announcements = self.smt_lines[-1].announcements
 
+    def _chain_line_order(self, i, line, box, selectors):
+        """
+        Ensure an announcement is matched by the first line that matches it,
+        with one cumulative var per line and announcement that holds when
+        none of the previous lines matched it. It's equivalent to negating
+        the matches of all the previous lines, but linear in the number
+        of lines.
+        """
+        last = i == len(self.route_map.lines) - 1
+        for ann in self.old_announcements:
+            index_var = selectors[ann]
+            is_match = box.smt_match.get_is_match(ann)
+            unmatched = self._unmatched[ann]
+            if unmatched is True:
+                first_match = is_match.var == True
+            elif unmatched is False:
+                first_match = False
+            else:
+                first_match = z3.And(unmatched, is_match.var == True,
+                                     self.ctx.z3_ctx)
+            const = z3.If(first_match,
+                          index_var.var == line.lineno,
+                          index_var.var != line.lineno,
+                          ctx=self.ctx.z3_ctx)
+            self.ctx.register_constraint(
+                const,
+                name_prefix='rmap_%s_order_' % self.route_map.name,
+                line=line.lineno)
+            if last:
+                continue
+            # Not matched by this line nor by the previous ones
+            if unmatched is False or \
+                    (is_match.is_concrete and is_match.get_value()):
+                self._unmatched[ann] = False
+            elif is_match.is_concrete:
+                self._unmatched[ann] = unmatched
+            else:
+                var = self.ctx.create_fresh_var(
+                    z3.BoolSort(ctx=self.ctx.z3_ctx),
+                    name_prefix='rmap_%s_unmatched_' % self.route_map.name)
+                not_matched = z3.Not(is_match.var, self.ctx.z3_ctx)
+                if unmatched is not True:
+                    not_matched = z3.And(unmatched, not_matched,
+                                         self.ctx.z3_ctx)
+                self.ctx.register_constraint(
+                    var.var == not_matched,
+                    name_prefix='rmap_%s_unmatched_' % self.route_map.name,
+                    line=line.lineno)
+                self._unmatched[ann] = var.var
+
     @property
     def announcements(self):
         return self._announcements
@@ -5,6 +5,11 @@ Helper class to keep track of SMT vars and constraints
 """
 
 import itertools
+import sys
+import weakref
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
 from timeit import default_timer as timer
 
 import z3
@@ -15,11 +20,47 @@ from tekton.bgp import Announcement
 from ipaddress import IPv4Address
 from ipaddress import IPv6Address
 
+from synet.utils.smt_cache import fingerprint
+from synet.utils.smt_cache import read_model_values
+from synet.utils.smt_cubes import choose_selectors
+from synet.utils.smt_cubes import enumerate_cubes
+from synet.utils.smt_cubes import solve_cubes
+from synet.utils.smt_dump import SMTDumper
+from synet.utils.smt_dump import write_smt2
+from synet.utils.smt_metrics import SolveMetrics
+from synet.utils.smt_metrics import read_z3_statistics
+from synet.utils.smt_mus import CoreMinimization
+from synet.utils.smt_portfolio import portfolio_configs
+from synet.utils.smt_portfolio import solve_portfolio
+from synet.utils.smt_portfolio import ValuesModel
+from synet.utils.smt_provenance import expr_var_names
+from synet.utils.smt_slicing import REQUIREMENT_PREFIXES
+from synet.utils.smt_slicing import SlicedModel
+from synet.utils.smt_slicing import cone_of_influence
+from synet.utils.smt_substitution import EqualitySubstitution
+from synet.utils.smt_substitution import SubstitutedModel
+from synet.utils.smt_snapshot import FormulaSnapshot
+from synet.utils.smt_snapshot import SORT_BOOL
+from synet.utils.smt_snapshot import SORT_BV
+from synet.utils.smt_snapshot import SORT_ENUM
+from synet.utils.smt_snapshot import SORT_INT
+from synet.utils.smt_tactics import create_solver
+from synet.utils.smt_tactics import tactic_name
+from synet.utils.smt_threads import check_context
+from synet.utils.smt_tuning import KIND_BGP
+from synet.utils.smt_tuning import default_tuning
+from synet.utils.smt_tuning import problem_header
+from synet.utils.tracing import SMT
+from synet.utils.tracing import get_tracer
+
 
 __author__ = "Ahmed El-Hassany"
 __email__ = "a.hassany@gmail.com"
 
 
+_tracer = get_tracer(SMT)
+
+
 # Used for the names of EnumTypes
 ANNOUNCEMENT_SORT = 'AnnSort'
 PREFIX_SORT = 'PrefixSort'
@@ -29,6 +70,35 @@ ASPATH_SORT = 'ASPathSort'
 NEXT_HOP_SORT = 'NextHopSort'
 VALUENOTSET = 'EMPTY?Value'
 
+# Encodings of the compare functions of EnumTypes
+# Uninterpreted compare function with pairwise axioms
+COMPARE_AXIOMS = 'axioms'
+# Each enum value gets a symbolic integer rank
+COMPARE_INT_RANK = 'int_rank'
+# Each enum value gets a symbolic bounded bit-vector rank
+COMPARE_BV_RANK = 'bv_rank'
+
+# The integer BGP attributes that can be encoded as bit-vectors
+BV_ATTRS = ('local_pref', 'med', 'as_path_len', 'router_id')
+# Widths that fit any value of the attributes
+DEFAULT_BV_WIDTHS = dict((attr, 32) for attr in BV_ATTRS)
+# Infer the widths from the concrete values, see infer_bv_widths
+BV_INFER = 'infer'
+# The narrowest inferred width, leaves room for the synthesized values
+MIN_BV_WIDTH = 8
+
+# Encodings of the first-match order of the route map lines
+# Negate the matches of all the previous lines, O(lines^2) per announcement
+RMAP_ORDER_PAIRWISE = 'pairwise'
+# Chain one "not matched yet" var per line, O(lines) per announcement
+RMAP_ORDER_CHAINED = 'chained'
+
+# Strategies to check the constraints of a SolverContext
+# Assert all constraints with assert_and_track
+SOLVE_TRACKED = 'tracked'
+# Check with plain add, re-check with tracking only to read the unsat core
+SOLVE_TWO_PHASE = 'two_phase'
+
 SMT_NAME_MAP = {
     '.': '_DOT_',
     '/': '_SLASH_',
@@ -67,6 +137,49 @@ def desanitize_smt_name(name):
     return tmp
 
 
+class SMTNameTable(object):
+    """
+    Memoize sanitize_smt_name and desanitize_smt_name.
+    Each SolverContext owns one table, so the memory is released with the
+    context. The table is cleared when it holds more than max_size entries.
+    """
+
+    def __init__(self, max_size=100000):
+        """
+        :param max_size: max number of names cached in each direction
+        """
+        self.max_size = max_size
+        self._sanitized = {}  # Map a raw name to the SMT name
+        self._desanitized = {}  # Map an SMT name to the raw name
+
+    def sanitize(self, name):
+        """Memoized version of sanitize_smt_name"""
+        try:
+            return self._sanitized[name]
+        except KeyError:
+            pass
+        if len(self._sanitized) >= self.max_size:
+            self._sanitized.clear()
+        sanitized = sanitize_smt_name(name)
+        self._sanitized[name] = sanitized
+        return sanitized
+
+    def desanitize(self, name):
+        """Memoized version of desanitize_smt_name"""
+        try:
+            return self._desanitized[name]
+        except KeyError:
+            pass
+        if len(self._desanitized) >= self.max_size:
+            self._desanitized.clear()
+        desanitized = desanitize_smt_name(name)
+        self._desanitized[name] = desanitized
+        return desanitized
+
+    def __len__(self):
+        return len(self._sanitized) + len(self._desanitized)
+
+
 def is_empty(var):
     """Return true if the variable is VALUENOTSET"""
     if hasattr(var, 'get_id'):
@@ -90,6 +203,26 @@ def decode_as_path(as_path_key):
     return [int(asnum) for asnum in as_path_key.split('_')[2:]]
 
 
+def infer_bv_widths(values, num_router_ids=0, headroom=1,
+                    min_width=MIN_BV_WIDTH):
+    """
+    The bit-vector widths that fit the concrete values of each attribute,
+    with headroom extra bits for the synthesized values.
+    The values are unsigned, compared with ULT/UGT (see SolverContext.less)
+    :param values: dict of attribute -> list of the concrete values in
+                   the announcements and the sketch
+    :param num_router_ids: the number of distinct router IDs needed
+    :return: dict of attribute -> width
+    """
+    widths = {}
+    for attr in BV_ATTRS:
+        max_value = max([0] + [int(value) for value in values.get(attr, [])])
+        if attr == 'router_id':
+            max_value = max(max_value, num_router_ids)
+        widths[attr] = max(min_width, max_value.bit_length() + headroom)
+    return widths
+
+
 def read_announcements(announcements, smt_ctx):
     """
     Read announcements provided by the user and generate a list of
@@ -104,10 +237,10 @@ def read_announcements(announcements, smt_ctx):
             ('peer', PEER_SORT, None),
             ('origin', BGP_ORIGIN_SORT, lambda x: x.name),
             ('as_path', ASPATH_SORT, get_as_path_key),
-            ('as_path_len', z3.IntSort(ctx=smt_ctx.z3_ctx), None),
+            ('as_path_len', smt_ctx.attr_sort('as_path_len'), None),
             ('next_hop', NEXT_HOP_SORT, None),
-            ('local_pref', z3.IntSort(ctx=smt_ctx.z3_ctx), None),
-            ('med', z3.IntSort(ctx=smt_ctx.z3_ctx), None),
+            ('local_pref', smt_ctx.attr_sort('local_pref'), None),
+            ('med', smt_ctx.attr_sort('med'), None),
             ('permitted', z3.BoolSort(ctx=smt_ctx.z3_ctx), None),
         ]
         for attr, vsort, conv in all_attrs:
@@ -140,18 +273,27 @@ def read_announcements(announcements, smt_ctx):
 class EnumType(object):
     """Create a enum sort"""
 
-    def __init__(self, name, values, z3_ctx):
+    def __init__(self, name, values, z3_ctx, smt_names=None):
         """
         :param name: Name of the type
         :param values: list of all possible values
+        :param smt_names: SMTNameTable to sanitize the looked up values
         """
         assert values, "Requires at least one value for '%s'" % name
         self._name = name
         assert self._name[0].isalpha(), "Name is not valid {}".format(self.name)
         self._concrete_values = values
         self.z3_ctx = z3_ctx
+        self.smt_names = smt_names if smt_names else SMTNameTable()
         self._sort, self._symbolic_values = z3.EnumSort(name, values,
                                                         ctx=self.z3_ctx)
+        # Map a concrete value to its index in the list of values
+        self._concrete_index = dict(
+            (value, index) for index, value in enumerate(values))
+        # Map the z3 AST id of a symbolic value to its index
+        self._symbolic_index = dict(
+            (var.get_id(), index)
+            for index, var in enumerate(self._symbolic_values))
 
 
     @property
@@ -176,24 +318,28 @@ class EnumType(object):
 
     def get_symbolic_value(self, value):
         """Given a string value return the Z3 value"""
-        value = sanitize_smt_name(value)
-        if value not in self._concrete_values:
+        value = self.smt_names.sanitize(value)
+        if value not in self._concrete_index:
             err = "Value '%s' is not defined in %s" % (
                 value, self.concrete_values)
             raise ValueError(err)
-        indexof = self._concrete_values.index(value)
-        return self.symbolic_values[indexof]
+        return self._symbolic_values[self._concrete_index[value]]
 
     def get_concrete_value(self, var):
         """Given a z3 variable, return the actual string value"""
         assert is_symbolic(var)
-        if var not in self._symbolic_values:
+        indexof = self._symbolic_index.get(var.get_id(), None)
+        if indexof is None or var.ctx != self.z3_ctx or \
+                not var.eq(self._symbolic_values[indexof]):
             err = "Symbolic value '{}' of type '{}' is not defined. " \
                   "Current defined values are: {}".format(
                 var, self.name, self.symbolic_values)
             raise ValueError(err)
-        indexof = self.symbolic_values.index(var)
-        return self.concrete_values[indexof]
+        return self._concrete_values[indexof]
+
+    def has_value(self, value):
+        """Return True if the (sanitized) string value is defined"""
+        return value in self._concrete_index
 
     def __str__(self):
         return "EnumType(%s, %s)" % (self.name, len(self.concrete_values))
@@ -202,33 +348,201 @@ class EnumType(object):
         return "EnumType(%s)" % self.name
 
 
+class RankCompare(object):
+    """
+    Compare the values of an EnumType by their ranks.
+    Each enum value is mapped to a symbolic rank (Int or bounded BitVec),
+    the solver is free to choose the ranks, hence the order of the values.
+    Comparisons are plain arithmetic over the ranks, thus no pairwise axioms
+    are required.
+    """
+
+    def __init__(self, name, vsort, comparator, compare_vars, use_bv=False):
+        """
+        :param name: name of the compare function
+        :param vsort: the EnumType to be compared
+        :param comparator: the EnumType of GREATER, LESS, EQ, UNKNOWN
+        :param compare_vars: symbolic values of the comparator
+        :param use_bv: if True the ranks are bit-vectors wide enough to
+                       hold a distinct rank for each value
+        """
+        self._name = name
+        self._vsort = vsort
+        self.z3_ctx = vsort.z3_ctx
+        if use_bv:
+            width = max(1, (len(vsort.concrete_values) - 1).bit_length())
+            rank_sort = z3.BitVecSort(width, ctx=self.z3_ctx)
+        else:
+            rank_sort = z3.IntSort(ctx=self.z3_ctx)
+        self._use_bv = use_bv
+        self._rank = z3.Function('rank_%s' % name, vsort.sort, rank_sort)
+        self._comparator = comparator
+        self._compare_vars = compare_vars
+
+    @property
+    def name(self):
+        """The name of the compare function"""
+        return self._name
+
+    @property
+    def vsort(self):
+        """The EnumType compared by this function"""
+        return self._vsort
+
+    @property
+    def use_bv(self):
+        """True if the ranks are bit-vectors"""
+        return self._use_bv
+
+    @property
+    def rank_decl(self):
+        """The z3 function mapping a value to its rank"""
+        return self._rank
+
+    def rank(self, var):
+        """The symbolic rank of a z3 enum value"""
+        return self._rank(var)
+
+    def greater(self, var1, var2):
+        """True if var1 is ranked higher than var2"""
+        if self._use_bv:
+            return z3.UGT(self.rank(var1), self.rank(var2))
+        return self.rank(var1) > self.rank(var2)
+
+    def less(self, var1, var2):
+        """True if var1 is ranked lower than var2"""
+        if self._use_bv:
+            return z3.ULT(self.rank(var1), self.rank(var2))
+        return self.rank(var1) < self.rank(var2)
+
+    def equal(self, var1, var2):
+        """True if var1 and var2 have the same rank"""
+        return self.rank(var1) == self.rank(var2)
+
+    def __call__(self, var1, var2):
+        """
+        Drop-in replacement of the uninterpreted compare function,
+        returns a value of the comparator sort
+        """
+        GREATER, LESS, EQUAL, INCOMPLETE = self._compare_vars
+        return z3.If(self.greater(var1, var2), GREATER,
+                     z3.If(self.less(var1, var2), LESS, EQUAL,
+                           ctx=self.z3_ctx),
+                     ctx=self.z3_ctx)
+
+    def __repr__(self):
+        return "RankCompare(%s)" % self.name
+
+
+class ModelRef(object):
+    """
+    Shared reference to the latest z3 model of a SolverContext,
+    used to concretize the variables lazily
+    """
+
+    def __init__(self):
+        self.model = None
+
+
+class VarTable(object):
+    """
+    Columnar storage of the state of SMTVars: the name, sort,
+    concrete flag, and value of the var with id i are in row i.
+    """
+
+    def __init__(self, model_ref=None):
+        """
+        :param model_ref: optional ModelRef, when it holds a model the vars
+                          are concretized the first time they're consulted
+        """
+        self.model_ref = model_ref
+        self.names = []
+        self.sort_ids = array('H')
+        self.concrete = bytearray()
+        self.values = []
+        self.sorts = []  # Map a sort id to the sort
+        self.sort_is_enum = []  # Map a sort id to True if it's an EnumType
+        self._sort_index = {}  # Map a sort to its id
+
+    def __len__(self):
+        return len(self.names)
+
+    def _get_sort_id(self, vsort):
+        sort_id = self._sort_index.get(vsort, None)
+        if sort_id is None:
+            sort_id = len(self.sorts)
+            self.sorts.append(vsort)
+            self.sort_is_enum.append(isinstance(vsort, EnumType))
+            self._sort_index[vsort] = sort_id
+        return sort_id
+
+    def append(self, name, vsort, is_concrete, value):
+        """Add a new row and return its id"""
+        self.names.append(name)
+        self.sort_ids.append(self._get_sort_id(vsort))
+        self.concrete.append(1 if is_concrete else 0)
+        self.values.append(value)
+        return len(self.names) - 1
+
+    def truncate(self, size):
+        """Remove all the rows starting from size"""
+        del self.names[size:]
+        del self.sort_ids[size:]
+        del self.concrete[size:]
+        del self.values[size:]
+
+    def num_concrete(self):
+        """The number of rows that have a concrete value"""
+        return self.concrete.count('\x01')
+
+    def memory_usage(self):
+        """Approximate size in bytes of each column"""
+        return OrderedDict([
+            ('names', sys.getsizeof(self.names) +
+             sum(sys.getsizeof(name) for name in self.names)),
+            ('sort_ids', self.sort_ids.buffer_info()[1] *
+             self.sort_ids.itemsize),
+            ('concrete', sys.getsizeof(self.concrete)),
+            ('values', sys.getsizeof(self.values)),
+        ])
+
+
 class SMTVar(object):
-    """Hold Symbolic variables in SyNET"""
+    """
+    Hold Symbolic variables in SyNET.
+    The state of the var is kept in a row of a VarTable.
+    """
+    __slots__ = ['_table', '_id', '_var', '_hash']
 
-    def __init__(self, name, vsort, value=None):
+    def __init__(self, name, vsort, value=None, model_ref=None, table=None):
         """
         :param name: The name of z3 variable
         :param vsort: The type of the variable, support z3.IntSort & EnumType
         :param value: optional conrete value for the var
+        :param model_ref: optional ModelRef, when it holds a model the var
+                          is concretized the first time it's consulted
+        :param table: the VarTable to store the var in, a table of
+                      a single row is created if None
         """
         assert isinstance(name, basestring)
-        self._name = name
-        assert self._name[0].isalpha(), "Name is not valid {}".format(self.name)
-        self._is_enum = isinstance(vsort, EnumType)
+        assert name[0].isalpha(), "Name is not valid {}".format(name)
+        is_enum = isinstance(vsort, EnumType)
         if value is None or is_empty(value):
             is_concrete = False
             value = VALUENOTSET
         else:
             is_concrete = True
-            if self._is_enum and not is_symbolic(value):
+            if is_enum and not is_symbolic(value):
                 value = vsort.get_symbolic_value(value)
-        if self._is_enum:
-            self._var = z3.Const(self.name, vsort.sort)
+        if is_enum:
+            self._var = z3.Const(name, vsort.sort)
         else:
-            self._var = z3.Const(self.name, vsort)
-        self._vsort = vsort
-        self._is_concrete = is_concrete
-        self._value = value
+            self._var = z3.Const(name, vsort)
+        if table is None:
+            table = VarTable(model_ref)
+        self._table = table
+        self._id = table.append(name, vsort, is_concrete, value)
+        self._hash = hash((name, self._var.get_id()))
 
     def __str__(self):
         return "SMTVar({}, {}, {})".format(
@@ -236,9 +550,11 @@ class SMTVar(object):
             self.get_value() if self.is_concrete else '?')
 
     def __hash__(self):
-        return hash((self.name, self.get_var().get_id()))
+        return self._hash
 
     def __eq__(self, other):
+        if self._hash != getattr(other, '_hash', None):
+            return False
         if self.name != getattr(other, 'name', None):
             return False
         other_var = getattr(other, 'get_var', None)
@@ -246,20 +562,57 @@ class SMTVar(object):
             return False
         return True
 
+    @property
+    def id(self):
+        """The id of the var in its VarTable"""
+        return self._id
+
     @property
     def name(self):
         """The name of variable, should be unique"""
-        return self._name
+        return self._table.names[self._id]
 
     @property
     def vsort(self):
         """The type of the variable"""
-        return self._vsort
+        return self._table.sorts[self._table.sort_ids[self._id]]
+
+    @property
+    def _is_enum(self):
+        return self._table.sort_is_enum[self._table.sort_ids[self._id]]
+
+    @property
+    def _is_concrete(self):
+        return self._table.concrete[self._id] == 1
+
+    @_is_concrete.setter
+    def _is_concrete(self, is_concrete):
+        self._table.concrete[self._id] = 1 if is_concrete else 0
+
+    @property
+    def _value(self):
+        return self._table.values[self._id]
+
+    @_value.setter
+    def _value(self, value):
+        self._table.values[self._id] = value
 
     @property
     def is_concrete(self):
         """Returns True if a concrete value is already defined"""
-        return self._is_concrete
+        table = self._table
+        if not table.concrete[self._id] and table.model_ref is not None \
+                and table.model_ref.model is not None:
+            self._concretize(table.model_ref.model)
+        return table.concrete[self._id] == 1
+
+    def _detach(self):
+        """Move the state of the var to a table of its own"""
+        table = VarTable(self._table.model_ref)
+        new_id = table.append(self.name, self.vsort, self._is_concrete,
+                              self._value)
+        self._table = table
+        self._id = new_id
 
     def get_var(self):
         """Return the Z3 variable"""
@@ -290,30 +643,37 @@ class SMTVar(object):
                 return True
         return self.var == other.var
 
+    def _concretize(self, model):
+        """Read the value of the variable from the z3 model"""
+        value = model.eval(self.get_var())
+        if self._is_enum:
+            self._value = value
+        elif isinstance(value, z3.BoolRef):
+            try:
+                self._value = z3.is_true(value)
+            except AttributeError:
+                #raise RuntimeError("Value not assigned for %s", str(self))
+                pass
+        elif isinstance(value, z3.BitVecRef):
+            if z3.is_bv_value(value):
+                self._value = value.as_long()
+        elif value.is_int:
+            try:
+                self._value = value.as_long()
+            except AttributeError:
+                # raise RuntimeError("Value not assigned for %s", str(self))
+                pass
+        else:
+            err = "Currently only support enums and ints"
+            raise NotImplementedError(err)
+        self._is_concrete = True
+        return value
+
     def eval(self, model):
         """Concertize the variable value based on the z3 model"""
-        if not self.is_concrete:
-            value = model.eval(self.get_var())
-            print "+" * 20, self.get_var()
-            print ">" * 20, value
-            if self._is_enum:
-                self._value = value
-            elif isinstance(value, z3.BoolRef):
-                try:
-                    self._value = z3.is_true(value)
-                except AttributeError:
-                    #raise RuntimeError("Value not assigned for %s", str(self))
-                    pass
-            elif value.is_int:
-                try:
-                    self._value = value.as_long()
-                except AttributeError:
-                    # raise RuntimeError("Value not assigned for %s", str(self))
-                    pass
-            else:
-                err = "Currently only support enums and ints"
-                raise NotImplementedError(err)
-            self._is_concrete = True
+        if not self._is_concrete:
+            value = self._concretize(model)
+            _tracer.trace("Concretized %s = %s", self.get_var(), value)
         return self.get_value()
 
 
@@ -323,14 +683,64 @@ class SolverContext(object):
     """
 
     def __init__(self, z3_ctx):
-        self._vars = {}  # Map a name to a var id
+        self._vars = {}  # Map a name to a SMTVar
+        # The model is read lazily by the vars when set_model(lazy=True)
+        self._model_ref = ModelRef()
+        # The state of the vars, in the order they were registered
+        self._var_table = VarTable(self._model_ref)
         self._tracked = {}  # Map a name to constraints, additional info
+        self._tracked_names = []  # Constraint names in registration order
+        # Constraints that partial evaluation turned into constants, they're
+        # never asserted. Map a name to the constant value
+        self._folded = {}
+        self._folded_info = {}  # Map a folded name to its additional info
+        self._folded_names = []  # Folded names in registration order
+        self._false_names = []  # Names of the constraints folded to False
+        # The maps keyed by z3 solvers hold them weakly, so the entries of
+        # the discarded solvers go away with them
+        # Map a z3 solver to what has been already asserted in it
+        # when checking incrementally
+        self._solver_marks = weakref.WeakKeyDictionary()
+        # Map a z3 solver to the name of its tactic pipeline
+        self._solver_tactics = weakref.WeakKeyDictionary()
+        # Map a z3 solver to the EqualitySubstitution of its last check
+        self._solver_substitutions = weakref.WeakKeyDictionary()
+        # Map a z3 solver to the solver of the constraints outside of the
+        # cone of influence when they made its last check unsat
+        self._solver_outside = weakref.WeakKeyDictionary()
         self._next_varnum = itertools.count(0)
         self._next_constnum = itertools.count(0)
         self._enum_types = {}
+        self._enum_values = {}  # Map an enum value to the name of its type
         self._enum_compare = {}
         self._enum_compare_sort = {}
+        self._enum_rank_compare = {}
         self.z3_ctx = z3_ctx
+        self.smt_names = SMTNameTable()
+        # Background writer for the SMT-LIB dumps, created on first use
+        self._smt_dumper = None
+        # SolveMetrics of the last call to check()
+        self.last_metrics = None
+        # Optional smt_cache.ModelCache consulted by check()
+        self.model_cache = None
+        # Unsat core (constraint names) read from the model cache
+        self._cached_unsat_core = None
+        # Optional smt_provenance.ProvenanceIndex recording where each
+        # var and constraint is created
+        self.provenance = None
+        # Stack of the provenance fields of the code creating the constraints
+        self._provenance_scopes = [{}]
+        # Map the name of a small-domain int var to its possible values,
+        # used to split the formula into cubes
+        self._selectors = OrderedDict()
+        # smt_tuning.Tuning used by create_solver when no tactic is given
+        self.tuning = default_tuning()
+        # Map the attributes in BV_ATTRS to a bit-vector width,
+        # they're unbounded ints if None
+        self.bv_widths = None
+        # How SMTRouteMap encodes the order of the route map lines,
+        # RMAP_ORDER_PAIRWISE or RMAP_ORDER_CHAINED
+        self.rmap_order = RMAP_ORDER_PAIRWISE
         self.compare_vals = ['GREATER', 'LESS', 'EQ', 'UNKNOWN']
         self.comparator = self.create_enum_type('Comparator', self.compare_vals)
         self.compare_vars = [self.comparator.get_symbolic_value(x) for x in self.compare_vals]
@@ -341,15 +751,17 @@ class SolverContext(object):
             raise ValueError("EnumSort %s is already defined" % name)
         assert values
         for value in values:
-            if value != sanitize_smt_name(value):
+            if value != self.smt_names.sanitize(value):
                 raise ValueError("Enum Value {} contains special chars".format(value))
             assert value[0].isalpha(), "Name is not valid {}".format(value)
-            for ename, etype in self._enum_types.iteritems():
-                if value in etype.concrete_values:
-                    err = "Duplicate value '%s' already defined in %s" % (
-                        value, ename)
-                    raise ValueError(err)
-        enum_type = EnumType(name, values, z3_ctx=self.z3_ctx)
+            if value in self._enum_values:
+                err = "Duplicate value '%s' already defined in %s" % (
+                    value, self._enum_values[value])
+                raise ValueError(err)
+        enum_type = EnumType(name, values, z3_ctx=self.z3_ctx,
+                             smt_names=self.smt_names)
+        for value in values:
+            self._enum_values[value] = name
         self._enum_types[name] = enum_type
         return self._enum_types[name]
 
@@ -357,6 +769,12 @@ class SolverContext(object):
         """Get the EnumType object of the given type name"""
         return self._enum_types[name]
 
+    def get_enum_type_of_value(self, value):
+        """Get the EnumType object that defines the given (sanitized) value"""
+        if value not in self._enum_values:
+            raise ValueError("Value '%s' is not defined in any EnumType" % value)
+        return self._enum_types[self._enum_values[value]]
+
     def fresh_var_name(self, prefix=None):
         """
         Creates a fresh name for the next variable
@@ -365,7 +783,7 @@ class SolverContext(object):
         if not prefix:
             prefix = 'Var_'
         else:
-            prefix = sanitize_smt_name(prefix)
+            prefix = self.smt_names.sanitize(prefix)
         name = "%s%d" % (prefix, self._next_varnum.next())
         while name in self._vars:
             name = "%s%d" % (prefix, self._next_varnum.next())
@@ -386,11 +804,62 @@ class SolverContext(object):
             raise ValueError(err)
         self._vars[var.name] = var
 
+    def memory_report(self):
+        """
+        Approximate memory used by the variables in bytes
+        (not including the z3 terms)
+        """
+        report = OrderedDict()
+        report['num_vars'] = len(self._vars)
+        for column, size in self._var_table.memory_usage().iteritems():
+            report['table_%s' % column] = size
+        report['var_objects'] = sum(
+            sys.getsizeof(var) for var in self._vars.itervalues())
+        report['name_index'] = sys.getsizeof(self._vars)
+        report['total'] = sum(report.values()) - report['num_vars']
+        return report
+
     def print_register_var(self):
         """print all SMT variables"""
         for val in vals:
             print val
 
+    @contextmanager
+    def provenance_scope(self, **fields):
+        """
+        Attach the given provenance fields (e.g., router, route_map, line,
+        requirement, announcement) to the vars and constraints created
+        within the scope. Nested scopes extend the outer fields.
+        """
+        scope = dict(self._provenance_scopes[-1])
+        scope.update(fields)
+        self._provenance_scopes.append(scope)
+        try:
+            yield scope
+        finally:
+            self._provenance_scopes.pop()
+
+    def attr_sort(self, attr):
+        """
+        The sort of an integer BGP attribute (see BV_ATTRS), a bit-vector
+        if a width is set for it in self.bv_widths, otherwise an int
+        """
+        if self.bv_widths and attr in self.bv_widths:
+            return z3.BitVecSort(self.bv_widths[attr], ctx=self.z3_ctx)
+        return z3.IntSort(ctx=self.z3_ctx)
+
+    def less(self, var1, var2):
+        """var1 < var2 over ints, unsigned if one of them is a bit-vector"""
+        if z3.is_bv(var1) or z3.is_bv(var2):
+            return z3.ULT(var1, var2)
+        return var1 < var2
+
+    def greater(self, var1, var2):
+        """var1 > var2 over ints, unsigned if one of them is a bit-vector"""
+        if z3.is_bv(var1) or z3.is_bv(var2):
+            return z3.UGT(var1, var2)
+        return var1 > var2
+
     def create_fresh_var(self, vsort, name=None, name_prefix=None, value=None):
         """
         Create new Z3 Variable
@@ -403,15 +872,41 @@ class SolverContext(object):
         if not name:
             name = self.fresh_var_name(name_prefix)
         else:
-            name = sanitize_smt_name(name)
+            name = self.smt_names.sanitize(name)
         if name in self._vars:
             err = "Variable name '%s' is already registered" % name
             raise ValueError(err)
-        print "~" * 10, name
-        var = SMTVar(name, vsort, value)
+        if isinstance(vsort, z3.BitVecSortRef) and \
+                isinstance(value, (int, long)) and \
+                not 0 <= value < 2 ** vsort.size():
+            err = "Value %s of var '%s' doesn't fit in %d bits, " \
+                  "increase the bit-vector width" % (value, name, vsort.size())
+            raise ValueError(err)
+        _tracer.trace("Created var %s", name)
+        var = SMTVar(name, vsort, value, table=self._var_table)
         self._register_var(var)
+        if self.provenance is not None:
+            sort_name = vsort.name if isinstance(vsort, EnumType) else vsort
+            self.provenance.add_var(name, sort_name,
+                                    **self._provenance_scopes[-1])
         return var
 
+    def register_selector(self, var, values):
+        """
+        Mark an int var as a selector that can only take the given values
+        (e.g., route map line numbers), check_cubes() splits on them.
+        The values must be constrained separately.
+        """
+        if var.is_concrete:
+            return
+        assert var.name in self._vars, "Var %s is not registered" % var.name
+        self._selectors[var.name] = list(values)
+
+    @property
+    def selectors(self):
+        """Map the name of a selector var to its possible values"""
+        return self._selectors
+
     def fresh_constraint_name(self, prefix=None):
         """
        Creates a fresh name for tracking the next constraint
@@ -420,7 +915,7 @@ class SolverContext(object):
         if not prefix:
             prefix = 'Constrain_'
         else:
-            prefix = sanitize_smt_name(prefix)
+            prefix = self.smt_names.sanitize(prefix)
         name = "%s%d" % (prefix, self._next_constnum.next())
         while name in self._vars:
             name = "%s%d" % (prefix, self._next_constnum.next())
@@ -437,17 +932,49 @@ class SolverContext(object):
         if not name:
             name = self.fresh_constraint_name(prefix=name_prefix)
         else:
-            name = sanitize_smt_name(name)
-        if name in self._tracked:
+            name = self.smt_names.sanitize(name)
+        if name in self._tracked or name in self._folded:
             err = "Constraint %s is already registered with the " \
                   "constraints: %s while the new constraints are: %s" % (
-                      name, constraints, self._tracked[name])
+                      name, constraints, self.get_constraint(name))
             raise ValueError(err)
+        if isinstance(constraints, bool) or z3.is_true(constraints) or \
+                z3.is_false(constraints):
+            # Fold constants instead of asserting them
+            value = constraints if isinstance(constraints, bool) \
+                else z3.is_true(constraints)
+            self._folded[name] = value
+            self._folded_info[name] = info
+            self._folded_names.append(name)
+            if self.provenance is not None:
+                self._record_constraint(name, None, value, info)
+            if not value:
+                _tracer.debug("Constraint %s is always False", name)
+                self._false_names.append(name)
+            return name
         self._tracked[name] = dict(constraints=constraints, info=info)
+        self._tracked_names.append(name)
+        if self.provenance is not None:
+            self._record_constraint(name, constraints, None, info)
         return name
 
+    def _record_constraint(self, name, constraints, folded, info):
+        fields = dict(self._provenance_scopes[-1])
+        fields.update(info)
+        self.provenance.add_constraint(name, constraints, folded, **fields)
+
+    @property
+    def false_constraints(self):
+        """
+        The names of the constraints that partial evaluation turned to False,
+        the constraints are unsat without calling the solver if not empty
+        """
+        return self._false_names[:]
+
     def get_constraint(self, name):
         """Get the constraints tracked by the given name"""
+        if name in self._folded:
+            return self._folded[name]
         if name not in self._tracked:
             raise ValueError("Constraint: %s was not registered before" % name)
         return self._tracked[name]['constraints']
@@ -462,131 +989,958 @@ class SolverContext(object):
 
     def get_constraints_info(self, name):
         """Get additional attributes associated with a constraint"""
+        if name in self._folded_info:
+            return self._folded_info[name]
         if name not in self._tracked:
             raise ValueError("Constraint: %s was not registered before" % name)
         return self._tracked[name]['info']
 
-    def create_enum_compare(self, enum_name):
+    def create_enum_compare(self, enum_name, encoding=COMPARE_AXIOMS):
+        """
+        Create a function to compare the values of an EnumType
+        :param enum_name: the name of the EnumType
+        :param encoding: COMPARE_AXIOMS for an uninterpreted function
+                with pairwise axioms added at check time, COMPARE_INT_RANK or
+                COMPARE_BV_RANK to compare symbolic ranks of the values
+        :return: callable (var1, var2) -> value of the comparator sort
+        """
         vsort = self.get_enum_type(enum_name)
         z3sort = vsort.sort
         name = 'compare_%s' % enum_name
         err = "Compare function '{}' already created".format(name)
         assert name not in self._enum_compare, err
+        assert name not in self._enum_rank_compare, err
+        if encoding in (COMPARE_INT_RANK, COMPARE_BV_RANK):
+            func = RankCompare(name, vsort, self.comparator, self.compare_vars,
+                               use_bv=encoding == COMPARE_BV_RANK)
+            self._enum_rank_compare[name] = func
+            return func
+        elif encoding != COMPARE_AXIOMS:
+            raise ValueError("Unknown compare encoding '%s'" % encoding)
         func = z3.Function(name, z3sort, z3sort, self.comparator.sort)
         self._enum_compare[name] = func
         self._enum_compare_sort[name] = vsort
         return func
 
-    def set_model(self, model):
-        """Set the Z3 model, after solving it"""
+    def set_model(self, model, lazy=False):
+        """
+        Set the Z3 model, after solving it
+        :param model: z3 model
+        :param lazy: if True, each variable is concretized only when its
+                     value is consulted for the first time
+        """
+        if lazy:
+            self._model_ref.model = model
+            return
         t1 = timer()
-        print "Setting the Var values start at", t1
         for var in self._vars.values():
             var.eval(model)
         t2 = timer()
-        print "Reading model time: %f" % (t2 - t1)
+        _tracer.info("Reading model time: %f", t2 - t1)
 
-    def check(self, solver, track=True, set_model=True, out_smt=None):
-        err1 = "Z3 Solver is not attached to the same Z3 context"
-        assert solver.ctx == self.z3_ctx, err1
+    def eval_vars(self, variables, model=None):
+        """
+        Concretize an explicit set of variables in one pass
+        :param variables: iterable of SMTVars
+        :param model: z3 model, default to the model set by set_model()
+        """
+        if model is None:
+            model = self._model_ref.model
+        assert model is not None, "No model is set to read the values from"
+        for var in variables:
+            if not var._is_concrete:
+                var._concretize(model)
 
-        t1 = timer()
-        partially_eval_vars = len([var for var in self._vars.values() if var.is_concrete])
-        partially_eval_const = 0
-        for name, const in self.constraints_itr():
-            assert isinstance(const, bool) or const.ctx == self.z3_ctx, err2
+    @property
+    def num_holes(self):
+        """Number of variables that are not concrete"""
+        return len(self._vars) - self._var_table.num_concrete()
+
+    def create_solver(self, tactic=None, unsat_core=False):
+        """
+        Create a z3 solver in this context that applies the given
+        tactic pipeline before solving.
+        :param tactic: None for the default solver, a preset name
+                       (e.g., 'fast-bgp'), or a chain of tactic names.
+                       If None and self.tuning is set, the tactic and
+                       parameters tuned for the class of this formula.
+        :param unsat_core: the solver is used to read unsat cores
+        :return: z3.Solver
+        """
+        params = None
+        if tactic is None and self.tuning is not None:
+            config = self.tuning.lookup(KIND_BGP, self.num_holes)
+            if config:
+                _tracer.info("Using the tuned solver configuration %s",
+                             config)
+                tactic, params = config['tactic'], config['params']
+        solver = create_solver(tactic, ctx=self.z3_ctx, unsat_core=unsat_core,
+                               params=params)
+        self._solver_tactics[solver] = tactic_name(tactic)
+        return solver
+
+    def check_context(self, solver=None, deep=True):
+        """
+        Make sure the solver and all the registered constraints are attached
+        to the z3 context of this SolverContext, raises ValueError otherwise.
+        Unlike the assertions of check(), nested terms (and vars) created
+        in another z3 context are found when deep is True. The vars of
+        another SolverContext on the same z3 context are only found when
+        their names differ from the vars of this one, see
+        smt_threads.foreign_terms.
+        """
+        check_context(self, solver, deep)
+
+    def _get_solver_mark(self, solver):
+        """
+        Get what has been asserted so far in the given solver
+        :return: dict with the number of asserted constraints, the compare
+                 functions with their axioms, and the open scopes
+        """
+        if solver not in self._solver_marks:
+            self._solver_marks[solver] = dict(
+                asserted=0, compares=set(), scopes=[])
+        return self._solver_marks[solver]
+
+    def _assert_constraints(self, solver, names, track, substitution=None):
+        """
+        Add the registered constraints with the given names to the solver
+        :param substitution: optional EqualitySubstitution applied to
+                             the constraints, they're tracked by their
+                             original names
+        """
+        err2 = "Constraint is not attached to the same Z3 context"
+        for name in names:
+            const = self._tracked[name]['constraints']
+            assert const.ctx == self.z3_ctx, err2
+            if substitution is not None:
+                const = substitution.substitute(const)
             if track:
-                err2 = "Constraint is not attached to the same Z3 context: %s" % const
-                if isinstance(const, bool):
-                    var = self.create_fresh_var(z3.BoolSort(ctx=self.z3_ctx), value=None, name_prefix='BoolHack_')
-                    solver.assert_and_track(var.var == const, name)
-                    solver.assert_and_track(var.var == True, "%s_hack" % name)
-                    partially_eval_const += 1
-                else:
-                    solver.assert_and_track(const, name)
+                solver.assert_and_track(const, name)
             else:
                 solver.add(const)
 
-        # Add comparator constraints:
+    def _assert_enum_compare(self, solver, name, track):
+        """Add the axioms of the compare function with the given name"""
+        func = self._enum_compare[name]
+        vsort = self._enum_compare_sort[name]
         GREATER, LESS, EQUAL, INCOMPLETE = self.compare_vars
-        tracked_eq = []
-        for name, func in self._enum_compare.iteritems():
-            vsort = self._enum_compare_sort[name]
-            for value1 in vsort.concrete_values:
-                var1 = vsort.get_symbolic_value(value1)
-                for value2 in vsort.concrete_values:
-                    var2 = vsort.get_symbolic_value(value2)
-                    pair = set([value1, value2])
-                    # Same var is equal
-                    if pair not in tracked_eq:
-                        equal_const1 = z3.Implies(var1 == var2,
-                                                  func(var1, var2) == EQUAL,
-                                                  self.z3_ctx)
-                        tracked_eq.append(pair)
-                    else:
-                        equal_const1 = None
-                    # Equal is reflexive
-                    equal_const2 = z3.Implies(func(var1, var2) == EQUAL,
-                                              func(var2, var1) == EQUAL,
-                                              self.z3_ctx)
-                    # Less is opposite of greater
-                    greater_less = z3.Implies(func(var1, var2) == GREATER,
-                                              func(var2, var1) == LESS,
-                                              self.z3_ctx)
-                    # Greater is opposite of less
-                    less_greater = z3.Implies(func(var1, var2) == LESS,
-                                              func(var2, var1) == GREATER,
+        values = zip(vsort.concrete_values, vsort.symbolic_values)
+        tracked_eq = set()
+        for value1, var1 in values:
+            for value2, var2 in values:
+                pair = frozenset([value1, value2])
+                # Same var is equal
+                if pair not in tracked_eq:
+                    equal_const1 = z3.Implies(var1 == var2,
+                                              func(var1, var2) == EQUAL,
                                               self.z3_ctx)
-                    if track:
-                        suffix = "{}_{}_{}".format(name, value1, value2)
-                        if equal_const1 is not None:
-                            solver.assert_and_track(equal_const1, "compare_equal_const_{}".format(suffix))
-                        solver.assert_and_track(equal_const2, "compare_equal_reflexive_{}".format(suffix))
-                        solver.assert_and_track(greater_less, "greater_implies_less_{}".format(suffix))
-                        solver.assert_and_track(less_greater, "less_implies_greater_{}".format(suffix))
-                    else:
+                    tracked_eq.add(pair)
+                else:
+                    equal_const1 = None
+                # Equal is reflexive
+                equal_const2 = z3.Implies(func(var1, var2) == EQUAL,
+                                          func(var2, var1) == EQUAL,
+                                          self.z3_ctx)
+                # Less is opposite of greater
+                greater_less = z3.Implies(func(var1, var2) == GREATER,
+                                          func(var2, var1) == LESS,
+                                          self.z3_ctx)
+                # Greater is opposite of less
+                less_greater = z3.Implies(func(var1, var2) == LESS,
+                                          func(var2, var1) == GREATER,
+                                          self.z3_ctx)
+                if track:
+                    suffix = "{}_{}_{}".format(name, value1, value2)
+                    if equal_const1 is not None:
+                        solver.assert_and_track(equal_const1, "compare_equal_const_{}".format(suffix))
+                    solver.assert_and_track(equal_const2, "compare_equal_reflexive_{}".format(suffix))
+                    solver.assert_and_track(greater_less, "greater_implies_less_{}".format(suffix))
+                    solver.assert_and_track(less_greater, "less_implies_greater_{}".format(suffix))
+                else:
+                    if equal_const1 is not None:
                         solver.add(equal_const1)
-                        solver.add(equal_const2)
-                        solver.add(greater_less)
-                        solver.add(less_greater)
-        t2 = timer()
+                    solver.add(equal_const2)
+                    solver.add(greater_less)
+                    solver.add(less_greater)
 
-        print "X" * 50
-        print "Total Number of variables:", len(self._vars)
-        print "Total Number of Constraints:", len(self._tracked)
-        print "Total Number of Partially evaluated variables:", partially_eval_vars
-        if len(self._vars):
-            print "Percentage Partially evaluated variables:", partially_eval_vars / (len(self._vars) * 1.0)
-        print "Total Number of Partially evaluated constraints:", partially_eval_const
-        if len(self._tracked) > 0:
-            print "Percentage Partially evaluated constraints:", partially_eval_const / (len(self._tracked) * 1.0)
+    def flush(self, solver, track=True):
+        """
+        Assert in the solver only the constraints (and compare axioms)
+        registered since the last time this solver was flushed or checked
+        incrementally.
+        """
+        err1 = "Z3 Solver is not attached to the same Z3 context"
+        assert solver.ctx == self.z3_ctx, err1
+        mark = self._get_solver_mark(solver)
+        names = self._tracked_names[mark['asserted']:]
+        self._assert_constraints(solver, names, track)
+        mark['asserted'] += len(names)
+        for name in self._enum_compare:
+            if name in mark['compares']:
+                continue
+            self._assert_enum_compare(solver, name, track)
+            mark['compares'].add(name)
+
+    def push(self, solver, track=True):
+        """
+        Open a new scope in the solver.
+        All the pending constraints are asserted first, then the constraints
+        registered after this call belong to the new scope and are
+        discarded by the matching pop().
+        """
+        self.flush(solver, track)
+        mark = self._get_solver_mark(solver)
+        scope = dict(asserted=mark['asserted'],
+                     num_folded=len(self._folded_names),
+                     num_false=len(self._false_names),
+                     num_vars=len(self._var_table),
+                     compares=set(mark['compares']),
+                     enum_compare=set(self._enum_compare.keys()),
+                     enum_rank_compare=set(self._enum_rank_compare.keys()))
+        mark['scopes'].append(scope)
+        solver.push()
+
+    def pop(self, solver):
+        """
+        Close the last scope opened by push() in the solver, and unregister
+        all the variables, constraints and compare functions created in it.
+        """
+        mark = self._get_solver_mark(solver)
+        if not mark['scopes']:
+            raise ValueError("No scope was pushed to the solver")
+        scope = mark['scopes'].pop()
+        solver.pop()
+        for name in self._tracked_names[scope['asserted']:]:
+            del self._tracked[name]
+        del self._tracked_names[scope['asserted']:]
+        for name in self._folded_names[scope['num_folded']:]:
+            del self._folded[name]
+            del self._folded_info[name]
+        del self._folded_names[scope['num_folded']:]
+        del self._false_names[scope['num_false']:]
+        for name in self._var_table.names[scope['num_vars']:]:
+            # The row is reused by the next var, don't let the removed
+            # var read it
+            self._vars.pop(name)._detach()
+        self._var_table.truncate(scope['num_vars'])
+        for name in self._selectors.keys():
+            if name not in self._vars:
+                del self._selectors[name]
+        for name in self._enum_compare.keys():
+            if name not in scope['enum_compare']:
+                del self._enum_compare[name]
+                del self._enum_compare_sort[name]
+        for name in self._enum_rank_compare.keys():
+            if name not in scope['enum_rank_compare']:
+                del self._enum_rank_compare[name]
+        mark['asserted'] = scope['asserted']
+        mark['compares'] = scope['compares']
+
+    @property
+    def smt_dumper(self):
+        """The background writer of the SMT-LIB dumps"""
+        if self._smt_dumper is None:
+            self._smt_dumper = SMTDumper()
+        return self._smt_dumper
+
+    def dump_smt(self, solver, out, async_dump=True, num_holes=None):
+        """
+        Write the assertions of the solver in SMT-LIB format, with the
+        header the tuner reads the class of the formula from (see smt_tuning)
+        :param solver: z3.Solver attached to the same z3 context
+        :param out: a filename (gzipped if it ends with '.gz') or a file
+        :param async_dump: write on a background thread
+        :param num_holes: recorded in the header, default to self.num_holes
+        :return: None
+        """
+        if num_holes is None:
+            num_holes = self.num_holes
+        header = problem_header(KIND_BGP, num_holes)
+        if async_dump:
+            self.smt_dumper.dump(solver, out, header)
         else:
-            print "No constraints"
-        if (len(self._tracked) +len(self._vars)) > 0:
-            print "Total Percentage Partially evaluated:", (partially_eval_vars + partially_eval_const) / ((len(self._tracked) +len(self._vars)) * 1.0)
-        print "X" * 50
+            write_smt2(solver, out, header=header)
+
+    def wait_dumps(self):
+        """
+        Block until the background SMT-LIB dumps are written
+        :return: list of (out, exception) of the failed dumps
+        """
+        if self._smt_dumper is None:
+            return []
+        return self._smt_dumper.wait()
+
+    def _create_metrics(self, tactic, incremental, track):
+        """
+        Start the metrics of a new check and keep them in self.last_metrics
+        Constraints that are always False make the check unsat right away.
+        """
+        partially_eval_vars = self._var_table.num_concrete()
+        partially_eval_const = len(self._folded)
+        metrics = SolveMetrics(num_vars=len(self._vars),
+                               num_constraints=len(self._tracked) + partially_eval_const,
+                               partially_eval_vars=partially_eval_vars,
+                               partially_eval_const=partially_eval_const,
+                               incremental=incremental,
+                               track=track,
+                               tactic=tactic)
+        metrics.count_constraints(self._tracked_names)
+        metrics.count_constraints(self._folded_names)
+        self.last_metrics = metrics
+        if self._false_names:
+            # Unsat without calling the solver
+            metrics.result = str(z3.unsat)
+            metrics.false_constraints = self.false_constraints
+            _tracer.info("Unsat before solving, the following constraints "
+                         "are always False: %s", self._false_names)
+        return metrics
+
+    def to_smt2(self, substitution=None):
+        """
+        Serialize all the registered constraints (without tracking)
+        and the compare axioms as SMT-LIB declarations and assertions
+        :param substitution: optional EqualitySubstitution applied to the
+                             constraints, the absorbed ones are left out
+        """
+        names = self._tracked_names
+        if substitution is not None:
+            absorbed = set(substitution.absorbed)
+            names = [name for name in names if name not in absorbed]
+        solver = z3.Solver(ctx=self.z3_ctx)
+        self._assert_constraints(solver, names, False, substitution)
+        for name in self._enum_compare:
+            self._assert_enum_compare(solver, name, False)
+        return solver.sexpr()
+
+    def fingerprint(self):
+        """
+        Fingerprint of the registered constraints and the enum declarations
+        """
+        enum_types = [(name, vsort.concrete_values)
+                      for name, vsort in self._enum_types.iteritems()]
+        return fingerprint(self.to_smt2(), enum_types)
+
+    def _snapshot_sort(self, var):
+        """The sort of a var as stored in a FormulaSnapshot"""
+        vsort = var.vsort
+        if isinstance(vsort, EnumType):
+            return [SORT_ENUM, vsort.name]
+        elif vsort.kind() == z3.Z3_BOOL_SORT:
+            return SORT_BOOL
+        elif vsort.kind() == z3.Z3_INT_SORT:
+            return SORT_INT
+        elif vsort.kind() == z3.Z3_BV_SORT:
+            return [SORT_BV, vsort.size()]
+        raise NotImplementedError(
+            "Unsupported sort %s of %s" % (vsort, var.name))
+
+    def _from_snapshot_sort(self, vsort):
+        if vsort == SORT_BOOL:
+            return z3.BoolSort(ctx=self.z3_ctx)
+        elif vsort == SORT_INT:
+            return z3.IntSort(ctx=self.z3_ctx)
+        elif vsort[0] == SORT_BV:
+            return z3.BitVecSort(vsort[1], ctx=self.z3_ctx)
+        elif vsort[0] == SORT_ENUM:
+            return self.get_enum_type(vsort[1])
+        raise ValueError("Unknown snapshot sort %s" % vsort)
+
+    def snapshot(self):
+        """
+        Save the registered constraints, enum sorts, vars and constraint
+        names to be solved again without encoding them, see from_snapshot.
+        Must be called before solving, the vars concretized by the model
+        are not holes anymore.
+        :return: smt_snapshot.FormulaSnapshot
+        """
+        variables = []
+        for name in self._var_table.names:
+            var = self._vars[name]
+            value = None
+            if var._is_concrete:
+                value = var.get_value()
+                if is_symbolic(value):
+                    value = z3.is_true(value) if z3.is_bool(value) \
+                        else value.as_long()
+            variables.append((name, self._snapshot_sort(var), value))
+        enum_types = [(name, vsort.concrete_values) for name, vsort
+                      in self._enum_types.iteritems()
+                      if vsort is not self.comparator]
+        compares = [(vsort.name, COMPARE_AXIOMS) for _, vsort
+                    in sorted(self._enum_compare_sort.iteritems())]
+        for _, func in sorted(self._enum_rank_compare.iteritems()):
+            compares.append((func.vsort.name, COMPARE_BV_RANK if func.use_bv
+                             else COMPARE_INT_RANK))
+        smt2 = '\n'.join(
+            '(assert %s)' % self._tracked[name]['constraints'].sexpr()
+            for name in self._tracked_names)
+        return FormulaSnapshot(
+            smt2=smt2,
+            constraints=self._tracked_names[:],
+            variables=variables,
+            enum_types=enum_types,
+            compares=compares,
+            false_constraints=self.false_constraints,
+            selectors=self._selectors.items(),
+            bv_widths=self.bv_widths,
+            fingerprint=self.fingerprint())
 
-        print "Constraints adding time: %f" % (t2 - t1)
-        print "Start Z3 check", t2
+    @staticmethod
+    def from_snapshot(snapshot, fixed_values=None):
+        """
+        Load a FormulaSnapshot in a new SolverContext (with a fresh z3
+        context) to solve it again. The vars and constraints have the
+        names they had when the snapshot was taken, so the values of a
+        model can be applied back to the encoded formula, see apply_values.
+        :param snapshot: smt_snapshot.FormulaSnapshot
+        :param fixed_values: optional dict of var name -> value to
+                             constrain some of the holes
+        :return: SolverContext
+        """
+        ctx = SolverContext(z3.Context())
+        ctx.bv_widths = snapshot.bv_widths
+        sorts = {}
+        decls = {}
+        for name, values in snapshot.enum_types:
+            ctx.create_enum_type(name, values)
+        for name, enum_type in ctx._enum_types.iteritems():
+            sorts[name] = enum_type.sort
+            for index in range(enum_type.sort.num_constructors()):
+                constructor = enum_type.sort.constructor(index)
+                decls[constructor.name()] = constructor
+        for enum_name, encoding in snapshot.compares:
+            func = ctx.create_enum_compare(enum_name, encoding)
+            if isinstance(func, RankCompare):
+                decls[func.rank_decl.name()] = func.rank_decl
+            else:
+                decls[func.name()] = func
+        for name, vsort, value in snapshot.variables:
+            var = ctx.create_fresh_var(ctx._from_snapshot_sort(vsort),
+                                       name=name, value=value)
+            if value is None:
+                decls[name] = var.get_var()
+        assertions = z3.parse_smt2_string(
+            snapshot.smt2, sorts=sorts, decls=decls, ctx=ctx.z3_ctx)
+        assert len(assertions) == len(snapshot.constraints), \
+            "The snapshot has %d assertions for %d constraints" % (
+                len(assertions), len(snapshot.constraints))
+        for name, const in zip(snapshot.constraints, assertions):
+            ctx.register_constraint(const, name=name)
+        for name in snapshot.false_constraints:
+            ctx.register_constraint(False, name=name)
+        for name, values in snapshot.selectors:
+            ctx.register_selector(ctx._vars[name], values)
+        for name, value in (fixed_values or {}).iteritems():
+            if name not in ctx._vars:
+                raise ValueError("Unknown var '%s' in the fixed values" % name)
+            var = ctx._vars[name]
+            if isinstance(var.vsort, EnumType):
+                value = var.vsort.get_symbolic_value(value)
+            ctx.register_constraint(var.var == value,
+                                    name_prefix='fixed_%s_' % name)
+        return ctx
+
+    def apply_values(self, values, lazy=False):
+        """
+        Concretize the vars from the values of a model read by name, e.g.,
+        the model of a formula replayed from a snapshot of this context
+        :param values: dict of var name -> value as printed by z3
+                       (see smt_cache.read_model_values)
+        :param lazy: see set_model
+        """
+        self.set_model(ValuesModel(values, self.z3_ctx), lazy=lazy)
+
+    def unsat_core(self, solver):
+        """
+        The names of the constraints in the unsat core of the last check,
+        either read from the solver or from the model cache
+        """
+        if self._cached_unsat_core is not None:
+            return self._cached_unsat_core[:]
+        if self._false_names:
+            # The solver was never called, the False constraints are the core
+            return self._false_names[:]
+        # The cone was sat if the constraints outside of it were unsat
+        core_solver = self._solver_outside.get(solver, solver)
+        core = [str(name) for name in core_solver.unsat_core()]
+        substitution = self._solver_substitutions.get(solver)
+        if substitution is not None:
+            # Add the absorbed equalities that justify the substitution
+            # of the vars in the core
+            var_names = set()
+            for name in core:
+                if name in self._tracked:
+                    var_names.update(expr_var_names(
+                        self._tracked[name]['constraints']))
+            seen = set(core)
+            for name in substitution.reasons(var_names):
+                if name not in seen:
+                    seen.add(name)
+                    core.append(name)
+        return core
+
+    def explain_core(self, names):
+        """
+        Where the constraints of an unsat core come from
+        :return: list of dicts with the 'name', the provenance fields
+                 (e.g., 'requirement', 'router'), and the 'holes'
+                 (the names of the symbolic vars in the constraint)
+        """
+        explained = []
+        for name in names:
+            entry = None
+            if self.provenance is not None:
+                entry = self.provenance.get_constraint(name)
+            if entry is None:
+                entry = dict(name=name)
+                if name in self._tracked:
+                    entry.update(self._tracked[name]['info'])
+            holes = []
+            if name in self._tracked:
+                holes = sorted(expr_var_names(
+                    self._tracked[name]['constraints']))
+            entry['holes'] = holes
+            explained.append(entry)
+        return explained
+
+    def minimize_core_async(self, core, max_muses=1, timeout=None):
+        """
+        Shrink an unsat core to minimal unsatisfiable subsets (MUSes)
+        in a background process, see smt_mus
+        :param core: the constraint names, e.g., read with self.unsat_core
+        :param max_muses: the number of MUSes to enumerate
+        :param timeout: optional seconds for the whole minimization
+        :return: smt_mus.CoreMinimization, the MUSes are explained
+                 with self.explain_core
+        """
+        handle = CoreMinimization(list(core), self.explain_core)
+        if self._false_names:
+            # Each constraint that is always False is a MUS on its own
+            return handle.set_muses(
+                [[name] for name in self._false_names[:max_muses]],
+                complete=max_muses >= len(self._false_names))
+        # Only the core is asserted, with the compare axioms it may use
+        solver = z3.Solver(ctx=self.z3_ctx)
+        self._assert_constraints(
+            solver, [name for name in core if name in self._tracked], True)
+        for name in self._enum_compare:
+            self._assert_enum_compare(solver, name, True)
+        return handle.start(solver.sexpr(), max_muses, timeout)
+
+    def _check_cache(self, key, track, set_model, lazy_model):
+        """
+        Look up the model cache
+        :return: z3.sat or z3.unsat on a hit, None otherwise
+        """
+        entry = self.model_cache.get(key)
+        if entry is None:
+            return None
+        if entry['result'] == str(z3.sat):
+            if set_model:
+                self.set_model(ValuesModel(entry['values'], self.z3_ctx),
+                               lazy=lazy_model)
+            return z3.sat
+        if entry['result'] == str(z3.unsat):
+            if track and entry['unsat_core'] is None:
+                # Cached without tracking, the unsat core is needed
+                return None
+            self._cached_unsat_core = [
+                str(name) for name in entry['unsat_core'] or []]
+            return z3.unsat
+        return None
+
+    def substitute_equalities(self):
+        """
+        Merge the vars of the registered constraints that are only
+        equalities between vars and values (e.g., the imported attributes)
+        with a union-find, see smt_substitution
+        :return: smt_substitution.EqualitySubstitution
+        """
+        substitution = EqualitySubstitution()
+        for name in self._tracked_names:
+            substitution.add(name, self._tracked[name]['constraints'])
+        return substitution
+
+    def slice_cone(self, root_prefixes=REQUIREMENT_PREFIXES, hole_vars=None):
+        """
+        Find the registered constraints in the cone of influence of the
+        requirements and the holes, see smt_slicing.cone_of_influence
+        :param hole_vars: names of the hole vars, defaults to the registered
+                          selectors (the lines of the route maps and the
+                          SelectOne indices of the sketch)
+        :return: smt_slicing.ConeSlice
+        """
+        if hole_vars is None:
+            hole_vars = self._selectors.keys()
+        constraints = [(name, self._tracked[name]['constraints'])
+                       for name in self._tracked_names]
+        return cone_of_influence(constraints, root_prefixes, hole_vars)
+
+    def _serialize(self, metrics, substitute):
+        """
+        Serialize the formula for the worker processes
+        :param substitute: substitute the equalities first
+        :return: (SMT-LIB formula, EqualitySubstitution or None)
+        """
+        t1 = timer()
+        substitution = None
+        if substitute:
+            substitution = self.substitute_equalities()
+            metrics.substitution = substitution.report()
+            metrics.add_timing('substitute', timer() - t1)
+            _tracer.info("Equality substitution: absorbed %d constraints, "
+                         "eliminated %d vars", len(substitution.absorbed),
+                         len(substitution.eliminated))
+        t2 = timer()
+        smt2 = self.to_smt2(substitution)
+        metrics.add_timing('serialize', timer() - t2)
+        return smt2, substitution
+
+    def check(self, solver, track=True, set_model=True, out_smt=None,
+              incremental=False, lazy_model=False, out_solved_smt=None,
+              async_dump=True, cone=False, substitute=False, budget=None):
+        """
+        Assert the registered constraints in the solver and check them.
+        :param solver: z3.Solver attached to the same z3 context
+        :param track: assert the constraints with assert_and_track
+                      to be able to read the unsat core
+        :param set_model: concretize the variables when the result is sat
+        :param out_smt: optional filename to dump the formula in smt2
+        :param incremental: only assert the constraints added since the last
+                            check (or flush) on the same solver
+        :param lazy_model: concretize the variables only when consulted
+        :param out_solved_smt: optional filename to dump the formula in smt2
+                               after the check
+        :param async_dump: write the smt2 dumps on a background thread,
+                           call wait_dumps() to make sure they're written.
+        :param cone: only assert the cone of influence of the requirements
+                     and the holes (see slice_cone) in the solver. If it's
+                     sat, the constraints outside of it are checked in a
+                     separate solver to give their variables values, they
+                     don't share variables or uninterpreted functions with
+                     the cone.
+        :param substitute: replace the vars that the equality constraints
+                           merge with their representatives, and don't
+                           assert those constraints (see
+                           substitute_equalities). The model and the unsat
+                           core are read in terms of the original vars and
+                           constraint names.
+        :param budget: optional budget.Budget, each z3 check is limited to
+                       the time remaining right before it
+        When self.model_cache is set, the cached solution of the same formula
+        is used without calling the solver, read the unsat core of a cached
+        unsat result with self.unsat_core(solver).
+        :return: z3.sat, z3.unsat, or z3.unknown, the metrics of the check
+                 are kept in self.last_metrics. Returns z3.unsat without
+                 calling the solver if self.false_constraints is not empty
+        """
+        err1 = "Z3 Solver is not attached to the same Z3 context"
+        assert solver.ctx == self.z3_ctx, err1
+        # Don't let a previous lazy model leak into the new check
+        self._model_ref.model = None
+        # As create_solver classifies the formula, before set_model
+        num_holes = self.num_holes
+
+        t1 = timer()
+        self._cached_unsat_core = None
+        if self.provenance is not None:
+            # Make the provenance queryable while solving
+            self.provenance.flush()
+        metrics = self._create_metrics(
+            self._solver_tactics.get(solver, tactic_name(None)),
+            incremental, track)
+        partially_eval_vars = metrics.partially_eval_vars
+        partially_eval_const = metrics.partially_eval_const
+        if self._false_names:
+            return z3.unsat
+        cache_key = None
+        if self.model_cache is not None:
+            cache_key = self.fingerprint()
+            ret = self._check_cache(cache_key, track, set_model, lazy_model)
+            metrics.add_timing('cache', timer() - t1)
+            metrics.cache_hit = ret is not None
+            if ret is not None:
+                _tracer.info("Model cache hit: %s %s", cache_key, ret)
+                metrics.result = str(ret)
+                return ret
+            t1 = timer()
+
+        dropped = []
+        substitution = None
+        self._solver_substitutions.pop(solver, None)
+        self._solver_outside.pop(solver, None)
+        if incremental:
+            assert not cone, "Slicing doesn't support incremental checks"
+            assert not substitute, \
+                "Substitution doesn't support incremental checks"
+            self.flush(solver, track)
+        else:
+            names = self._tracked_names[:]
+            if cone:
+                cone_slice = self.slice_cone()
+                metrics.cone = cone_slice.report()
+                names = cone_slice.kept
+                dropped = cone_slice.dropped
+                metrics.add_timing('slice', timer() - t1)
+                t1 = timer()
+                _tracer.info("Cone of influence: kept %d constraints, "
+                             "dropped %d", len(cone_slice.kept),
+                             len(cone_slice.dropped))
+            if substitute:
+                substitution = self.substitute_equalities()
+                self._solver_substitutions[solver] = substitution
+                metrics.substitution = substitution.report()
+                absorbed = set(substitution.absorbed)
+                names = [name for name in names if name not in absorbed]
+                dropped = [name for name in dropped if name not in absorbed]
+                metrics.add_timing('substitute', timer() - t1)
+                t1 = timer()
+                _tracer.info("Equality substitution: absorbed %d constraints, "
+                             "eliminated %d vars", len(substitution.absorbed),
+                             len(substitution.eliminated))
+            self._assert_constraints(solver, names, track, substitution)
+            # Add comparator constraints:
+            for name in self._enum_compare:
+                self._assert_enum_compare(solver, name, track)
+        t2 = timer()
+        metrics.add_timing('assert', t2 - t1)
+
+        _tracer.info("Total Number of variables: %d", metrics.num_vars)
+        _tracer.info("Total Number of Constraints: %d", metrics.num_constraints)
+        _tracer.info("Total Number of Partially evaluated variables: %d",
+                     partially_eval_vars)
+        if metrics.num_vars:
+            _tracer.info("Percentage Partially evaluated variables: %s",
+                         metrics.partially_eval_vars_ratio)
+        _tracer.info("Total Number of Partially evaluated constraints: %d",
+                     partially_eval_const)
+        if metrics.num_constraints > 0:
+            _tracer.info("Percentage Partially evaluated constraints: %s",
+                         metrics.partially_eval_const_ratio)
+        else:
+            _tracer.info("No constraints")
+        if metrics.partially_eval_ratio is not None:
+            _tracer.info("Total Percentage Partially evaluated: %s",
+                         metrics.partially_eval_ratio)
+        _tracer.info("Constraints adding time: %f", t2 - t1)
         if out_smt:
-            with open(out_smt, 'w') as outf:
-                outf.write(solver.to_smt2())
+            self.dump_smt(solver, out_smt, async_dump, num_holes)
+            metrics.add_timing('dump', timer() - t2)
+        t2 = timer()
+        _tracer.debug("Start Z3 check %f", t2)
+        if budget is not None:
+            budget.set_z3_timeout(solver)
         ret = solver.check()
         t3 = timer()
-        print "Z3 check time: %f" % (t3 - t2)
+        _tracer.info("Z3 check time: %f", t3 - t2)
+        metrics.add_timing('z3_check', t3 - t2)
+        outside = None
+        if dropped and ret == z3.sat:
+            outside = self._check_outside_cone(solver, dropped, track,
+                                               substitution)
+            if budget is not None:
+                budget.set_z3_timeout(outside)
+            ret = outside.check()
+            t4 = timer()
+            _tracer.info("Z3 check time outside of the cone: %f", t4 - t3)
+            metrics.add_timing('z3_check_outside_cone', t4 - t3)
+            if ret == z3.unsat:
+                self._solver_outside[solver] = outside
+        metrics.result = str(ret)
+        metrics.z3_stats = read_z3_statistics(solver.statistics())
+        model = None
+        if ret == z3.sat:
+            model = solver.model()
+            if outside is not None:
+                model = SlicedModel(model, outside.model())
+            if substitution is not None:
+                model = SubstitutedModel(model, substitution)
+        if cache_key and ret == z3.sat:
+            values = model.values() if substitution is not None \
+                else read_model_values(model)
+            self.model_cache.put(cache_key, str(ret), values=values)
+        elif cache_key and ret == z3.unsat:
+            self.model_cache.put(cache_key, str(ret),
+                                 unsat_core=self.unsat_core(solver) if track else None)
         if set_model and ret == z3.sat:
-            self.set_model(solver.model())
-            print "*" * 80
-        with open('smt_solvered.smt2', 'w') as outf:
-            outf.write(solver.to_smt2())
+            t4 = timer()
+            self.set_model(model, lazy=lazy_model)
+            metrics.add_timing('set_model', timer() - t4)
+        if out_solved_smt:
+            t5 = timer()
+            self.dump_smt(solver, out_solved_smt, async_dump, num_holes)
+            metrics.add_timing('dump', timer() - t5)
         return ret
 
+    def _check_outside_cone(self, solver, names, track, substitution):
+        """
+        Create a solver for the constraints outside of the cone of influence,
+        with the same tactic pipeline as the solver of the cone
+        """
+        outside = self.create_solver(
+            self._solver_tactics.get(solver), unsat_core=track)
+        self._assert_constraints(outside, names, track, substitution)
+        for name in self._enum_compare:
+            self._assert_enum_compare(outside, name, track)
+        return outside
+
+    def check_two_phase(self, solver, tracked_solver=None, **kwargs):
+        """
+        Check the constraints without tracking them first, since tracking
+        slows z3 down even when the constraints are sat.
+        Only when the first check is unsat, the constraints are asserted with
+        tracking in tracked_solver and checked again to read the unsat core.
+        :param solver: z3.Solver attached to the same z3 context
+        :param tracked_solver: z3.Solver used for the tracked check,
+                               a new solver is created if None
+        :param kwargs: passed to self.check
+        :return: (z3.sat, z3.unsat, or z3.unknown, the solver of the result)
+        """
+        assert 'track' not in kwargs, "The tracking is set by each phase"
+        assert not kwargs.get('incremental'), \
+            "Two phase checking doesn't support incremental checks"
+        # Only the solver of the result is dumped after the check
+        out_solved_smt = kwargs.pop('out_solved_smt', None)
+        num_holes = self.num_holes
+        ret = self.check(solver, track=False, **kwargs)
+        if self._false_names:
+            return ret, solver
+        if ret != z3.unsat:
+            if out_solved_smt and not self.last_metrics.cache_hit:
+                t1 = timer()
+                self.dump_smt(solver, out_solved_smt,
+                              kwargs.get('async_dump', True), num_holes)
+                self.last_metrics.add_timing('dump', timer() - t1)
+            return ret, solver
+        _tracer.info("Untracked check is unsat, "
+                     "checking again to read the unsat core")
+        untracked_metrics = self.last_metrics
+        if tracked_solver is None:
+            tracked_solver = z3.Solver(ctx=self.z3_ctx)
+        # Don't dump the same formula twice
+        kwargs.pop('out_smt', None)
+        ret = self.check(tracked_solver, track=True,
+                         out_solved_smt=out_solved_smt, **kwargs)
+        for phase, seconds in untracked_metrics.timings.iteritems():
+            self.last_metrics.add_timing('untracked_%s' % phase, seconds)
+        return ret, tracked_solver
+
+    def check_portfolio(self, num_workers=4, configs=None, timeout=None,
+                        set_model=True, lazy_model=False, substitute=False):
+        """
+        Serialize the constraints and solve them in worker processes,
+        each with a different seed, tactic or parameters.
+        The first sat/unsat answer wins and the other workers are terminated.
+        The constraints are not tracked, so no unsat core is available.
+        :param num_workers: number of worker processes
+        :param configs: list of worker configurations, default to
+                        smt_portfolio.portfolio_configs(num_workers, timeout)
+        :param timeout: optional z3 timeout (in ms) for each worker
+        :param set_model: concretize the variables when the result is sat
+        :param lazy_model: concretize the variables only when consulted
+        :param substitute: serialize the formula after substituting the
+                           equalities, see check
+        :return: z3.sat, z3.unsat, or z3.unknown
+        """
+        self._model_ref.model = None
+        if configs is None:
+            configs = portfolio_configs(num_workers, timeout)
+        metrics = self._create_metrics('portfolio', False, False)
+        if self._false_names:
+            return z3.unsat
+        smt2, substitution = self._serialize(metrics, substitute)
+        t2 = timer()
+        _tracer.debug("Start Z3 portfolio check with %d workers %f",
+                      len(configs), t2)
+        answer = solve_portfolio(smt2, self.z3_ctx, configs)
+        t3 = timer()
+        _tracer.info("Z3 portfolio check time: %f", t3 - t2)
+        _tracer.info("Z3 portfolio winner: %s", answer.winner)
+        for worker_id, err in answer.errors:
+            _tracer.warning("Z3 portfolio worker %d failed: %s", worker_id, err)
+        metrics.add_timing('z3_check', t3 - t2)
+        metrics.result = str(answer.result)
+        metrics.portfolio_winner = answer.winner
+        if set_model and answer.result == z3.sat:
+            model = answer.model
+            if substitution is not None:
+                model = SubstitutedModel(model, substitution)
+            self.set_model(model, lazy=lazy_model)
+            metrics.add_timing('set_model', timer() - t3)
+        return answer.result
+
+    def check_cubes(self, num_workers=4, max_cubes=None, selectors=None,
+                    tactic=None, timeout=None, set_model=True,
+                    lazy_model=False, substitute=False):
+        """
+        Split the formula into cubes over the values of the selector vars
+        and solve each cube in a pool of worker processes.
+        The result is sat with the model of the first sat cube, or unsat
+        when all the cubes are unsat.
+        The constraints are not tracked, so no unsat core is available.
+        :param num_workers: number of worker processes
+        :param max_cubes: the max number of cubes, 4 per worker by default
+        :param selectors: names of the selectors to split on, chosen from
+                          self.selectors by the size of their domains if None
+        :param tactic: the z3 tactic pipeline of the workers
+        :param timeout: optional z3 timeout (in ms) for each cube
+        :param set_model: concretize the variables when the result is sat
+        :param lazy_model: concretize the variables only when consulted
+        :param substitute: serialize the formula after substituting the
+                           equalities, see check. The replaced selectors
+                           aren't split on.
+        :return: z3.sat, z3.unsat, or z3.unknown
+        """
+        self._model_ref.model = None
+        if max_cubes is None:
+            max_cubes = 4 * num_workers
+        metrics = self._create_metrics('cubes', False, False)
+        if self._false_names:
+            return z3.unsat
+        smt2, substitution = self._serialize(metrics, substitute)
+        candidates = self._selectors
+        if selectors is not None:
+            candidates = OrderedDict(
+                (name, self._selectors[name]) for name in selectors)
+        if substitution is not None:
+            candidates = OrderedDict(
+                (name, values) for name, values in candidates.iteritems()
+                if name not in substitution.eliminated)
+        cubes = enumerate_cubes(choose_selectors(candidates, max_cubes))
+        t2 = timer()
+        _tracer.info("Z3 cubes check, %d cubes over %d selectors with %d "
+                     "workers", len(cubes), len(cubes[0]), num_workers)
+        params = {'timeout': timeout} if timeout else {}
+        answer = solve_cubes(smt2, self.z3_ctx, cubes, num_workers,
+                             tactic=tactic, params=params)
+        t3 = timer()
+        _tracer.info("Z3 cubes check time: %f, solved %d of %d cubes",
+                     t3 - t2, answer.num_solved, len(cubes))
+        for cube_id, err in answer.errors:
+            _tracer.warning("Z3 cube %s failed: %s", cube_id, err)
+        metrics.add_timing('z3_check', t3 - t2)
+        metrics.result = str(answer.result)
+        metrics.num_cubes = len(cubes)
+        if set_model and answer.result == z3.sat:
+            model = answer.model
+            if substitution is not None:
+                model = SubstitutedModel(model, substitution)
+            self.set_model(model, lazy=lazy_model)
+            metrics.add_timing('set_model', timer() - t3)
+        return answer.result
+
     @staticmethod
     def create_context(announcements, prefix_list=None, peer_list=None,
                        as_path_list=None, next_hop_list=None,
-                       create_as_paths=True):
+                       create_as_paths=True, provenance=None, bv_widths=None,
+                       rmap_order=RMAP_ORDER_PAIRWISE):
         """
         Creates the SMT context that contains all the known announcements
+        :param provenance: optional smt_provenance.ProvenanceIndex
+        :param bv_widths: optional dict of attribute -> bit-vector width
+                          (see BV_ATTRS, DEFAULT_BV_WIDTHS, infer_bv_widths)
+        :param rmap_order: RMAP_ORDER_PAIRWISE or RMAP_ORDER_CHAINED
         :return: SMTContext
         """
         prefix_list = prefix_list if prefix_list else []
@@ -597,11 +1951,14 @@ class SolverContext(object):
         announcements = announcements if announcements else []
         assert announcements, "No announcements defined to extract context from"
         ctx = SolverContext(z3.Context())
+        ctx.provenance = provenance
+        ctx.bv_widths = bv_widths
+        ctx.rmap_order = rmap_order
 
         # Prefixes prefix_list + read_list (x.prefix for x in announcements)
         read_list = [x.prefix for x in announcements if not is_empty(x.prefix)]
         prefix_list = list(set(read_list + prefix_list))
-        prefix_list = [sanitize_smt_name(prefix) for prefix in prefix_list]
+        prefix_list = [ctx.smt_names.sanitize(prefix) for prefix in prefix_list]
         ctx.create_enum_type(PREFIX_SORT, prefix_list)
 
         # Peers peer_list + read_list (x.peer for x in announcements)
@@ -625,11 +1982,11 @@ class SolverContext(object):
         origin_next_hop = '0.0.0.0'
         read_list.append(origin_next_hop)
         next_hop_list = list(set(read_list + next_hop_list))
-        next_hop_list = [sanitize_smt_name(next_hop) for next_hop in next_hop_list]
+        next_hop_list = [ctx.smt_names.sanitize(next_hop) for next_hop in next_hop_list]
         vsort = ctx.create_enum_type(NEXT_HOP_SORT, next_hop_list)
 
         ctx.communities = announcements[0].communities.keys()
-        ctx.origin_next_hop = sanitize_smt_name(origin_next_hop)
+        ctx.origin_next_hop = ctx.smt_names.sanitize(origin_next_hop)
         ctx.origin_next_hop_var = vsort.get_symbolic_value(ctx.origin_next_hop)
         return ctx
 
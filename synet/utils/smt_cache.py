@@ -0,0 +1,121 @@
+"""
+Persistent on-disk cache of the solutions of SMT formulas
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# Bump when the format of the cache entries changes
+CACHE_VERSION = 1
+
+
+def fingerprint(smt2, enum_types):
+    """
+    Compute a fingerprint of a formula
+    :param smt2: the formula as SMT-LIB declarations and assertions
+    :param enum_types: list of (enum type name, list of values)
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update('v%d\n' % CACHE_VERSION)
+    for name, values in sorted(enum_types):
+        digest.update('%s:%s\n' % (name, ','.join(str(v) for v in values)))
+    digest.update(smt2)
+    return digest.hexdigest()
+
+
+def read_model_values(model):
+    """
+    Read the values of all the constants in a z3 model
+    :return: dict of constant name -> value as printed by z3
+    """
+    return dict((decl.name(), str(model[decl]))
+                for decl in model.decls() if decl.arity() == 0)
+
+
+class ModelCache(object):
+    """
+    Keep the satisfying assignment or the unsat core of formulas on disk,
+    one JSON file per fingerprint. The least recently used entries are
+    evicted when the total size exceeds max_size bytes.
+    """
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, '%s.json' % key)
+
+    def get(self, key):
+        """
+        Read a cache entry
+        :return: dict with 'result' and 'values' or 'unsat_core', or None
+        """
+        path = self._path(key)
+        try:
+            with open(path) as inf:
+                entry = json.load(inf)
+        except (IOError, OSError, ValueError):
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, result, values=None, unsat_core=None):
+        """
+        Write a cache entry and evict old entries if needed
+        :param key: the formula fingerprint
+        :param result: 'sat' or 'unsat'
+        :param values: the model values if sat, see read_model_values
+        :param unsat_core: list of constraint names if unsat and tracked
+        """
+        entry = dict(result=result, values=values, unsat_core=unsat_core)
+        # Write to a temp file first, so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as outf:
+            json.dump(entry, outf)
+        os.rename(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries above max_size"""
+        entries = []
+        total = 0
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Remove all the entries"""
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json'):
+                os.remove(os.path.join(self.directory, filename))
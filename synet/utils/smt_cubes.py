@@ -0,0 +1,157 @@
+"""
+Cube-and-conquer: split the SMT formula on small-domain selector
+variables and solve the cubes in worker processes
+"""
+
+import itertools
+import multiprocessing
+from Queue import Empty
+
+import z3
+
+from synet.utils.smt_cache import read_model_values
+from synet.utils.smt_portfolio import ValuesModel
+from synet.utils.smt_tactics import create_solver
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def choose_selectors(selectors, max_cubes):
+    """
+    Pick the selectors to split on, the selectors with the largest domains
+    first, as long as the number of cubes stays within max_cubes
+    :param selectors: dict of var name -> list of possible values
+    :param max_cubes: the max number of cubes
+    :return: list of (var name, values)
+    """
+    chosen = []
+    num_cubes = 1
+    candidates = sorted(selectors.iteritems(),
+                        key=lambda item: (-len(item[1]), item[0]))
+    for name, values in candidates:
+        if len(values) < 2:
+            continue
+        if num_cubes * len(values) > max_cubes:
+            continue
+        chosen.append((name, values))
+        num_cubes *= len(values)
+    return chosen
+
+
+def enumerate_cubes(chosen):
+    """
+    All the combinations of the chosen selector values
+    :param chosen: list of (var name, values), see choose_selectors
+    :return: list of cubes, each is a list of (var name, value)
+    """
+    names = [name for name, _ in chosen]
+    return [zip(names, values) for values in
+            itertools.product(*[values for _, values in chosen])]
+
+
+def _cube_worker(smt2, tactic, params, tasks, results):
+    """Solve the cubes from the tasks queue until reading None"""
+    try:
+        ctx = z3.Context()
+        solver = create_solver(tactic, ctx=ctx)
+        for key, value in params.iteritems():
+            solver.set(key, value)
+        solver.add(z3.parse_smt2_string(smt2, ctx=ctx))
+    except Exception as exp:
+        results.put((None, str(z3.unknown), None, str(exp)))
+        return
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        cube_id, cube = task
+        try:
+            # The cube is assumed, so the learned lemmas are kept
+            # for the next cubes
+            assumptions = [z3.Int(name, ctx) == value for name, value in cube]
+            ret = solver.check(*assumptions)
+            values = None
+            if ret == z3.sat:
+                values = read_model_values(solver.model())
+            results.put((cube_id, str(ret), values, None))
+        except Exception as exp:
+            results.put((cube_id, str(z3.unknown), None, str(exp)))
+
+
+class CubesResult(object):
+    """The merged answer of the cubes"""
+
+    def __init__(self, result, model, cubes, sat_cube, num_solved, errors):
+        self.result = result
+        self.model = model
+        self.cubes = cubes
+        # The cube of the model, None if not sat
+        self.sat_cube = sat_cube
+        self.num_solved = num_solved
+        self.errors = errors
+
+
+def solve_cubes(smt2, z3_ctx, cubes, num_workers, tactic=None, params=None):
+    """
+    Solve the formula under each cube in a pool of worker processes.
+    The answer is sat as soon as one cube is sat, unsat when all the cubes
+    are unsat, and unknown otherwise.
+    :param smt2: the formula as SMT-LIB declarations and assertions
+    :param z3_ctx: the z3 context to read the model in
+    :param cubes: list of cubes, see enumerate_cubes
+    :param num_workers: number of worker processes
+    :param tactic: the z3 tactic pipeline of the workers
+    :param params: dict of z3 solver parameters of the workers
+    :return: CubesResult
+    """
+    num_workers = min(num_workers, len(cubes))
+    tasks = multiprocessing.Queue()
+    for cube_id, cube in enumerate(cubes):
+        tasks.put((cube_id, cube))
+    for _ in range(num_workers):
+        tasks.put(None)
+    results = multiprocessing.Queue()
+    workers = []
+    for _ in range(num_workers):
+        worker = multiprocessing.Process(
+            target=_cube_worker,
+            args=(smt2, tactic, params or {}, tasks, results))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    answer = CubesResult(z3.unknown, None, cubes, None, 0, [])
+    num_unsat = 0
+    try:
+        while answer.num_solved < len(cubes):
+            try:
+                cube_id, ret, values, err = results.get(timeout=0.5)
+            except Empty:
+                # Don't wait for workers that died without answering
+                if not any(worker.is_alive() for worker in workers) and \
+                        results.empty():
+                    break
+                continue
+            if cube_id is None:
+                # The worker couldn't read the formula
+                answer.errors.append((cube_id, err))
+                continue
+            answer.num_solved += 1
+            if err:
+                answer.errors.append((cube_id, err))
+            if ret == str(z3.sat):
+                answer.result = z3.sat
+                answer.model = ValuesModel(values, z3_ctx)
+                answer.sat_cube = cubes[cube_id]
+                break
+            elif ret == str(z3.unsat):
+                num_unsat += 1
+        if num_unsat == len(cubes):
+            answer.result = z3.unsat
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+    return answer
@@ -0,0 +1,150 @@
+"""
+Write SMT-LIB dumps of z3 solvers without blocking the solving
+"""
+
+import collections
+import gzip
+import logging
+import threading
+
+import z3
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def open_smt_file(filename, compress=None):
+    """
+    Open a file to write an SMT-LIB dump
+    :param filename: the output filename
+    :param compress: gzip the output, if None then compress only when the
+                     filename ends with '.gz'
+    :return: file object
+    """
+    if compress is None:
+        compress = filename.endswith('.gz')
+    if compress:
+        return gzip.open(filename, 'wb')
+    return open(filename, 'w')
+
+
+def write_smt2(solver, out, compress=None, header=None):
+    """
+    Stream the SMT-LIB formula of the solver assertions, the assertions are
+    serialized one at a time so the whole formula is never held as a string
+    :param solver: z3.Solver
+    :param out: a filename or a file like object
+    :param compress: see open_smt_file
+    :param header: optional SMT-LIB comment lines written first
+    """
+    if isinstance(out, basestring):
+        with open_smt_file(out, compress) as outf:
+            _write_assertions(solver, outf, header)
+    else:
+        _write_assertions(solver, out, header)
+
+
+def smt2_declarations(assertions, ctx):
+    """
+    The SMT-LIB declarations of the sorts and the symbols in the assertions
+    :param assertions: iterable of z3.BoolRef
+    :param ctx: the z3 context of the assertions
+    :return: str
+    """
+    # One application of each uninterpreted function (and of each
+    # datatype constant, so its sort is declared)
+    apps = collections.OrderedDict()
+    seen = set()
+    todo = list(assertions)
+    while todo:
+        expr = todo.pop()
+        if expr.get_id() in seen:
+            continue
+        seen.add(expr.get_id())
+        if z3.is_quantifier(expr):
+            todo.append(expr.body())
+            continue
+        if not z3.is_app(expr):
+            continue
+        decl = expr.decl()
+        if decl.kind() == z3.Z3_OP_UNINTERPRETED or (
+                expr.num_args() == 0 and
+                isinstance(expr.sort(), z3.DatatypeSortRef)):
+            apps.setdefault(decl.get_id(), expr)
+        todo.extend(expr.children())
+    if not apps:
+        return ''
+    # Let z3 print the declarations of a formula over the same symbols
+    witness = z3.Solver(ctx=ctx)
+    witness.add(z3.And([app == app for app in apps.values()], ctx))
+    smt2 = witness.to_smt2()
+    return smt2[:smt2.index('(assert')]
+
+
+def _write_assertions(solver, outf, header):
+    assertions = solver.assertions()
+    if header:
+        outf.write(header)
+    outf.write(smt2_declarations(assertions, solver.ctx))
+    for assertion in assertions:
+        outf.write('(assert\n %s)\n' % assertion.sexpr())
+    outf.write('(check-sat)\n')
+
+
+class SMTDumper(object):
+    """
+    Write SMT-LIB dumps on background threads.
+    The solver is first translated to a fresh z3 context, so the
+    serialization doesn't share a context with the (possibly running)
+    solver.
+    """
+
+    def __init__(self, compress=None):
+        """
+        :param compress: gzip the dumps, if None then compress only when the
+                         filename ends with '.gz'
+        """
+        self.log = logging.getLogger('%s.%s' % (
+            self.__module__, self.__class__.__name__))
+        self.compress = compress
+        self._threads = []
+        self._errors = []
+
+    def dump(self, solver, out, header=None):
+        """
+        Schedule writing the current assertions of the solver
+        :param solver: z3.Solver
+        :param out: a filename or a file like object
+        :param header: see write_smt2
+        :return: None
+        """
+        # Solver.translate rejects solvers with tracked assertions,
+        # so copy the assertions vector instead
+        target = z3.Context()
+        snapshot = z3.Solver(ctx=target)
+        snapshot.add(solver.assertions().translate(target))
+        thread = threading.Thread(target=self._write,
+                                  args=(snapshot, out, header))
+        self._threads = [t for t in self._threads if t.is_alive()]
+        self._threads.append(thread)
+        thread.start()
+
+    def _write(self, solver, out, header):
+        try:
+            write_smt2(solver, out, self.compress, header)
+        except Exception as exp:
+            self.log.error("Couldn't write SMT dump to %s: %s", out, exp)
+            self._errors.append((out, exp))
+
+    def wait(self):
+        """
+        Block until all the scheduled dumps are written
+        :return: list of (out, exception) of the failed dumps
+        """
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        errors = self._errors
+        self._errors = []
+        return errors
@@ -0,0 +1,153 @@
+"""
+Structured metrics about encoding and solving SMT problems
+"""
+
+import json
+import re
+from collections import Counter
+from collections import OrderedDict
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# The numeric suffix added by SolverContext to generated names
+_NAME_SUFFIX = re.compile(r'\d+$')
+
+
+def constraint_name_prefix(name):
+    """
+    Group constraint names by stripping the generated numeric suffix
+    e.g., 'SelectOne_index_12' -> 'SelectOne_index_'
+    """
+    prefix = _NAME_SUFFIX.sub('', name)
+    return prefix if prefix else name
+
+
+def read_z3_statistics(stats):
+    """
+    Convert z3.Statistics to a dict
+    :param stats: z3.Statistics returned by solver.statistics()
+    :return: dict key -> int or float
+    """
+    ret = OrderedDict()
+    for key in stats.keys():
+        ret[key] = stats.get_key_value(key)
+    return ret
+
+
+def _ratio(part, total):
+    if not total:
+        return None
+    return part / (total * 1.0)
+
+
+class SolveMetrics(object):
+    """
+    The metrics of a single SolverContext.check() or
+    SynthesisComponent.solve() call
+    """
+
+    def __init__(self, num_vars=0, num_constraints=0,
+                 partially_eval_vars=0, partially_eval_const=0,
+                 incremental=False, track=True, tactic=None):
+        self.result = None
+        self.num_vars = num_vars
+        self.num_constraints = num_constraints
+        self.partially_eval_vars = partially_eval_vars
+        self.partially_eval_const = partially_eval_const
+        self.incremental = incremental
+        self.track = track
+        # Name of the tactic pipeline used to solve
+        self.tactic = tactic
+        # Time spent (in seconds) in each phase of the check, in order
+        self.timings = OrderedDict()
+        # Number of constraints per name prefix
+        self.constraint_prefixes = Counter()
+        # Raw z3 statistics of the solver after the check
+        self.z3_stats = OrderedDict()
+        # Names of the constraints that are always False
+        self.false_constraints = []
+        # Configuration of the worker that answered first in portfolio mode
+        self.portfolio_winner = None
+        # True/False if the model cache was consulted
+        self.cache_hit = None
+        # smt_slicing.ConeSlice.report() if the formula was sliced
+        self.cone = None
+        # Number of cubes the formula was split into in cubes mode
+        self.num_cubes = None
+        # smt_substitution.EqualitySubstitution.report() if the equalities
+        # were substituted
+        self.substitution = None
+
+    @property
+    def partially_eval_vars_ratio(self):
+        return _ratio(self.partially_eval_vars, self.num_vars)
+
+    @property
+    def partially_eval_const_ratio(self):
+        return _ratio(self.partially_eval_const, self.num_constraints)
+
+    @property
+    def partially_eval_ratio(self):
+        return _ratio(self.partially_eval_vars + self.partially_eval_const,
+                      self.num_vars + self.num_constraints)
+
+    @property
+    def total_time(self):
+        return sum(self.timings.values())
+
+    def add_timing(self, phase, seconds):
+        """Accumulate the time spent in the given phase"""
+        self.timings[phase] = self.timings.get(phase, 0) + seconds
+
+    def count_constraints(self, names):
+        """Count the given constraint names by their prefix"""
+        for name in names:
+            self.constraint_prefixes[constraint_name_prefix(name)] += 1
+
+    def to_dict(self):
+        """Return the metrics as a JSON serializable dict"""
+        return OrderedDict([
+            ('result', self.result),
+            ('incremental', self.incremental),
+            ('track', self.track),
+            ('tactic', self.tactic),
+            ('num_vars', self.num_vars),
+            ('num_constraints', self.num_constraints),
+            ('partially_eval_vars', self.partially_eval_vars),
+            ('partially_eval_const', self.partially_eval_const),
+            ('partially_eval_vars_ratio', self.partially_eval_vars_ratio),
+            ('partially_eval_const_ratio', self.partially_eval_const_ratio),
+            ('partially_eval_ratio', self.partially_eval_ratio),
+            ('timings', self.timings),
+            ('total_time', self.total_time),
+            ('constraint_prefixes', OrderedDict(
+                sorted(self.constraint_prefixes.items()))),
+            ('false_constraints', self.false_constraints),
+            ('portfolio_winner', self.portfolio_winner),
+            ('cache_hit', self.cache_hit),
+            ('cone', self.cone),
+            ('num_cubes', self.num_cubes),
+            ('substitution', self.substitution),
+            ('z3_stats', self.z3_stats),
+        ])
+
+    def to_json(self, **kwargs):
+        """Serialize the metrics to a JSON string"""
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def write_json(self, out):
+        """
+        Write the metrics as a single JSON line
+        :param out: a filename (appended to) or a file like object
+        """
+        if isinstance(out, basestring):
+            with open(out, 'a') as outf:
+                outf.write(self.to_json() + '\n')
+        else:
+            out.write(self.to_json() + '\n')
+
+    def __str__(self):
+        return self.to_json(indent=2)
@@ -0,0 +1,294 @@
+"""
+Minimize unsat cores to minimal unsatisfiable subsets (MUSes) and enumerate
+more of them (MARCO style) in a background process
+"""
+
+import multiprocessing
+from Queue import Empty
+
+import z3
+
+from synet.utils.budget import Budget
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def _literals(names, ctx):
+    return [z3.Bool(name, ctx) for name in names]
+
+
+def shrink(solver, names, ctx):
+    """
+    Deletion based minimization of an unsat set of tracked constraints,
+    the unsat core of each unsat check drops more than one at a time
+    :param solver: z3.Solver with the constraints asserted as
+                   (=> name constraint)
+    :param names: the names of an unsat subset of the tracked constraints
+    :return: (the remaining names, True if they're proven minimal)
+    """
+    minimal = True
+    mus = list(names)
+    i = 0
+    while i < len(mus):
+        candidate = mus[:i] + mus[i + 1:]
+        ret = solver.check(*_literals(candidate, ctx))
+        if ret == z3.unsat:
+            core = set(str(lit) for lit in solver.unsat_core())
+            mus = [name for name in candidate if name in core]
+        else:
+            # Removing it made the set sat, it's necessary
+            if ret == z3.unknown:
+                minimal = False
+            i += 1
+    return mus, minimal
+
+
+def grow(solver, names, all_names, ctx):
+    """
+    Extend a sat set of tracked constraints to a maximal sat set
+    :return: set of names
+    """
+    mss = set(names)
+    for name in all_names:
+        if name in mss:
+            continue
+        if solver.check(*_literals(sorted(mss) + [name], ctx)) == z3.sat:
+            mss.add(name)
+    return mss
+
+
+def enumerate_muses(solver, names, ctx, max_muses=1, budget=None,
+                    on_mus=None):
+    """
+    Enumerate the MUSes of an unsat set of tracked constraints.
+    The first MUS is shrunk from the whole set, the next ones are found by
+    exploring the subsets not covered yet (MARCO).
+    :param solver: z3.Solver with the constraints asserted as
+                   (=> name constraint)
+    :param names: the names of the tracked constraints to consider
+    :param max_muses: stop after finding this many MUSes
+    :param budget: optional utils.budget.Budget, the z3 checks are limited
+                   to the remaining time
+    :param on_mus: optional callable(names, minimal) called for each MUS
+    :return: (list of (names, minimal), True if there are no more MUSes)
+    """
+    budget = budget or Budget()
+    names = list(names)
+    map_solver = z3.Solver(ctx=ctx)
+    muses = []
+    while len(muses) < max_muses:
+        if budget.expired():
+            return muses, False
+        budget.set_z3_timeout(solver)
+        if map_solver.check() != z3.sat:
+            return muses, True
+        model = map_solver.model()
+        # Unassigned constraints are part of the seed to get larger seeds
+        seed = [name for name in names if not z3.is_false(
+            model.eval(z3.Bool(name, ctx), model_completion=False))]
+        ret = solver.check(*_literals(seed, ctx))
+        if ret == z3.sat:
+            mss = grow(solver, seed, names, ctx)
+            outside = [name for name in names if name not in mss]
+            if not outside:
+                # All the constraints are sat together
+                return muses, True
+            # Any MUS has a constraint outside this MSS
+            map_solver.add(z3.Or(*(_literals(outside, ctx) + [ctx])))
+        elif ret == z3.unsat:
+            core = set(str(lit) for lit in solver.unsat_core())
+            mus, minimal = shrink(
+                solver, [name for name in seed if name in core], ctx)
+            muses.append((mus, minimal))
+            if on_mus:
+                on_mus(mus, minimal)
+            # Don't find the same MUS (or its supersets) again
+            map_solver.add(z3.Or(*([z3.Not(lit) for lit in
+                                    _literals(mus, ctx)] + [ctx])))
+        else:
+            return muses, False
+    return muses, False
+
+
+def _mus_worker(smt2, names, max_muses, timeout, results):
+    """Enumerate the MUSes and put each one in the results queue"""
+    try:
+        budget = Budget(timeout)
+        ctx = z3.Context()
+        solver = z3.Solver(ctx=ctx)
+        solver.set('unsat_core', True)
+        solver.add(z3.parse_smt2_string(smt2, ctx=ctx))
+
+        def on_mus(mus, minimal):
+            results.put(('mus', mus, minimal))
+
+        _, complete = enumerate_muses(solver, names, ctx, max_muses,
+                                      budget=budget, on_mus=on_mus)
+        results.put(('done', complete, None))
+    except Exception as exp:
+        results.put(('done', False, str(exp)))
+
+
+class MinimizedCore(object):
+    """A MUS and where its constraints come from"""
+
+    def __init__(self, names, minimal=True, constraints=None):
+        """
+        :param names: the names of the constraints in the MUS
+        :param minimal: False if a z3 check timed out while shrinking
+        :param constraints: list of dicts with the 'name', 'requirement',
+                            and 'holes' (and other provenance) of each
+                            constraint
+        """
+        self.names = names
+        self.minimal = minimal
+        self.constraints = constraints or [dict(name=name) for name in names]
+
+    @property
+    def requirements(self):
+        """The requirements involved in the MUS"""
+        reqs = []
+        for const in self.constraints:
+            req = const.get('requirement')
+            if req is not None and req not in reqs:
+                reqs.append(req)
+        return reqs
+
+    @property
+    def holes(self):
+        """The names of the sketch holes mentioned by the MUS"""
+        holes = set()
+        for const in self.constraints:
+            holes.update(const.get('holes', []))
+        return sorted(holes)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return "MinimizedCore(%s, requirements=%s)" % (
+            self.names, self.requirements)
+
+
+class CoreMinimization(object):
+    """
+    Handle of a background core minimization, the raw core is available
+    right away and the MUSes as the worker finds them
+    """
+
+    def __init__(self, raw_core, explain=None):
+        """
+        :param raw_core: the names in the unsat core
+        :param explain: optional callable(names) that returns the list of
+                        provenance dicts of the constraints
+        """
+        self.raw_core = raw_core
+        self._explain = explain
+        self._muses = []
+        # True if there are no more MUSes than the ones found
+        self.complete = False
+        self.error = None
+        self._finished = False
+        self._process = None
+        self._results = None
+
+    def _add(self, names, minimal):
+        constraints = self._explain(names) if self._explain else None
+        self._muses.append(MinimizedCore(names, minimal, constraints))
+
+    def start(self, smt2, max_muses=1, timeout=None):
+        """
+        Start the worker process
+        :param smt2: SMT-LIB formula that asserts each constraint of the
+                     raw core as (=> name constraint), the constraints
+                     outside of the core are dropped when their name is
+                     left unconstrained
+        :param max_muses: the number of MUSes to enumerate
+        :param timeout: optional seconds for the whole minimization
+        """
+        self._results = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_mus_worker,
+            args=(smt2, self.raw_core, max_muses, timeout, self._results))
+        self._process.daemon = True
+        self._process.start()
+        return self
+
+    def set_muses(self, muses, complete=True):
+        """Resolve without a worker when the MUSes are known already"""
+        for names in muses:
+            self._add(names, True)
+        self.complete = complete
+        self._finished = True
+        return self
+
+    def _read(self, block, timeout):
+        while not self._finished:
+            try:
+                msg = self._results.get(block, timeout)
+            except Empty:
+                if self._process.is_alive() or not self._results.empty():
+                    return
+                self.error = "The core minimization process died"
+                self._finish()
+                return
+            if msg[0] == 'mus':
+                self._add(msg[1], msg[2])
+            else:
+                self.complete, self.error = msg[1], msg[2]
+                self._finish()
+
+    def _finish(self):
+        self._finished = True
+        self._process.join()
+
+    def done(self):
+        """True when the worker is finished"""
+        self._read(False, None)
+        return self._finished
+
+    def result(self, timeout=None):
+        """
+        Wait for the worker to finish
+        :param timeout: optional seconds to wait, the MUSes found so far
+                        are returned if it's not finished by then
+        :return: list of MinimizedCore
+        """
+        if timeout is None:
+            while not self._finished:
+                self._read(True, 0.5)
+        else:
+            budget = Budget(timeout)
+            while not self._finished and not budget.expired():
+                self._read(True, min(0.5, budget.remaining()) or 0.01)
+        return self._muses[:]
+
+    def cancel(self):
+        """Stop the worker, keeping the MUSes found so far"""
+        if self._finished:
+            return
+        self._read(False, None)
+        if not self._finished:
+            self._process.terminate()
+            self._finish()
+
+    def __repr__(self):
+        return "CoreMinimization(raw_core=%d, muses=%d, finished=%s)" % (
+            len(self.raw_core), len(self._muses), self._finished)
+
+
+def minimize_core_async(smt2, raw_core, max_muses=1, timeout=None,
+                        explain=None):
+    """
+    Minimize an unsat core in a background process
+    :param smt2: see CoreMinimization.start
+    :param raw_core: the names in the unsat core
+    :param max_muses: the number of MUSes to enumerate
+    :param timeout: optional seconds for the whole minimization
+    :param explain: see CoreMinimization
+    :return: CoreMinimization
+    """
+    handle = CoreMinimization(list(raw_core), explain)
+    return handle.start(smt2, max_muses, timeout)
@@ -0,0 +1,173 @@
+"""
+Solve the same SMT formula in several processes with different z3
+configurations, the first answer wins
+"""
+
+import multiprocessing
+from Queue import Empty
+
+import z3
+
+from synet.utils.smt_cache import read_model_values
+from synet.utils.smt_tactics import create_solver
+from synet.utils.smt_tactics import tactic_name
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# Variations used by the workers, the seed is changed for every worker
+PORTFOLIO_VARIANTS = [
+    dict(tactic=None, params={}),
+    dict(tactic='fast-bgp', params={}),
+    dict(tactic=None, params={'phase_selection': 0}),
+    dict(tactic=None, params={'restart_strategy': 0}),
+]
+
+
+def portfolio_configs(num_workers, timeout=None):
+    """
+    Create a configuration for each worker
+    :param num_workers: number of worker processes
+    :param timeout: optional z3 timeout (in ms) for each worker
+    :return: list of dicts with 'seed', 'tactic', and 'params'
+    """
+    configs = []
+    for index in range(num_workers):
+        variant = PORTFOLIO_VARIANTS[index % len(PORTFOLIO_VARIANTS)]
+        params = dict(variant['params'])
+        if timeout:
+            params['timeout'] = timeout
+        configs.append(dict(seed=index, tactic=variant['tactic'],
+                            params=params))
+    return configs
+
+
+def _solve_worker(worker_id, smt2, config, results):
+    """Solve the formula in a fresh z3 context and report the model"""
+    try:
+        ctx = z3.Context()
+        solver = create_solver(config['tactic'], ctx=ctx)
+        solver.set('random_seed', config['seed'])
+        for key, value in config['params'].iteritems():
+            solver.set(key, value)
+        solver.add(z3.parse_smt2_string(smt2, ctx=ctx))
+        ret = solver.check()
+        values = None
+        if ret == z3.sat:
+            values = read_model_values(solver.model())
+        results.put((worker_id, str(ret), values, None))
+    except Exception as exp:
+        results.put((worker_id, str(z3.unknown), None, str(exp)))
+
+
+class ValuesModel(object):
+    """
+    A read only model built from the values reported by a worker.
+    It provides the subset of z3.ModelRef used to concretize SMTVars.
+    """
+
+    def __init__(self, values, z3_ctx):
+        """
+        :param values: dict of constant name -> value as printed by z3
+        :param z3_ctx: the z3 context of the parent formula
+        """
+        self.values = values
+        self.z3_ctx = z3_ctx
+        self._constructors = {}
+
+    def _enum_value(self, sort, name):
+        if sort.name() not in self._constructors:
+            self._constructors[sort.name()] = dict(
+                (sort.constructor(i).name(), sort.constructor(i)())
+                for i in range(sort.num_constructors()))
+        return self._constructors[sort.name()][name]
+
+    def eval(self, expr, model_completion=False):
+        """Return the value of a constant as a z3 value"""
+        name = expr.decl().name()
+        if name not in self.values:
+            return expr
+        value = self.values[name]
+        sort = expr.sort()
+        if z3.is_bool(expr):
+            return z3.BoolVal(value == 'True', ctx=self.z3_ctx)
+        elif z3.is_int(expr):
+            return z3.IntVal(int(value), ctx=self.z3_ctx)
+        elif z3.is_bv(expr):
+            return z3.BitVecVal(int(value), sort.size(), ctx=self.z3_ctx)
+        elif isinstance(sort, z3.DatatypeSortRef):
+            return self._enum_value(sort, value)
+        raise NotImplementedError(
+            "Unsupported sort %s of %s" % (sort, name))
+
+
+class PortfolioResult(object):
+    """The answer of the first worker"""
+
+    def __init__(self, result, model, config, worker_id, errors):
+        self.result = result
+        self.model = model
+        self.config = config
+        self.worker_id = worker_id
+        self.errors = errors
+
+    @property
+    def winner(self):
+        """Describe the configuration of the winning worker"""
+        if self.config is None:
+            return None
+        return dict(worker=self.worker_id, seed=self.config['seed'],
+                    tactic=tactic_name(self.config['tactic']),
+                    params=self.config['params'])
+
+
+def solve_portfolio(smt2, z3_ctx, configs):
+    """
+    Solve the formula in a worker process per configuration.
+    Returns the first sat/unsat answer and terminates the other workers.
+    :param smt2: the formula as SMT-LIB declarations and assertions
+    :param z3_ctx: the z3 context to read the model in
+    :param configs: list of worker configurations, see portfolio_configs
+    :return: PortfolioResult
+    """
+    results = multiprocessing.Queue()
+    workers = []
+    for worker_id, config in enumerate(configs):
+        worker = multiprocessing.Process(
+            target=_solve_worker, args=(worker_id, smt2, config, results))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    answer = PortfolioResult(z3.unknown, None, None, None, [])
+    try:
+        answered = 0
+        while answered < len(workers):
+            try:
+                worker_id, ret, values, err = results.get(timeout=0.5)
+            except Empty:
+                # Don't wait for workers that died without answering
+                if not any(worker.is_alive() for worker in workers) and \
+                        results.empty():
+                    break
+                continue
+            answered += 1
+            if err:
+                answer.errors.append((worker_id, err))
+            if ret == str(z3.sat):
+                answer = PortfolioResult(
+                    z3.sat, ValuesModel(values, z3_ctx), configs[worker_id],
+                    worker_id, answer.errors)
+                break
+            elif ret == str(z3.unsat):
+                answer = PortfolioResult(
+                    z3.unsat, None, configs[worker_id], worker_id,
+                    answer.errors)
+                break
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+    return answer
@@ -0,0 +1,232 @@
+"""
+Index of where the SMT variables and constraints come from, so the names
+in unsat cores and SMT dumps can be traced back to the network.
+"""
+
+import json
+import sqlite3
+
+import z3
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# The provenance fields that have their own (indexed) column,
+# the rest are kept as JSON in the info column
+PROVENANCE_FIELDS = ('router', 'route_map', 'line', 'requirement',
+                     'announcement')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vars (
+    name TEXT PRIMARY KEY,
+    sort TEXT,
+    router TEXT,
+    route_map TEXT,
+    line INTEGER,
+    requirement TEXT,
+    announcement TEXT,
+    info TEXT
+);
+CREATE TABLE IF NOT EXISTS constraints (
+    name TEXT PRIMARY KEY,
+    folded INTEGER,
+    router TEXT,
+    route_map TEXT,
+    line INTEGER,
+    requirement TEXT,
+    announcement TEXT,
+    info TEXT
+);
+CREATE TABLE IF NOT EXISTS mentions (
+    var TEXT,
+    constraint_name TEXT,
+    PRIMARY KEY (var, constraint_name)
+);
+CREATE INDEX IF NOT EXISTS mentions_constraint
+    ON mentions (constraint_name);
+CREATE INDEX IF NOT EXISTS vars_router ON vars (router, route_map);
+CREATE INDEX IF NOT EXISTS constraints_router
+    ON constraints (router, route_map);
+"""
+
+
+def expr_var_names(expr):
+    """
+    The names of the uninterpreted constants (the SMT variables)
+    in a z3 expression
+    :return: set of names
+    """
+    names = set()
+    seen = set()
+    todo = [expr]
+    while todo:
+        term = todo.pop()
+        term_id = term.get_id()
+        if term_id in seen:
+            continue
+        seen.add(term_id)
+        if z3.is_const(term):
+            if term.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+                names.add(term.decl().name())
+        elif z3.is_app(term):
+            todo.extend(term.children())
+        elif z3.is_quantifier(term):
+            todo.append(term.body())
+    return names
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (basestring, int, long, float, bool)):
+        return value
+    return str(value)
+
+
+def _split_fields(fields):
+    """Split the fields into the indexed columns and the rest as JSON"""
+    columns = [_json_value(fields.get(key)) for key in PROVENANCE_FIELDS]
+    rest = dict((key, _json_value(value)) for key, value in fields.iteritems()
+                if key not in PROVENANCE_FIELDS and value is not None)
+    columns.append(json.dumps(rest, sort_keys=True) if rest else None)
+    return columns
+
+
+class ProvenanceIndex(object):
+    """
+    Record the provenance of the variables and the constraints of a
+    SolverContext in SQLite, and the variables each constraint mentions.
+    The rows are written in batches, call flush() before querying from
+    another connection.
+    """
+
+    def __init__(self, path=':memory:', batch_size=10000, reset=False):
+        """
+        :param path: the SQLite database file, in memory by default
+        :param batch_size: number of rows buffered before writing them
+        :param reset: remove the rows recorded by previous runs
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(_SCHEMA)
+        self._vars = []
+        self._constraints = []
+        self._mentions = []
+        if reset:
+            self.clear()
+
+    def clear(self):
+        """Remove all the recorded rows"""
+        self._vars = []
+        self._constraints = []
+        self._mentions = []
+        with self.conn:
+            for table in ('vars', 'constraints', 'mentions'):
+                self.conn.execute("DELETE FROM %s" % table)
+
+    def add_var(self, name, sort, **fields):
+        """
+        Record a variable
+        :param name: the variable name
+        :param sort: the name of its sort
+        :param fields: the provenance, see PROVENANCE_FIELDS
+        """
+        self._vars.append([name, str(sort)] + _split_fields(fields))
+        self._maybe_flush()
+
+    def add_constraint(self, name, expr=None, folded=None, **fields):
+        """
+        Record a constraint and the variables it mentions
+        :param name: the constraint name
+        :param expr: the z3 expression, None for folded constraints
+        :param folded: the constant value if it's folded by partial evaluation
+        :param fields: the provenance, see PROVENANCE_FIELDS
+        """
+        self._constraints.append(
+            [name, None if folded is None else int(folded)] +
+            _split_fields(fields))
+        if expr is not None:
+            for var_name in expr_var_names(expr):
+                self._mentions.append((var_name, name))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._vars) + len(self._constraints) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows"""
+        with self.conn:
+            if self._vars:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO vars VALUES (?,?,?,?,?,?,?,?)",
+                    self._vars)
+            if self._constraints:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO constraints "
+                    "VALUES (?,?,?,?,?,?,?,?)", self._constraints)
+            if self._mentions:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO mentions VALUES (?,?)",
+                    self._mentions)
+        self._vars = []
+        self._constraints = []
+        self._mentions = []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def _query(self, sql, *args):
+        self.flush()
+        return [dict(row) for row in self.conn.execute(sql, args)]
+
+    def constraints_mentioning(self, var_name):
+        """The constraints that mention the given variable"""
+        return self._query(
+            "SELECT c.* FROM mentions m JOIN constraints c "
+            "ON c.name = m.constraint_name WHERE m.var = ? ORDER BY c.name",
+            var_name)
+
+    def vars_of(self, constraint_name):
+        """The variables mentioned by the given constraint"""
+        return self._query(
+            "SELECT v.* FROM mentions m JOIN vars v ON v.name = m.var "
+            "WHERE m.constraint_name = ? ORDER BY v.name", constraint_name)
+
+    def get_var(self, name):
+        """The provenance of a variable, None if it's not recorded"""
+        rows = self._query("SELECT * FROM vars WHERE name = ?", name)
+        return rows[0] if rows else None
+
+    def get_constraint(self, name):
+        """The provenance of a constraint, None if it's not recorded"""
+        rows = self._query("SELECT * FROM constraints WHERE name = ?", name)
+        return rows[0] if rows else None
+
+    def find(self, router=None, route_map=None, line=None, requirement=None,
+             kind='constraints'):
+        """
+        The variables or constraints created in the given part of the network
+        :param kind: 'vars' or 'constraints'
+        """
+        if kind not in ('vars', 'constraints'):
+            raise ValueError("Unknown kind '%s'" % kind)
+        where = []
+        args = []
+        for column, value in [('router', router), ('route_map', route_map),
+                              ('line', line), ('requirement', requirement)]:
+            if value is not None:
+                where.append('%s = ?' % column)
+                args.append(value)
+        sql = "SELECT * FROM %s" % kind
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self._query(sql + " ORDER BY name", *args)
+
+    def explain_core(self, names):
+        """The provenance of each constraint in an unsat core"""
+        return [self.get_constraint(name) or dict(name=name)
+                for name in names]
@@ -0,0 +1,151 @@
+"""
+Cone-of-influence slicing of the registered constraints: keep only the
+constraints connected (through shared variables and uninterpreted
+functions) to the requirements
+"""
+
+from collections import Counter
+from collections import OrderedDict
+
+import z3
+
+from synet.utils.smt_metrics import constraint_name_prefix
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# Name prefixes of the constraints generated from the requirements
+REQUIREMENT_PREFIXES = ('Req_Allow', 'Req_Block', 'SELECT_at')
+
+
+class ConeSlice(object):
+    """The constraints kept and dropped by cone_of_influence"""
+
+    def __init__(self, kept, dropped, num_roots, num_vars, num_cone_vars):
+        # Constraint names, in registration order
+        self.kept = kept
+        self.dropped = dropped
+        self.num_roots = num_roots
+        self.num_vars = num_vars
+        self.num_cone_vars = num_cone_vars
+
+    def report(self):
+        """Summary of the slice with the dropped constraints by name prefix"""
+        dropped = Counter(constraint_name_prefix(name) for name in self.dropped)
+        return OrderedDict([
+            ('num_roots', self.num_roots),
+            ('num_kept', len(self.kept)),
+            ('num_dropped', len(self.dropped)),
+            ('num_vars', self.num_vars),
+            ('num_cone_vars', self.num_cone_vars),
+            ('dropped_prefixes', OrderedDict(sorted(dropped.items()))),
+        ])
+
+
+def expr_dependencies(expr):
+    """
+    The names of the uninterpreted constants (the SMT variables) and
+    the uninterpreted functions (e.g., the compare and rank functions of
+    the enums) in a z3 expression. Two constraints applying the same
+    function depend on each other through its interpretation.
+    :return: set of var names and ('func', name) pairs
+    """
+    names = set()
+    seen = set()
+    todo = [expr]
+    while todo:
+        term = todo.pop()
+        term_id = term.get_id()
+        if term_id in seen:
+            continue
+        seen.add(term_id)
+        if z3.is_app(term):
+            decl = term.decl()
+            if decl.kind() == z3.Z3_OP_UNINTERPRETED:
+                if decl.arity() == 0:
+                    names.add(decl.name())
+                else:
+                    names.add(('func', decl.name()))
+            todo.extend(term.children())
+        elif z3.is_quantifier(term):
+            todo.append(term.body())
+    return names
+
+
+def cone_of_influence(constraints, root_prefixes=REQUIREMENT_PREFIXES,
+                      hole_vars=None):
+    """
+    Find the constraints that share variables or uninterpreted functions,
+    directly or transitively, with the root constraints
+    :param constraints: list of (name, z3 expression) in registration order
+    :param root_prefixes: constraints whose name start with one of these
+                          prefixes are roots
+    :param hole_vars: optional names of variables, the constraints that
+                      mention them are roots as well
+    :return: ConeSlice
+    """
+    hole_vars = set(hole_vars or [])
+    root_prefixes = tuple(root_prefixes)
+    var_consts = {}
+    const_vars = {}
+    todo = []
+    for name, expr in constraints:
+        names = expr_dependencies(expr)
+        const_vars[name] = names
+        for var in names:
+            var_consts.setdefault(var, []).append(name)
+        if name.startswith(root_prefixes) or names & hole_vars:
+            todo.append(name)
+    num_roots = len(todo)
+    cone = set(todo)
+    cone_vars = set()
+    while todo:
+        name = todo.pop()
+        for var in const_vars[name]:
+            if var in cone_vars:
+                continue
+            cone_vars.add(var)
+            for other in var_consts[var]:
+                if other not in cone:
+                    cone.add(other)
+                    todo.append(other)
+    kept = []
+    dropped = []
+    for name, _ in constraints:
+        (kept if name in cone else dropped).append(name)
+    return ConeSlice(kept, dropped, num_roots, len(var_consts),
+                     len(cone_vars))
+
+
+class SlicedModel(object):
+    """
+    The model of a formula checked in two slices that share no variables
+    or uninterpreted functions, the cone and the constraints outside of it. It provides the subset of
+    z3.ModelRef used to concretize SMTVars and read the model values.
+    """
+
+    def __init__(self, cone_model, outside_model):
+        self.cone_model = cone_model
+        self.outside_model = outside_model
+        self._outside_names = set(
+            decl.name() for decl in outside_model.decls())
+
+    def _model_of(self, name):
+        if name in self._outside_names:
+            return self.outside_model
+        return self.cone_model
+
+    def decls(self):
+        return self.cone_model.decls() + self.outside_model.decls()
+
+    def __getitem__(self, decl):
+        return self._model_of(decl.name())[decl]
+
+    def eval(self, expr, model_completion=False):
+        if z3.is_const(expr):
+            model = self._model_of(expr.decl().name())
+        else:
+            model = self.cone_model
+        return model.eval(expr, model_completion)
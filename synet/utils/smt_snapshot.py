@@ -0,0 +1,130 @@
+"""
+Snapshots of an encoded formula: the constraints, enum sorts, vars and
+constraint names of a SolverContext, saved to be solved again (replayed)
+without encoding the network again, see SolverContext.snapshot and
+SolverContext.from_snapshot
+"""
+
+import gzip
+import json
+
+from synet.utils.smt_dump import open_smt_file
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# Bump when the format of the snapshots changes
+SNAPSHOT_VERSION = 1
+
+# The sorts of the vars
+SORT_BOOL = 'bool'
+SORT_INT = 'int'
+SORT_BV = 'bv'
+SORT_ENUM = 'enum'
+
+
+def _str(value):
+    """z3 rejects unicode names read from JSON"""
+    return str(value) if isinstance(value, unicode) else value
+
+
+def _read_sort(vsort):
+    if isinstance(vsort, basestring):
+        return str(vsort)
+    return [str(vsort[0]), _str(vsort[1])]
+
+
+class FormulaSnapshot(object):
+    """The serializable state of an encoded SolverContext"""
+
+    def __init__(self, smt2, constraints, variables, enum_types,
+                 compares=None, false_constraints=None, selectors=None,
+                 bv_widths=None, fingerprint=None):
+        """
+        :param smt2: one SMT-LIB assertion per constraint, without the
+                     declarations
+        :param constraints: the names of the constraints, in the order of
+                            their assertions
+        :param variables: list of (name, sort, value), the sort is one of
+                          SORT_BOOL, SORT_INT, [SORT_BV, width], or
+                          [SORT_ENUM, enum name]. The value is None
+                          for the symbolic vars (holes)
+        :param enum_types: list of (enum type name, list of values)
+        :param compares: list of (enum type name, compare encoding)
+        :param false_constraints: the names of the constraints that are
+                                  always False
+        :param selectors: list of (selector var name, possible values)
+        :param bv_widths: see SolverContext.bv_widths
+        :param fingerprint: SolverContext.fingerprint() of the encoded
+                            formula, to map the results back to it
+        """
+        self.smt2 = smt2
+        self.constraints = constraints
+        self.variables = variables
+        self.enum_types = enum_types
+        self.compares = compares or []
+        self.false_constraints = false_constraints or []
+        self.selectors = selectors or []
+        self.bv_widths = bv_widths
+        self.fingerprint = fingerprint
+
+    @property
+    def holes(self):
+        """The names of the symbolic vars"""
+        return [name for name, _, value in self.variables if value is None]
+
+    def to_dict(self):
+        return dict(
+            version=SNAPSHOT_VERSION,
+            smt2=self.smt2,
+            constraints=self.constraints,
+            variables=self.variables,
+            enum_types=self.enum_types,
+            compares=self.compares,
+            false_constraints=self.false_constraints,
+            selectors=self.selectors,
+            bv_widths=self.bv_widths,
+            fingerprint=self.fingerprint,
+        )
+
+    @staticmethod
+    def from_dict(data):
+        if data.get('version') != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported snapshot version %s" %
+                             data.get('version'))
+        bv_widths = data['bv_widths']
+        if bv_widths is not None:
+            bv_widths = dict((str(attr), width) for attr, width
+                             in bv_widths.iteritems())
+        return FormulaSnapshot(
+            smt2=str(data['smt2']),
+            constraints=[str(name) for name in data['constraints']],
+            variables=[(str(name), _read_sort(vsort), _str(value))
+                       for name, vsort, value in data['variables']],
+            enum_types=[(str(name), [_str(value) for value in values])
+                        for name, values in data['enum_types']],
+            compares=[(str(name), str(encoding))
+                      for name, encoding in data['compares']],
+            false_constraints=[str(name) for name
+                               in data['false_constraints']],
+            selectors=[(str(name), values) for name, values
+                       in data['selectors']],
+            bv_widths=bv_widths,
+            fingerprint=data['fingerprint'])
+
+    def save(self, path):
+        """Write the snapshot as JSON (gzipped if path ends with '.gz')"""
+        with open_smt_file(path) as outf:
+            json.dump(self.to_dict(), outf)
+
+    @staticmethod
+    def load(path):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as inf:
+            return FormulaSnapshot.from_dict(json.load(inf))
+
+    def __repr__(self):
+        return "FormulaSnapshot(constraints=%d, holes=%d)" % (
+            len(self.constraints), len(self.holes))
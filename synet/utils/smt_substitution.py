@@ -0,0 +1,275 @@
+"""
+Equality substitution: merge the variables that the constraints
+force to be equal (var == var, var == value) with a union-find and
+replace each one with the representative of its class before solving
+"""
+
+from collections import OrderedDict
+
+import z3
+
+from synet.utils.smt_cache import read_model_values
+from synet.utils.smt_provenance import expr_var_names
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def _is_var(expr):
+    return z3.is_const(expr) and \
+        expr.decl().kind() == z3.Z3_OP_UNINTERPRETED
+
+
+def _is_value(expr):
+    """Int, bit-vector, bool, and enum values"""
+    if z3.is_int_value(expr) or z3.is_bv_value(expr) or \
+            z3.is_true(expr) or z3.is_false(expr):
+        return True
+    return z3.is_const(expr) and \
+        expr.decl().kind() == z3.Z3_OP_DT_CONSTRUCTOR
+
+
+def split_equalities(expr):
+    """
+    The equalities of a constraint that is only made of equalities between
+    vars and values, e.g., And(x == y), (x == 1) == True
+    :return: list of (lhs, rhs), None if the constraint is anything else
+    """
+    pairs = []
+    todo = [expr]
+    while todo:
+        term = todo.pop()
+        if z3.is_and(term):
+            todo.extend(term.children())
+        elif z3.is_eq(term):
+            lhs, rhs = term.children()
+            if z3.is_true(rhs) and z3.is_bool(lhs):
+                todo.append(lhs)
+            elif z3.is_true(lhs) and z3.is_bool(rhs):
+                todo.append(rhs)
+            elif (_is_var(lhs) or _is_value(lhs)) and \
+                    (_is_var(rhs) or _is_value(rhs)):
+                pairs.append((lhs, rhs))
+            else:
+                return None
+        else:
+            return None
+    return pairs
+
+
+class EqualitySubstitution(object):
+    """
+    Union-find over the vars of the equality constraints, each class is
+    represented by its value if it's bound to one, or one of its vars.
+    A class bound to two different values isn't substituted, the
+    constraints that merged or bound it are kept to make the formula unsat.
+    """
+
+    def __init__(self):
+        self._parent = {}  # Map a var name to its parent name
+        self._size = {}
+        self._consts = {}  # Map a var name to the z3 const
+        self._values = {}  # Map a root to the value of the class
+        # Map a root to the constraints that merged or bound the class
+        self._reasons = {}
+        # Roots of the classes bound to two different values
+        self._conflicting = set()
+        # Map the name of each added constraint to the names of its vars
+        self._added = OrderedDict()
+        # Names of the constraints equating two different values
+        self._false = set()
+        self._eliminated = None
+        self._absorbed = None
+
+    def _find(self, name):
+        root = name
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[name] != root:
+            self._parent[name], name = root, self._parent[name]
+        return root
+
+    def _add_var(self, var):
+        name = var.decl().name()
+        if name not in self._parent:
+            self._parent[name] = name
+            self._size[name] = 1
+            self._consts[name] = var
+            self._reasons[name] = []
+        return self._find(name)
+
+    def _bind(self, root, value, reason):
+        """Bind a class to a value, False on a conflict"""
+        self._reasons[root].append(reason)
+        current = self._values.get(root)
+        if current is None:
+            self._values[root] = value
+            return True
+        if current.eq(value):
+            return True
+        self._conflicting.add(root)
+        return False
+
+    def _union(self, root1, root2, reason):
+        """Merge two classes, False on a conflict"""
+        if root1 == root2:
+            self._reasons[root1].append(reason)
+            return True
+        if self._size[root1] < self._size[root2]:
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        self._size[root1] += self._size[root2]
+        self._reasons[root1].extend(self._reasons.pop(root2))
+        self._reasons[root1].append(reason)
+        if root2 in self._conflicting:
+            self._conflicting.discard(root2)
+            self._conflicting.add(root1)
+        value = self._values.pop(root2, None)
+        if value is None:
+            return root1 not in self._conflicting
+        current = self._values.setdefault(root1, value)
+        if current.eq(value):
+            return root1 not in self._conflicting
+        self._conflicting.add(root1)
+        return False
+
+    def add(self, name, expr):
+        """
+        Merge the classes of the equalities of a constraint
+        :return: True if the constraint is an equality constraint that
+                 doesn't bind a class to a second value (so far)
+        """
+        pairs = split_equalities(expr)
+        if pairs is None:
+            return False
+        self._eliminated = None
+        self._absorbed = None
+        var_names = []
+        for lhs, rhs in pairs:
+            var_names.extend(term.decl().name() for term in (lhs, rhs)
+                             if not _is_value(term))
+        self._added[name] = var_names
+        consistent = True
+        for lhs, rhs in pairs:
+            if _is_value(lhs) and _is_value(rhs):
+                if not lhs.eq(rhs):
+                    self._false.add(name)
+                    consistent = False
+            elif _is_value(lhs):
+                consistent = self._bind(self._add_var(rhs), lhs, name) and \
+                    consistent
+            elif _is_value(rhs):
+                consistent = self._bind(self._add_var(lhs), rhs, name) and \
+                    consistent
+            else:
+                consistent = self._union(self._add_var(lhs),
+                                         self._add_var(rhs), name) and \
+                    consistent
+        return consistent
+
+    def _is_conflicting(self, var_name):
+        return self._find(var_name) in self._conflicting
+
+    @property
+    def absorbed(self):
+        """
+        Names of the constraints replaced by the substitution, the ones
+        of the classes bound to two different values are kept
+        """
+        if self._absorbed is None:
+            self._absorbed = [
+                name for name, var_names in self._added.iteritems()
+                if name not in self._false and
+                not any(self._is_conflicting(var) for var in var_names)]
+        return self._absorbed
+
+    @property
+    def conflicts(self):
+        """
+        Names of the equality constraints of the classes bound to two
+        different values, they're kept in the formula to make it unsat
+        """
+        absorbed = set(self.absorbed)
+        return [name for name in self._added if name not in absorbed]
+
+    @property
+    def eliminated(self):
+        """Map the name of each replaced var to (z3 const, representative)"""
+        if self._eliminated is None:
+            self._eliminated = OrderedDict()
+            for name, const in self._consts.iteritems():
+                root = self._find(name)
+                if root in self._conflicting:
+                    continue
+                rep = self._values.get(root, self._consts[root])
+                if not rep.eq(const):
+                    self._eliminated[name] = (const, rep)
+        return self._eliminated
+
+    def substitute(self, expr):
+        """Replace the vars of the expression by their representatives"""
+        eliminated = self.eliminated
+        pairs = [eliminated[name] for name in expr_var_names(expr)
+                 if name in eliminated]
+        if not pairs:
+            return expr
+        return z3.substitute(expr, *pairs)
+
+    def reasons(self, var_names):
+        """
+        The names of the constraints that merged or bound the classes
+        of the given vars, i.e., that justify their substitution
+        """
+        names = []
+        seen = set()
+        for var in var_names:
+            if var not in self._parent:
+                continue
+            root = self._find(var)
+            if root in seen or root in self._conflicting:
+                # The constraints of a conflicting class aren't replaced
+                continue
+            seen.add(root)
+            names.extend(self._reasons[root])
+        return names
+
+    def report(self):
+        """Summary of the substitution"""
+        return OrderedDict([
+            ('num_absorbed', len(self.absorbed)),
+            ('num_conflicts', len(self.conflicts)),
+            ('num_vars', len(self._parent)),
+            ('num_eliminated', len(self.eliminated)),
+        ])
+
+
+class SubstitutedModel(object):
+    """
+    A z3 model of the substituted formula that evaluates the replaced vars
+    as their representatives. It provides the subset of z3.ModelRef used
+    to concretize SMTVars.
+    """
+
+    def __init__(self, model, substitution):
+        self.model = model
+        self.substitution = substitution
+
+    def eval(self, expr, model_completion=False):
+        if z3.is_const(expr):
+            entry = self.substitution.eliminated.get(expr.decl().name())
+            if entry is not None:
+                expr = entry[1]
+        return self.model.eval(expr, model_completion)
+
+    def values(self):
+        """
+        The values of all the constants, including the replaced vars,
+        see smt_cache.read_model_values
+        """
+        values = read_model_values(self.model)
+        for name, (_, rep) in self.substitution.eliminated.iteritems():
+            value = self.model.eval(rep)
+            if _is_value(value):
+                values[name] = str(value)
+        return values
@@ -0,0 +1,84 @@
+"""
+Named z3 tactic pipelines applied to the formulas before solving
+"""
+
+import z3
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# Name recorded in the metrics when the default z3 solver is used
+DEFAULT_TACTIC = 'default'
+
+# Tactics that decide the goal, a pipeline must end with one of them
+SOLVING_TACTICS = ('smt', 'qflia', 'qflra', 'qfbv', 'qfnia', 'qfnra',
+                   'qfuf', 'qfufbv', 'qfauflia', 'qfaufbv')
+
+# Cheap preprocessing for formulas dominated by equalities and
+# concretely evaluated terms
+_PREPROCESS = ('simplify', 'propagate-values', 'solve-eqs', 'elim-uncnstr')
+
+TACTIC_PRESETS = {
+    # BGP formulas mix enums, uninterpreted compare functions and ints
+    'fast-bgp': _PREPROCESS + ('simplify', 'smt'),
+    # OSPF formulas are linear integer arithmetic over the link costs
+    'ospf-lia': _PREPROCESS + ('qflia',),
+}
+
+
+def resolve_tactic(tactic):
+    """
+    Get the chain of tactic names
+    :param tactic: None for the default solver, a preset name,
+                   a comma separated chain, or a list of tactic names
+    :return: tuple of tactic names or None
+    """
+    if not tactic or tactic == DEFAULT_TACTIC:
+        return None
+    if isinstance(tactic, basestring):
+        if tactic in TACTIC_PRESETS:
+            return TACTIC_PRESETS[tactic]
+        tactic = [name.strip() for name in tactic.split(',')]
+    chain = tuple(tactic)
+    known = z3.tactics()
+    for name in chain:
+        if name not in known:
+            raise ValueError("Unknown z3 tactic '%s' in %s" % (name, chain))
+    if chain[-1] not in SOLVING_TACTICS:
+        chain += ('smt',)
+    return chain
+
+
+def tactic_name(tactic):
+    """The name of the tactic pipeline as it's recorded in the metrics"""
+    if isinstance(tactic, basestring) and tactic in TACTIC_PRESETS:
+        return tactic
+    chain = resolve_tactic(tactic)
+    if chain is None:
+        return DEFAULT_TACTIC
+    return ','.join(chain)
+
+
+def create_solver(tactic=None, ctx=None, unsat_core=False, params=None):
+    """
+    Create a z3 solver that applies the tactic pipeline before solving
+    :param tactic: see resolve_tactic
+    :param ctx: z3 context, z3 main context if None
+    :param unsat_core: the solver is used to read unsat cores,
+                       tactics drop the tracking literals otherwise
+    :param params: optional dict of z3 solver parameters
+    :return: z3.Solver
+    """
+    chain = resolve_tactic(tactic)
+    if chain is None:
+        solver = z3.Solver(ctx=ctx)
+    else:
+        solver = z3.Then(
+            *[z3.Tactic(name, ctx=ctx) for name in chain]).solver()
+        if unsat_core:
+            solver.set(unsat_core=True)
+    for key, value in (params or {}).iteritems():
+        solver.set(key, value)
+    return solver
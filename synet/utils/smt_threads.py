@@ -0,0 +1,264 @@
+"""
+Solve independent z3 contexts concurrently on a pool of threads.
+z3 releases the GIL while checking, so the contexts are solved in parallel
+without serializing the formulas to other processes. A z3 context must
+only be used by one thread at a time, the jobs are checked for shared
+contexts (and expressions created in another context) before starting.
+Two SolverContexts must not share a z3 context either: z3 creates a
+single term for the vars of the same name and sort in a context, so
+their vars can't be told apart.
+"""
+
+import ctypes
+import threading
+from Queue import Queue
+from timeit import default_timer as timer
+
+import z3
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# Held while using the global z3 context (e.g., by the OSPF stage),
+# it's shared by all the threads
+GLOBAL_CONTEXT_LOCK = threading.RLock()
+
+
+def _ptr(ast):
+    """The address of a z3 AST, unique among the live ASTs of all contexts"""
+    return ctypes.cast(ast, ctypes.c_void_p).value
+
+
+def _ctx_ptr(z3_ctx):
+    return _ptr(z3_ctx.ref())
+
+
+def _own_sort(smt_ctx, sort):
+    """
+    The sort of the same kind created in the context of smt_ctx,
+    None if it can't be rebuilt
+    """
+    z3_ctx = smt_ctx.z3_ctx
+    kind = sort.kind()
+    if kind == z3.Z3_BOOL_SORT:
+        return z3.BoolSort(ctx=z3_ctx)
+    elif kind == z3.Z3_INT_SORT:
+        return z3.IntSort(ctx=z3_ctx)
+    elif kind == z3.Z3_REAL_SORT:
+        return z3.RealSort(ctx=z3_ctx)
+    elif kind == z3.Z3_BV_SORT:
+        return z3.BitVecSort(sort.size(), ctx=z3_ctx)
+    elif kind == z3.Z3_DATATYPE_SORT:
+        try:
+            return smt_ctx.get_enum_type(sort.name()).sort
+        except KeyError:
+            return None
+    return None
+
+
+def foreign_terms(smt_ctx, expr, own_sorts=None):
+    """
+    The sub terms of the expression that don't belong to smt_ctx: terms of
+    another z3 context, and the vars and enum values of another
+    SolverContext. z3py rejects most expressions mixing z3 contexts, but
+    not the ones mixing two SolverContexts created on the same z3 context.
+    Only the vars (and enum types) of the other SolverContext whose names
+    aren't used by smt_ctx are found: z3 hash-conses the constants and
+    sorts, so a var of the same name and sort is the very same term in
+    both (e.g., x0 of two SolverContexts that created the same number of
+    vars). Don't share a z3 context between SolverContexts, check_jobs
+    rejects it.
+    :param smt_ctx: SolverContext
+    :param own_sorts: optional dict to cache the sorts of the context
+                      between calls
+    :return: list of z3 terms
+    """
+    if expr.ctx != smt_ctx.z3_ctx:
+        return [expr]
+    own_sorts = {} if own_sorts is None else own_sorts
+    foreign = []
+    seen = set()
+    todo = [expr]
+    while todo:
+        term = todo.pop()
+        addr = _ptr(term.as_ast())
+        if addr in seen:
+            continue
+        seen.add(addr)
+        sort = term.sort()
+        sort_addr = _ptr(sort.as_ast())
+        if sort_addr not in own_sorts:
+            own = _own_sort(smt_ctx, sort)
+            own_sorts[sort_addr] = own is None or \
+                _ptr(own.as_ast()) == sort_addr
+        if not own_sorts[sort_addr]:
+            foreign.append(term)
+            continue
+        if not z3.is_app(term):
+            continue
+        if z3.is_const(term) and \
+                term.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+            var = smt_ctx._vars.get(term.decl().name())
+            if var is None or var.get_var() is None or \
+                    _ptr(var.get_var().as_ast()) != addr:
+                foreign.append(term)
+            continue
+        todo.extend(term.children())
+    return foreign
+
+
+def check_context(smt_ctx, solver=None, deep=True):
+    """
+    Make sure the solver and the registered constraints belong to the z3
+    context of smt_ctx, raises ValueError otherwise
+    :param solver: optional z3.Solver
+    :param deep: also look for terms of other contexts nested in the
+                 constraints (see foreign_terms)
+    """
+    if solver is not None and solver.ctx != smt_ctx.z3_ctx:
+        raise ValueError("Z3 Solver is not attached to the same Z3 context")
+    own_sorts = {}
+    for name, const in smt_ctx.constraints_itr():
+        if const.ctx != smt_ctx.z3_ctx:
+            raise ValueError(
+                "Constraint '%s' is not attached to the same Z3 context" %
+                name)
+        if not deep:
+            continue
+        foreign = foreign_terms(smt_ctx, const, own_sorts)
+        if foreign:
+            raise ValueError(
+                "Constraint '%s' uses terms of another Z3 context: %s" % (
+                    name, ', '.join(str(term) for term in foreign[:5])))
+
+
+class SolveJob(object):
+    """A prepared SolverContext and solver to check, and its outcome"""
+
+    def __init__(self, smt_ctx, solver=None, **check_args):
+        """
+        :param smt_ctx: SolverContext
+        :param solver: z3.Solver of the same context, one is created with
+                       smt_ctx.create_solver if None
+        :param check_args: passed to SolverContext.check
+        """
+        self.smt_ctx = smt_ctx
+        self.solver = solver
+        self.check_args = check_args
+        # z3.sat, z3.unsat, or z3.unknown, None if the check raised
+        self.result = None
+        self.metrics = None
+        self.error = None
+        self.elapsed = None
+
+    def run(self):
+        if self.solver is None:
+            self.solver = self.smt_ctx.create_solver()
+        self.result = self.smt_ctx.check(self.solver, **self.check_args)
+        self.metrics = self.smt_ctx.last_metrics
+        return self.result
+
+    def __repr__(self):
+        return "SolveJob(result=%s, elapsed=%s, error=%s)" % (
+            self.result, self.elapsed, self.error)
+
+
+def check_shared_contexts(smt_ctxs):
+    """
+    Make sure the SolverContexts don't share a z3 context, raises
+    ValueError otherwise. Their vars of the same name would be the same
+    terms, which the other checks can't detect (see foreign_terms).
+    :param smt_ctxs: list of SolverContext
+    """
+    contexts = {}
+    for index, smt_ctx in enumerate(smt_ctxs):
+        addr = _ctx_ptr(smt_ctx.z3_ctx)
+        if addr in contexts:
+            raise ValueError("Jobs %d and %d share the same Z3 context" % (
+                contexts[addr], index))
+        contexts[addr] = index
+
+
+def check_jobs(jobs, deep=True):
+    """
+    Make sure the jobs don't share z3 contexts, solvers, or expressions,
+    raises ValueError otherwise
+    :param jobs: list of SolveJob
+    :param deep: see check_context
+    """
+    check_shared_contexts([job.smt_ctx for job in jobs])
+    for job in jobs:
+        check_context(job.smt_ctx, job.solver, deep)
+
+
+def run_concurrently(tasks, num_threads=None):
+    """
+    Call each task on a pool of threads
+    :param tasks: list of callables without arguments
+    :param num_threads: the size of the pool, one thread per task if None
+    :return: list of (return value, exception, elapsed seconds)
+             in the order of the tasks
+    """
+    num_threads = min(num_threads or len(tasks), len(tasks))
+    # z3 creates the global context lazily, don't let the threads race on it
+    z3.main_ctx()
+    results = [None] * len(tasks)
+    queue = Queue()
+    for index in range(len(tasks)):
+        queue.put(index)
+
+    def worker():
+        while True:
+            index = queue.get()
+            if index is None:
+                return
+            start = timer()
+            try:
+                ret = tasks[index]()
+                results[index] = (ret, None, timer() - start)
+            except Exception as exp:
+                results[index] = (None, exp, timer() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+    for thread in threads:
+        queue.put(None)
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _run_job(job):
+    if job.smt_ctx.z3_ctx == z3.main_ctx():
+        with GLOBAL_CONTEXT_LOCK:
+            return job.run()
+    return job.run()
+
+
+def solve_concurrently(jobs, num_threads=None, guard=True):
+    """
+    Check independent SolverContexts concurrently
+    :param jobs: list of SolveJob, or (SolverContext, z3.Solver) pairs
+    :param num_threads: the size of the pool, one thread per job if None
+    :param guard: check the jobs don't share expressions before starting
+                  (see check_jobs), jobs sharing a z3 context are always
+                  rejected
+    :return: list of SolveJob with the result, metrics, or error of each
+    """
+    jobs = [job if isinstance(job, SolveJob) else SolveJob(*job)
+            for job in jobs]
+    if not jobs:
+        return jobs
+    if guard:
+        check_jobs(jobs)
+    else:
+        check_shared_contexts([job.smt_ctx for job in jobs])
+    outcomes = run_concurrently(
+        [lambda job=job: _run_job(job) for job in jobs], num_threads)
+    for job, (_, error, elapsed) in zip(jobs, outcomes):
+        job.error = error
+        job.elapsed = elapsed
+    return jobs
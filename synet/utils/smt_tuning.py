@@ -0,0 +1,230 @@
+"""
+Pick the z3 tactic and parameters per class of problems, from the results
+of replaying a corpus of dumped formulas (see synet.drivers.smt_tune)
+"""
+
+import gzip
+import itertools
+import json
+import os
+import random
+import re
+from timeit import default_timer as timer
+
+import z3
+
+from synet.utils.smt_tactics import create_solver
+from synet.utils.smt_tactics import tactic_name
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# The kinds of formulas
+KIND_BGP = 'bgp'
+KIND_OSPF = 'ospf'
+
+# (max number of holes, bucket name), the last bucket has no bound
+HOLE_BUCKETS = ((100, 'small'), (1000, 'medium'), (None, 'large'))
+
+# The search space of the tuner
+TUNING_TACTICS = {
+    KIND_BGP: [None, 'fast-bgp'],
+    KIND_OSPF: [None, 'ospf-lia'],
+}
+TUNING_PARAMS = [
+    ('phase_selection', [3, 0, 2]),
+    ('restart_strategy', [1, 0]),
+    ('relevancy', [2, 0]),
+    ('arith.solver', [2, 6]),
+]
+
+# Environment variable with the tuning file picked up by default
+TUNING_ENV = 'SYNET_TUNING'
+
+# The first line of the dumped formulas, it records what's needed to
+# classify them the same way when tuning and when solving
+_PROBLEM_HEADER = '; synet-problem kind=%s holes=%d\n'
+_PROBLEM_HEADER_RE = re.compile(r'^; synet-problem kind=(\w+) holes=(\d+)$',
+                                re.MULTILINE)
+
+
+def problem_class(kind, num_holes):
+    """
+    The class of a problem
+    :param kind: KIND_BGP or KIND_OSPF
+    :param num_holes: the number of holes, the symbolic variables the
+                      solver assigns: SolverContext.num_holes for BGP and
+                      OSPFSyn.num_holes (the symbolic link costs) for OSPF
+    :return: e.g., 'bgp-medium'
+    """
+    for bound, bucket in HOLE_BUCKETS:
+        if bound is None or num_holes <= bound:
+            return '%s-%s' % (kind, bucket)
+
+
+def problem_header(kind, num_holes):
+    """The header (an SMT-LIB comment) of a dumped formula"""
+    return _PROBLEM_HEADER % (kind, num_holes)
+
+
+def read_problem_header(smt2):
+    """
+    Read the header written by problem_header in a dumped formula,
+    the declarations can't tell the holes from the other constants
+    (e.g., the tracking literals)
+    :return: (kind, number of holes)
+    """
+    match = _PROBLEM_HEADER_RE.search(smt2, 0, 1024)
+    if match is None:
+        raise ValueError("The formula has no synet-problem header, dump it "
+                         "again with SolverContext.check(out_smt=...) or "
+                         "SynthesisComponent.out_smt")
+    return match.group(1), int(match.group(2))
+
+
+def candidate_configs(kind, strategy='grid', num_samples=20, seed=0):
+    """
+    The configurations to try, the default z3 solver is always the first
+    :param kind: KIND_BGP or KIND_OSPF
+    :param strategy: 'grid' for all the combinations or 'random' to
+                     sample num_samples of them
+    :return: list of dicts with 'tactic' and 'params'
+    """
+    names = [name for name, _ in TUNING_PARAMS]
+    grid = []
+    for tactic in TUNING_TACTICS[kind]:
+        for values in itertools.product(*[vals for _, vals in TUNING_PARAMS]):
+            grid.append(dict(tactic=tactic, params=dict(zip(names, values))))
+    default = dict(tactic=None, params={})
+    if strategy == 'grid':
+        return [default] + grid
+    elif strategy == 'random':
+        rand = random.Random(seed)
+        return [default] + rand.sample(grid, min(num_samples, len(grid)))
+    raise ValueError("Unknown search strategy '%s'" % strategy)
+
+
+def time_config(smt2, config, timeout=None):
+    """
+    Solve the formula with the given configuration in a fresh z3 context
+    :param timeout: in ms
+    :return: (result as a string, solve time in seconds)
+    """
+    ctx = z3.Context()
+    solver = create_solver(config['tactic'], ctx=ctx,
+                           params=config['params'])
+    if timeout:
+        solver.set('timeout', timeout)
+    solver.add(z3.parse_smt2_string(smt2, ctx=ctx))
+    t1 = timer()
+    ret = solver.check()
+    return str(ret), timer() - t1
+
+
+def read_formula(path):
+    """Read a formula dumped by SolverContext.check(out_smt=...)"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as inf:
+        return inf.read()
+
+
+class Tuning(object):
+    """The best configuration per class of problems"""
+
+    def __init__(self, classes=None):
+        # Map a class to a dict with 'tactic', 'params', and the stats
+        self.classes = classes or {}
+
+    def lookup(self, kind, num_holes):
+        """
+        The configuration of the class of a problem
+        :return: dict with 'tactic' and 'params', or None
+        """
+        entry = self.classes.get(problem_class(kind, num_holes))
+        if entry is None:
+            return None
+        # z3 rejects unicode parameter names read from JSON
+        tactic = entry['tactic']
+        return dict(tactic=str(tactic) if tactic else None,
+                    params=dict((str(key), value) for key, value
+                                in entry['params'].iteritems()))
+
+    def set_class(self, name, config, **stats):
+        entry = dict(tactic=config['tactic'], params=config['params'])
+        entry.update(stats)
+        self.classes[name] = entry
+
+    def save(self, path):
+        with open(path, 'w') as outf:
+            json.dump(self.classes, outf, indent=2, sort_keys=True)
+
+    @staticmethod
+    def load(path):
+        with open(path) as inf:
+            return Tuning(json.load(inf))
+
+
+def tune(formulas, kind, strategy='grid', num_samples=20, timeout=60000,
+         seed=0, log=None):
+    """
+    Replay the formulas under each candidate configuration and pick the
+    fastest configuration for each class of problems
+    :param formulas: list of (name, SMT-LIB formula)
+    :param kind: KIND_BGP or KIND_OSPF
+    :param timeout: in ms, a timeout counts as twice the timeout
+    :param log: optional callable(msg) to report the progress
+    :return: Tuning
+    """
+    configs = candidate_configs(kind, strategy, num_samples, seed)
+    by_class = {}
+    for name, smt2 in formulas:
+        formula_kind, num_holes = read_problem_header(smt2)
+        if formula_kind != kind:
+            raise ValueError("Formula %s is a %s formula, not %s" % (
+                name, formula_kind, kind))
+        by_class.setdefault(
+            problem_class(kind, num_holes), []).append((name, smt2))
+    tuning = Tuning()
+    for class_name, problems in sorted(by_class.iteritems()):
+        best = None
+        default_time = None
+        for config in configs:
+            total = 0
+            for name, smt2 in problems:
+                ret, seconds = time_config(smt2, config, timeout)
+                if ret == str(z3.unknown):
+                    seconds = 2 * timeout / 1000.0
+                total += seconds
+                if log:
+                    log("%s %s %s %s: %s %f" % (
+                        class_name, name, tactic_name(config['tactic']),
+                        config['params'], ret, seconds))
+                if best is not None and total >= best[0]:
+                    # Already slower than the best
+                    break
+            if default_time is None:
+                default_time = total
+            if best is None or total < best[0]:
+                best = (total, config)
+        tuning.set_class(class_name, best[1], total_time=best[0],
+                         default_time=default_time,
+                         num_problems=len(problems))
+    return tuning
+
+
+_default_tuning = {}
+
+
+def default_tuning():
+    """
+    The Tuning read from the file in the SYNET_TUNING environment variable,
+    None if it's not set
+    """
+    path = os.environ.get(TUNING_ENV)
+    if not path:
+        return None
+    if path not in _default_tuning:
+        _default_tuning[path] = Tuning.load(path)
+    return _default_tuning[path]
@@ -0,0 +1,196 @@
+"""
+Level gated tracing for the synthesis subsystems.
+
+Each subsystem has its own tracer and level, messages below the level are
+dropped before they're formatted. The levels are configured with
+configure() or the SYNET_TRACE environment variable, e.g.,
+SYNET_TRACE="smt=debug,policy=trace,jsonl=/tmp/trace.jsonl"
+"""
+
+import json
+import logging
+import os
+import sys
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# Finer than logging.DEBUG, used inside the inner loops
+TRACE = 5
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+OFF = logging.CRITICAL + 10
+
+LEVELS = {
+    'trace': TRACE,
+    'debug': DEBUG,
+    'info': INFO,
+    'warning': WARNING,
+    'off': OFF,
+}
+
+# The subsystems that can be traced
+SMT = 'smt'
+POLICY = 'policy'
+BGP = 'bgp'
+PROPAGATION = 'propagation'
+NETCOMPLETE = 'netcomplete'
+OSPF = 'ospf'
+SUBSYSTEMS = (SMT, POLICY, BGP, PROPAGATION, NETCOMPLETE, OSPF)
+
+# The level of the subsystems that aren't configured, inner loops trace
+# at DEBUG or TRACE so nothing is emitted from them by default
+DEFAULT_LEVEL = INFO
+
+# The parent of all the tracing loggers
+ROOT_LOGGER = 'synet.trace'
+
+logging.addLevelName(TRACE, 'TRACE')
+
+
+class Tracer(object):
+    """Emit the trace messages of a single subsystem"""
+
+    def __init__(self, subsystem, level=DEFAULT_LEVEL):
+        self.subsystem = subsystem
+        self.logger = logging.getLogger('%s.%s' % (ROOT_LOGGER, subsystem))
+        self.level = level
+
+    def enabled(self, level):
+        """True if messages of the given level are emitted"""
+        return level >= self.level
+
+    def log(self, level, msg, *args, **fields):
+        """
+        Emit a message, msg % args is only computed if it's emitted
+        :param fields: extra structured fields for the JSON-lines sink
+        """
+        if level < self.level:
+            return
+        self.logger.log(level, msg, *args,
+                        extra={'subsystem': self.subsystem,
+                               'fields': fields})
+
+    def trace(self, msg, *args, **fields):
+        if TRACE >= self.level:
+            self.log(TRACE, msg, *args, **fields)
+
+    def debug(self, msg, *args, **fields):
+        if DEBUG >= self.level:
+            self.log(DEBUG, msg, *args, **fields)
+
+    def info(self, msg, *args, **fields):
+        if INFO >= self.level:
+            self.log(INFO, msg, *args, **fields)
+
+    def warning(self, msg, *args, **fields):
+        if WARNING >= self.level:
+            self.log(WARNING, msg, *args, **fields)
+
+
+class JSONLinesHandler(logging.Handler):
+    """Write each trace message as a JSON object per line"""
+
+    def __init__(self, out):
+        """
+        :param out: a filename (appended to) or a file like object
+        """
+        super(JSONLinesHandler, self).__init__()
+        if isinstance(out, basestring):
+            out = open(out, 'a')
+        self.out = out
+
+    def emit(self, record):
+        try:
+            entry = dict(time=record.created,
+                         subsystem=getattr(record, 'subsystem', record.name),
+                         level=record.levelname,
+                         msg=record.getMessage())
+            fields = getattr(record, 'fields', None)
+            if fields:
+                entry['fields'] = dict(
+                    (key, value if isinstance(value, (int, long, float, bool))
+                     else str(value)) for key, value in fields.iteritems())
+            self.out.write(json.dumps(entry) + '\n')
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.out.flush()
+
+    def close(self):
+        self.flush()
+        super(JSONLinesHandler, self).close()
+
+
+_tracers = {}
+
+
+def get_tracer(subsystem):
+    """Get the tracer of a subsystem"""
+    if subsystem not in _tracers:
+        _tracers[subsystem] = Tracer(subsystem)
+    return _tracers[subsystem]
+
+
+def set_level(subsystem, level):
+    """
+    Set the level of a subsystem
+    :param subsystem: the subsystem name, or '*' for all of them
+    :param level: one of the level constants or their names
+    """
+    if isinstance(level, basestring):
+        level = LEVELS[level.lower()]
+    if subsystem == '*':
+        for name in set(SUBSYSTEMS) | set(_tracers.keys()):
+            get_tracer(name).level = level
+    else:
+        get_tracer(subsystem).level = level
+
+
+def set_sink(handler):
+    """
+    Replace the output of the tracers with the given logging.Handler
+    """
+    logger = logging.getLogger(ROOT_LOGGER)
+    for old in logger.handlers[:]:
+        logger.removeHandler(old)
+        old.close()
+    logger.addHandler(handler)
+
+
+def configure(spec):
+    """
+    Configure the tracers from a spec string
+    :param spec: comma separated subsystem=level, '*=level' sets all the
+                 subsystems, and 'jsonl=filename' writes JSON lines
+    """
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key, value = item.split('=', 1)
+        if key == 'jsonl':
+            set_sink(JSONLinesHandler(value))
+        else:
+            set_level(key, value)
+
+
+def _setup():
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(TRACE)
+    # Don't duplicate the trace in the application logs
+    logger.propagate = False
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    for subsystem in SUBSYSTEMS:
+        get_tracer(subsystem)
+    if os.environ.get('SYNET_TRACE'):
+        configure(os.environ['SYNET_TRACE'])
+
+
+_setup()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+"""
+Tests of the constraints folded to constants by the SolverContext
+"""
+
+import unittest
+
+import z3
+
+from synet.utils.fnfree_smt_context import SolverContext
+from synet.utils.tracing import SMT
+from synet.utils.tracing import WARNING
+from synet.utils.tracing import set_level
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def setUpModule():
+    set_level(SMT, WARNING)
+
+
+class FoldedConstraintsTest(unittest.TestCase):
+    def test_false_constraints_core(self):
+        ctx = SolverContext(z3.Context())
+        var = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx),
+                                   name_prefix='v')
+        ctx.register_constraint(var.var == 1, name='eq_one')
+        ctx.register_constraint(False, name='never', router='R1')
+        ctx.register_constraint(True, name='always')
+        solver = ctx.create_solver()
+        self.assertEqual(ctx.check(solver), z3.unsat)
+        self.assertEqual(ctx.unsat_core(solver), ['never'])
+
+    def test_folded_constraints_info(self):
+        ctx = SolverContext(z3.Context())
+        ctx.register_constraint(False, name='never', router='R1')
+        ctx.register_constraint(True, name='always')
+        self.assertEqual(ctx.get_constraints_info('never'), {'router': 'R1'})
+        self.assertEqual(ctx.get_constraints_info('always'), {})
+        with self.assertRaises(ValueError):
+            ctx.get_constraints_info('missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""
+Tests of the cone-of-influence slicing of the SolverContext formulas
+"""
+
+import unittest
+
+import z3
+
+from synet.utils.fnfree_smt_context import SolverContext
+from synet.utils.tracing import SMT
+from synet.utils.tracing import WARNING
+from synet.utils.tracing import set_level
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def setUpModule():
+    set_level(SMT, WARNING)
+
+
+class ConeSlicingTest(unittest.TestCase):
+    def _create_context(self, num_vars):
+        ctx = SolverContext(z3.Context())
+        int_sort = z3.IntSort(ctx=ctx.z3_ctx)
+        variables = [ctx.create_fresh_var(int_sort, name_prefix='v')
+                     for _ in range(num_vars)]
+        return ctx, variables
+
+    def test_disjoint_slices(self):
+        ctx, (a, b, c, d) = self._create_context(4)
+        ctx.register_constraint(a.var > b.var, name_prefix='Req_Allow_')
+        ctx.register_constraint(b.var > 2, name_prefix='link_')
+        ctx.register_constraint(c.var + d.var == 7, name_prefix='other_')
+        ctx.register_constraint(d.var > 10, name_prefix='other_')
+        cone = ctx.slice_cone()
+        self.assertEqual(cone.kept, ['Req_Allow_0', 'link_1'])
+        self.assertEqual(cone.dropped, ['other_2', 'other_3'])
+        solver = ctx.create_solver()
+        self.assertEqual(ctx.check(solver, cone=True), z3.sat)
+        self.assertGreater(a.get_value(), b.get_value())
+        self.assertEqual(c.get_value() + d.get_value(), 7)
+        self.assertGreater(d.get_value(), 10)
+
+    def test_slices_linked_by_function(self):
+        ctx, (a, b) = self._create_context(2)
+        int_sort = z3.IntSort(ctx=ctx.z3_ctx)
+        func = z3.Function('f', int_sort, int_sort)
+        ctx.register_constraint(z3.And(a.var == 0, func(a.var) == 1, ctx.z3_ctx),
+                                name_prefix='Req_Allow_')
+        ctx.register_constraint(z3.And(b.var == 0, func(b.var) == 2, ctx.z3_ctx),
+                                name_prefix='other_')
+        cone = ctx.slice_cone()
+        self.assertEqual(cone.dropped, [])
+        self.assertEqual(ctx.check(ctx.create_solver(), cone=False), z3.unsat)
+        self.assertEqual(ctx.check(ctx.create_solver(), cone=True), z3.unsat)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+Tests of the equality substitution of the SolverContext formulas
+"""
+
+import unittest
+
+import z3
+
+from synet.utils.fnfree_smt_context import SolverContext
+from synet.utils.smt_substitution import EqualitySubstitution
+from synet.utils.tracing import SMT
+from synet.utils.tracing import WARNING
+from synet.utils.tracing import set_level
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def setUpModule():
+    set_level(SMT, WARNING)
+
+
+class EqualitySubstitutionTest(unittest.TestCase):
+    def _create_context(self, num_vars):
+        ctx = SolverContext(z3.Context())
+        int_sort = z3.IntSort(ctx=ctx.z3_ctx)
+        variables = [ctx.create_fresh_var(int_sort, name_prefix='v')
+                     for _ in range(num_vars)]
+        return ctx, variables
+
+    def test_conflicting_values_unsat(self):
+        ctx, (x, y) = self._create_context(2)
+        ctx.register_constraint(x.var == 3, name_prefix='bind_')
+        ctx.register_constraint(y.var == 5, name_prefix='bind_')
+        ctx.register_constraint(x.var == y.var, name_prefix='merge_')
+        self.assertEqual(ctx.check(ctx.create_solver(), substitute=False),
+                         z3.unsat)
+        solver = ctx.create_solver()
+        self.assertEqual(ctx.check(solver, substitute=True), z3.unsat)
+        self.assertEqual(sorted(ctx.unsat_core(solver)),
+                         ['bind_0', 'bind_1', 'merge_2'])
+
+    def test_conflicting_class_not_eliminated(self):
+        ctx, (x, y, z) = self._create_context(3)
+        ctx.register_constraint(x.var == y.var, name_prefix='merge_')
+        ctx.register_constraint(y.var == 5, name_prefix='bind_')
+        ctx.register_constraint(z.var == 3, name_prefix='bind_')
+        ctx.register_constraint(x.var == z.var, name_prefix='merge_')
+        substitution = ctx.substitute_equalities()
+        self.assertEqual(substitution.absorbed, [])
+        self.assertEqual(len(substitution.conflicts), 4)
+        self.assertEqual(len(substitution.eliminated), 0)
+
+    def test_consistent_values_sat(self):
+        ctx, (x, y, z) = self._create_context(3)
+        ctx.register_constraint(x.var == 3, name_prefix='bind_')
+        ctx.register_constraint(x.var == y.var, name_prefix='merge_')
+        ctx.register_constraint(z.var > y.var, name_prefix='req_')
+        solver = ctx.create_solver()
+        self.assertEqual(ctx.check(solver, substitute=True), z3.sat)
+        self.assertEqual([x.get_value(), y.get_value()], [3, 3])
+        self.assertGreater(z.get_value(), 3)
+
+    def test_false_value_equality_kept(self):
+        z3_ctx = z3.Context()
+        substitution = EqualitySubstitution()
+        three = z3.IntVal(3, ctx=z3_ctx)
+        five = z3.IntVal(5, ctx=z3_ctx)
+        substitution.add('false_0', three == five)
+        self.assertEqual(substitution.absorbed, [])
+        self.assertEqual(substitution.conflicts, ['false_0'])
+
+
+if __name__ == '__main__':
+    unittest.main()